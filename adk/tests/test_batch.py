@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+from trac.runtime import scheduler
+from trac.runtime.base import JOB_STATUS
+from trac.runtime.batch import expand_parameter_grid, run_batch
+from trac.runtime.scheduler import JobScheduler
+from trac.schema.task import TaskDef
+
+
+def test_expand_parameter_grid():
+    grid = {"forecast_length": [7, 14], "num_validations": [1, 2], "model": "fast"}
+
+    assert expand_parameter_grid(grid) == [
+        {"forecast_length": 7, "num_validations": 1, "model": "fast"},
+        {"forecast_length": 7, "num_validations": 2, "model": "fast"},
+        {"forecast_length": 14, "num_validations": 1, "model": "fast"},
+        {"forecast_length": 14, "num_validations": 2, "model": "fast"},
+    ]
+
+    # a list is taken as the parameter sets
+    assert expand_parameter_grid([{"a": 1}, {"a": 2}]) == [{"a": 1}, {"a": 2}]
+
+
+def test_run_batch(monkeypatch, task_spec):
+    submitted = []
+
+    def fake_submit(task_spec, run_config, backend, backend_config):
+        submitted.append(run_config)
+        return f"job-{run_config.parameters['param2']}"
+
+    def fake_wait(job_handle, backend, backend_config):
+        if job_handle == "job-2":
+            return JOB_STATUS.FAILED
+        return JOB_STATUS.SUCCESS
+
+    # the runs go through the scheduler of the process
+    monkeypatch.setattr(scheduler, "submit", fake_submit)
+    monkeypatch.setattr(scheduler, "wait_for_completion", fake_wait)
+
+    parameter_sets = expand_parameter_grid({"param1": "a", "param2": [1, 2, 3]})
+    results = run_batch(
+        TaskDef.parse_obj(task_spec),
+        parameter_sets,
+        {"file1": "/tmp/file1"},
+        max_concurrency=2,
+    )
+
+    assert [result["job_handle"] for result in results] == ["job-1", "job-2", "job-3"]
+    assert [result["status"] for result in results] == [
+        JOB_STATUS.SUCCESS,
+        JOB_STATUS.FAILED,
+        JOB_STATUS.SUCCESS,
+    ]
+    # all the runs share the input files
+    assert {run_config.input_files["file1"] for run_config in submitted} == {
+        "/tmp/file1"
+    }
+
+    # an invalid parameter set stops the whole batch before any submission
+    submitted.clear()
+    with pytest.raises(Exception, match="parameter set 1: Parameter param2 has type"):
+        run_batch(
+            TaskDef.parse_obj(task_spec),
+            [{"param2": 1}, {"param2": "two"}],
+            {"file1": "/tmp/file1"},
+        )
+    assert not submitted
+
+
+def test_run_batch_within_scheduler_limits(monkeypatch, task_spec):
+    lock = threading.Lock()
+    running = []
+    peak = 0
+
+    def fake_submit(task_spec, run_config, backend, backend_config):
+        nonlocal peak
+        with lock:
+            running.append(run_config)
+            peak = max(peak, len(running))
+        return f"job-{run_config.parameters['param2']}"
+
+    def fake_wait(job_handle, backend, backend_config):
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+        return JOB_STATUS.SUCCESS
+
+    monkeypatch.setattr(scheduler, "submit", fake_submit)
+    monkeypatch.setattr(scheduler, "wait_for_completion", fake_wait)
+
+    results = run_batch(
+        TaskDef.parse_obj(task_spec),
+        expand_parameter_grid({"param2": [1, 2, 3, 4]}),
+        {"file1": "/tmp/file1"},
+        max_concurrency=4,
+        scheduler=JobScheduler(backend_limits={"docker": {"max_jobs": 1}}),
+    )
+
+    # the backend cap of the scheduler wins over the concurrency of the batch
+    assert peak == 1
+    assert [result["status"] for result in results] == [JOB_STATUS.SUCCESS] * 4
@@ -0,0 +1,77 @@
+import pytest
+from trac.schema.data import FileValidator, check_input_files, validate_input_files
+from trac.schema.task import FileDef, TaskDef
+
+
+def test_file_validator(tmp_path):
+    file_def = FileDef(
+        name="orders",
+        mount_path="/mnt/orders",
+        file_schema={
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer"},
+                "qty": {"type": "number", "minimum": 0},
+                "paid": {"type": "boolean"},
+                "kind": {"type": "string", "enum": ["a", "b"]},
+            },
+            "required": ["id"],
+        },
+    )
+    path = tmp_path / "orders.csv"
+    path.write_text(
+        "id,qty,paid,kind\n" "1,2.5,True,a\n" "x,-1,maybe,c\n" ",3,false,b\n" "1,2\n"
+    )
+
+    assert FileValidator(file_def).validate_file(str(path)) == [
+        "orders line 3 column id: 'x' is not of type integer",
+        "orders line 3 column qty: -1.0 is less than the minimum of 0",
+        "orders line 3 column paid: 'maybe' is not of type boolean",
+        "orders line 3 column kind: 'c' is not one of ['a', 'b']",
+        "orders line 4 column id: missing value",
+        "orders line 5: 2 cells, expected 4",
+    ]
+    assert len(FileValidator(file_def).validate_file(str(path), max_errors=2)) == 3
+
+
+def test_validate_input_files(tmp_path, task_spec):
+    task_spec["io"]["files"].append(
+        dict(task_spec["io"]["files"][0], name="file3", mount_path="/mnt/file3")
+    )
+    task = TaskDef.parse_obj(task_spec)
+
+    good = tmp_path / "good.csv"
+    good.write_text("name,age\nalice,30\n")
+    bad = tmp_path / "bad.csv"
+    bad.write_text("name,age\nbob,old\n")
+
+    input_files = {"file1": str(good), "file3": str(bad)}
+    assert validate_input_files(task, input_files) == {
+        "file3": ["file3 line 2 column age: 'old' is not of type integer"]
+    }
+    with pytest.raises(Exception, match="'old' is not of type integer"):
+        check_input_files(task, input_files)
+
+
+def test_validate_only_csv_files(tmp_path, task_spec):
+    task_spec["io"]["files"].append(
+        dict(task_spec["io"]["files"][0], name="file3", mount_path="/mnt/file3.json")
+    )
+    task_spec["io"]["files"].append(
+        dict(task_spec["io"]["files"][0], name="file4", mount_path="/mnt/file4.csv")
+    )
+    task = TaskDef.parse_obj(task_spec)
+
+    # json and parquet inputs are left to the task
+    records = tmp_path / "records.json"
+    records.write_text('[{"name": "bob", "age": "old"}]')
+    table = tmp_path / "table.parquet"
+    table.write_bytes(b"PAR1\x00\xff")
+    # the mount path tells a csv file without extension on the host
+    bad = tmp_path / "bad"
+    bad.write_text("name,age\nbob,old\n")
+
+    input_files = {"file1": str(table), "file3": str(records), "file4": str(bad)}
+    assert validate_input_files(task, input_files) == {
+        "file4": ["file4 line 2 column age: 'old' is not of type integer"]
+    }
@@ -1,6 +1,11 @@
+import io
+import os
+import tarfile
+from types import SimpleNamespace
+
 import pytest
 from trac.runtime.base import JOB_STATUS
-from trac.runtime.docker import LocalDockerExecutor
+from trac.runtime.docker import OUTPUT_DIR_LABEL, LocalDockerExecutor
 from trac.schema.task import FILE_TYPE, RunConfig, TaskDef
 
 
@@ -50,3 +55,110 @@ def test_docker_executor_failed_job(task_spec_will_fail, run_config):
     assert logs
 
     executor.cleanup(job_handle)
+
+
+def test_docker_executor_open_output_streams_archive(task_spec):
+    content = b"name,age\n" + b"alice,1\n" * 10000
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar_file:
+        tar_info = tarfile.TarInfo("file2")
+        tar_info.size = len(content)
+        tar_file.addfile(tar_info, io.BytesIO(content))
+    archive = archive.getvalue()
+
+    # docker streams the archive in chunks
+    chunks = [archive[i : i + 1000] for i in range(0, len(archive), 1000)]
+    container = SimpleNamespace(
+        status="exited", labels={}, get_archive=lambda path: (iter(chunks), {})
+    )
+    client = SimpleNamespace(containers=SimpleNamespace(get=lambda _: container))
+
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = LocalDockerExecutor(
+        task_spec, None, session=SimpleNamespace(client=client), skip_validation=True
+    )
+
+    with executor.open_output("job", "file2") as f:
+        assert f.readline() == b"name,age\n"
+        assert f.read() == content[len(b"name,age\n") :]
+
+    assert executor.get_output("job") == {"file2": content}
+
+    with pytest.raises(Exception):
+        executor.open_output("job", "file1")
+
+
+def test_docker_executor_mounted_outputs(tmp_path, task_spec):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = LocalDockerExecutor(
+        task_spec,
+        None,
+        session=SimpleNamespace(client=None),
+        output_dir=str(tmp_path),
+        skip_validation=True,
+    )
+
+    job_output_dir = executor.prepare_outputs()
+    vols = executor.output_volumes(job_output_dir)
+    output_path = os.path.join(job_output_dir, "file2")
+    assert vols == {output_path: {"bind": "/mnt/file2", "mode": "rw"}}
+    assert os.path.isfile(output_path)
+
+    # the task writes through the mount, and the outputs are readable
+    # on the host while it is still running
+    with open(output_path, "wb") as f:
+        f.write(b"partial")
+
+    container = SimpleNamespace(
+        status="running", labels={OUTPUT_DIR_LABEL: job_output_dir}
+    )
+    executor.session = SimpleNamespace(
+        client=SimpleNamespace(containers=SimpleNamespace(get=lambda _: container))
+    )
+
+    assert executor.get_output_paths("job") == {"file2": output_path}
+    with executor.open_output("job", "file2") as f:
+        assert f.read() == b"partial"
+
+
+def test_docker_executor_output_volume(tmp_path, task_spec):
+    volumes = {
+        "local": {"Driver": "local", "Mountpoint": str(tmp_path)},
+        # e.g., the daemon runs in a vm or on another host
+        "remote": {"Driver": "local", "Mountpoint": "/var/lib/docker/volumes/x"},
+        "nfs": {"Driver": "nfs", "Mountpoint": str(tmp_path)},
+    }
+    client = SimpleNamespace(
+        volumes=SimpleNamespace(get=lambda name: SimpleNamespace(attrs=volumes[name]))
+    )
+
+    def executor(output_volume):
+        return LocalDockerExecutor(
+            TaskDef.parse_obj(task_spec),
+            None,
+            session=SimpleNamespace(client=client),
+            output_volume=output_volume,
+            skip_validation=True,
+        )
+
+    assert executor("local").resolve_output_dir() == str(tmp_path)
+    for name in ("remote", "nfs"):
+        with pytest.raises(Exception, match="not a local volume"):
+            executor(name).resolve_output_dir()
+
+
+def test_docker_executor_resource_limits(task_spec):
+    task_spec["container"].update(cpu=2, memory="512Mi", shm_size="1G")
+    executor = LocalDockerExecutor(
+        TaskDef.parse_obj(task_spec),
+        None,
+        session=SimpleNamespace(),
+        skip_validation=True,
+    )
+
+    assert executor.resource_kwargs() == {
+        "nano_cpus": 2 * 10**9,
+        "mem_limit": 512 * 1024**2,
+        "shm_size": 10**9,
+    }
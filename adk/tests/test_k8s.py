@@ -1,3 +1,6 @@
+import os
+from types import SimpleNamespace
+
 from trac.runtime.k8s import JOB_STATUS, K8sExecutor
 from trac.schema.task import RunConfig, TaskDef
 
@@ -6,7 +9,14 @@ def test_k8s_executor(task_spec, run_config):
     task_spec = TaskDef.parse_obj(task_spec)
     run_config = RunConfig.parse_obj(run_config)
 
-    executor = K8sExecutor(task_spec, run_config)
+    # the output file needs a store the host and the cluster can reach
+    executor = K8sExecutor(
+        task_spec,
+        run_config,
+        input_staging="object_store",
+        staging_endpoint=os.environ.get("TRAC_STAGING_ENDPOINT", "http://minio:9000"),
+        staging_bucket=os.environ.get("TRAC_STAGING_BUCKET", "trac-staging"),
+    )
     job_handle = executor.submit()
     assert job_handle
 
@@ -23,3 +33,35 @@ def test_k8s_executor(task_spec, run_config):
     assert outputs["file2"] == b"hello world"
 
     executor.cleanup(job_handle)
+
+
+def test_k8s_executor_compile_resources(tmp_path, task_spec):
+    task_spec["container"].update(
+        cpu=2,
+        # "m" is mega in the spec, milli in kubernetes quantities
+        memory="512m",
+        shm_size="256Mi",
+        node_selector={"pool": "solver"},
+        tolerations=[{"key": "solver", "value": "true", "effect": "NoSchedule"}],
+    )
+    executor = K8sExecutor(
+        TaskDef.parse_obj(task_spec),
+        None,
+        session=SimpleNamespace(),
+        skip_validation=True,
+        input_staging="pvc",
+        staging_pvc="trac-staging",
+        staging_dir=str(tmp_path),
+    )
+
+    pod_spec = executor.compile().spec.template.spec
+    container = pod_spec.containers[0]
+    assert container.resources.requests == {"cpu": "2.0", "memory": "512000000"}
+    assert container.resources.limits == container.resources.requests
+    assert {"name": "OMP_NUM_THREADS", "value": "2"} in [
+        {"name": env.name, "value": env.value} for env in container.env
+    ]
+    assert pod_spec.node_selector == {"pool": "solver"}
+    assert pod_spec.tolerations[0].key == "solver"
+    assert container.volume_mounts[0].mount_path == "/dev/shm"
+    assert pod_spec.volumes[-1].empty_dir.size_limit == str(256 * 1024**2)
@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+from trac.runtime import scheduler
+from trac.runtime.base import JOB_STATUS
+from trac.runtime.scheduler import PRIORITY, JobScheduler
+from trac.schema.task import RunConfig, TaskDef, parse_memory
+
+
+class FakeBackend:
+    """
+    A backend whose jobs run till the test finishes them
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = []
+        self.done = {}
+
+    def submit(self, task_spec, run_config, backend="docker", backend_config=None):
+        with self.lock:
+            job_handle = f"job{len(self.submitted)}"
+            self.submitted.append(run_config.parameters["name"])
+            self.done[job_handle] = threading.Event()
+        return job_handle
+
+    def wait_for_completion(self, job_handle, backend="docker", backend_config=None):
+        self.done[job_handle].wait(5)
+        return JOB_STATUS.SUCCESS
+
+    def finish(self, job):
+        self.done[job.wait_submitted(timeout=5)].set()
+        assert job.wait(timeout=5) == JOB_STATUS.SUCCESS
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(scheduler, "submit", backend.submit)
+    monkeypatch.setattr(scheduler, "wait_for_completion", backend.wait_for_completion)
+    return backend
+
+
+def make_job(task_spec, run_config, name, cpu=None, memory=None):
+    task_spec = dict(task_spec, container=dict(task_spec["container"]))
+    task_spec["container"].update(cpu=cpu, memory=memory)
+    run_config = dict(run_config, parameters={"name": name})
+    return TaskDef.parse_obj(task_spec), RunConfig.parse_obj(run_config)
+
+
+def test_parse_memory():
+    assert parse_memory("512Mi") == 512 * 1024**2
+    assert parse_memory("2G") == 2 * 1000**3
+    assert parse_memory(1024) == 1024
+    with pytest.raises(ValueError):
+        parse_memory("lots")
+
+
+def test_scheduler_caps_and_priorities(backend, task_spec, run_config):
+    """
+    Jobs over the cap are queued, and the higher priority ones are admitted first
+    """
+    jobs = JobScheduler(backend_limits={"docker": {"max_jobs": 1}})
+
+    first = jobs.submit(*make_job(task_spec, run_config, "first"))
+    low = jobs.submit(*make_job(task_spec, run_config, "low"), priority=PRIORITY.LOW)
+    high = jobs.submit(*make_job(task_spec, run_config, "high"), priority=PRIORITY.HIGH)
+
+    first.wait_submitted(timeout=5)
+    assert jobs.stats() == {"queued": 2, "running": 1}
+
+    backend.finish(first)
+    backend.finish(high)
+    backend.finish(low)
+    assert backend.submitted == ["first", "high", "low"]
+
+
+def test_scheduler_resources_and_fair_share(backend, task_spec, run_config):
+    """
+    Jobs are admitted within the cpu capacity, the app with the fewest running
+    jobs going first under the fair policy
+    """
+    jobs = JobScheduler(backend_limits={"docker": {"cpu": 4}}, policy="fair")
+
+    a1 = jobs.submit(*make_job(task_spec, run_config, "a1", cpu=2), app="a")
+    a2 = jobs.submit(*make_job(task_spec, run_config, "a2", cpu=2), app="a")
+    a3 = jobs.submit(*make_job(task_spec, run_config, "a3", cpu=2), app="a")
+    b1 = jobs.submit(*make_job(task_spec, run_config, "b1", cpu=2), app="b")
+
+    a2.wait_submitted(timeout=5)
+    assert jobs.stats() == {"queued": 2, "running": 2}
+
+    # a is running two jobs, b none, b gets the freed cpus
+    backend.finish(a1)
+    b1.wait_submitted(timeout=5)
+    assert backend.submitted == ["a1", "a2", "b1"]
+
+    backend.finish(a2)
+    backend.finish(b1)
+    backend.finish(a3)
+
+    with pytest.raises(Exception):
+        jobs.submit(*make_job(task_spec, run_config, "huge", cpu=8))
+
+
+def test_scheduler_app_limits_and_cancel(backend, task_spec, run_config):
+    """
+    The jobs of an app at its limit wait, a job too big for the free cpus
+    lets smaller ones through, and cancelled jobs are never submitted
+    """
+    jobs = JobScheduler(
+        backend_limits={"docker": {"cpu": 4}}, app_limits={"a": 1}, default_app_limit=2
+    )
+
+    a1 = jobs.submit(*make_job(task_spec, run_config, "a1", cpu=1), app="a")
+    a2 = jobs.submit(*make_job(task_spec, run_config, "a2", cpu=1), app="a")
+    b1 = jobs.submit(*make_job(task_spec, run_config, "b1", cpu=2), app="b")
+    b2 = jobs.submit(*make_job(task_spec, run_config, "b2", cpu=2), app="b")
+    c1 = jobs.submit(*make_job(task_spec, run_config, "c1", cpu=1), app="c")
+    c2 = jobs.submit(*make_job(task_spec, run_config, "c2", cpu=1), app="c")
+
+    # a1 and b1 take 3 cpus, b2 does not fit, c1 does
+    c1.wait_submitted(timeout=5)
+    assert backend.submitted == ["a1", "b1", "c1"]
+    assert jobs.cancel(a2)
+    assert a2.wait(timeout=5) == JOB_STATUS.FAILED
+
+    # the cpu freed by a1 is enough for c2, not for b2
+    backend.finish(a1)
+    c2.wait_submitted(timeout=5)
+    backend.finish(b1)
+    b2.wait_submitted(timeout=5)
+    for job in (c1, c2, b2):
+        backend.finish(job)
+    assert backend.submitted == ["a1", "b1", "c1", "c2", "b2"]
+    assert not jobs.cancel(c2)
+    assert jobs.stats() == {"queued": 0, "running": 0}
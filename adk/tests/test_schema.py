@@ -1,5 +1,15 @@
 # test schema parsing and validation
-from trac.schema.task import FILE_TYPE, AppDef, RunConfig, TaskDef
+import pytest
+from trac.schema import task
+from trac.schema.task import (
+    FILE_TYPE,
+    AppDef,
+    FileDef,
+    RunConfig,
+    TaskDef,
+    canonical_hash,
+    get_validator,
+)
 
 
 def test_task_spec_schema(task_spec):
@@ -86,3 +96,70 @@ def test_run_config_parsing(run_config):
     assert config.parameters["param1"] == "value1"
     assert config.parameters["param2"] == 1
     assert config.input_files["file1"]
+
+
+def test_container_resources(task_spec):
+    """
+    Test the resources of the container spec
+    """
+    task_spec["container"].update(
+        cpu=2.5, memory="1Gi", envs=[("OMP_NUM_THREADS", "1")]
+    )
+    container = TaskDef.parse_obj(task_spec).container
+
+    # the thread counts follow the cpus, unless set explicitly
+    envs = dict(container.resolved_envs())
+    assert envs["OMP_NUM_THREADS"] == "1"
+    assert envs["MKL_NUM_THREADS"] == "2"
+
+    task_spec["container"]["memory"] = "lots"
+    with pytest.raises(ValueError):
+        TaskDef.parse_obj(task_spec)
+
+
+def test_run_config_validator(task_spec, run_config):
+    """
+    Test the run config validation, compiled once per task spec
+    """
+    task = TaskDef.parse_obj(task_spec)
+    validator = task.run_config_validator()
+    assert task.run_config_validator() is validator
+
+    assert validator.errors(RunConfig.parse_obj(run_config)) == []
+
+    run_config["parameters"] = {"param2": True, "param3": 1}
+    run_config["input_files"] = {"file2": "/tmp/file2"}
+    errors = validator.errors(RunConfig.parse_obj(run_config))
+    assert errors == [
+        "Parameter param2 has type bool, expected integer",
+        "Parameter param3 not found in task_spec",
+        "File file2 is an output of the task",
+        "Input file file1 is missing",
+    ]
+
+    with pytest.raises(Exception, match="param3 not found"):
+        validator.validate(RunConfig.parse_obj(run_config))
+
+
+def test_validator_cache(monkeypatch):
+    """
+    Test the compiled validators are shared by the equal schemas
+    """
+    checked = []
+    check_schema = task.Draft202012Validator.check_schema
+    monkeypatch.setattr(
+        task.Draft202012Validator,
+        "check_schema",
+        lambda schema: checked.append(schema) or check_schema(schema),
+    )
+
+    schema = {"type": "object", "properties": {"cached": {"type": "integer"}}}
+    reordered = {"properties": {"cached": {"type": "integer"}}, "type": "object"}
+    assert canonical_hash(schema) == canonical_hash(reordered)
+
+    validator = get_validator(schema)
+    assert get_validator(reordered) is validator
+    assert len(checked) == 1
+
+    with pytest.raises(ValueError, match="Invalid schema"):
+        FileDef(name="f", mount_path="/f", file_schema={"type": "unknown"})
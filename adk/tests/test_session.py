@@ -0,0 +1,56 @@
+from trac.runtime.session import SESSIONS, BackendSession, get_session
+
+
+class FakeSession(BackendSession):
+    """
+    A session whose health is controlled by the test
+    """
+
+    health_check_interval = 0
+
+    def __init__(self, **backend_config):
+        super().__init__(**backend_config)
+        self.healthy = True
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        return object()
+
+    def ping(self, client):
+        if not self.healthy:
+            raise Exception("connection lost")
+
+
+def test_session_reuses_client():
+    session = FakeSession()
+    assert session.client is session.client
+    assert session.connects == 1
+
+
+def test_session_reconnects_when_unhealthy():
+    session = FakeSession()
+    client = session.client
+
+    session.healthy = False
+    assert session.client is not client
+    assert session.connects == 2
+
+
+def test_get_session_is_shared_per_backend_config(monkeypatch):
+    monkeypatch.setitem(SESSIONS, "fake", FakeSession)
+
+    session = get_session("fake", {"namespace": "a"})
+    assert get_session("fake", {"namespace": "a"}) is session
+    assert get_session("fake", {"namespace": "b"}) is not session
+    assert session.backend_config == {"namespace": "a"}
+
+
+def test_get_session_accepts_nested_config(monkeypatch):
+    monkeypatch.setitem(SESSIONS, "fake", FakeSession)
+
+    config = {"auth": {"token": "t", "user": "u"}, "hosts": ["a", "b"]}
+    session = get_session("fake", config)
+    reordered = {"hosts": ["a", "b"], "auth": {"user": "u", "token": "t"}}
+    assert get_session("fake", reordered) is session
+    assert get_session("fake", {**config, "hosts": ["b", "a"]}) is not session
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from trac.runtime.spec import (
+    SPEC_LABEL,
+    SpecCache,
+    _spec_from_label,
+    encode_spec_label,
+)
+
+
+def test_spec_cache_roundtrip(tmp_path, app_spec):
+    cache = SpecCache(tmp_path)
+
+    assert cache.get("sha256:abc") is None
+
+    cache.put("sha256:abc", app_spec)
+    assert cache.get("sha256:abc") == app_spec
+
+    # a new digest (e.g., the image got rebuilt) misses the cache
+    assert cache.get("sha256:def") is None
+
+
+def test_spec_cache_ignores_corrupted_entry(tmp_path, app_spec):
+    cache = SpecCache(tmp_path)
+    cache.put("sha256:abc", app_spec)
+
+    (tmp_path / "sha256-abc.json").write_text("{not json")
+    assert cache.get("sha256:abc") is None
+
+
+def test_spec_label_roundtrip(app_spec):
+    image = SimpleNamespace(labels={SPEC_LABEL: encode_spec_label(app_spec)})
+    assert _spec_from_label(image) == app_spec
+
+    # images built without the label fall through to the next reader
+    assert _spec_from_label(SimpleNamespace(labels=None)) is None
@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import io
+import json
+from types import SimpleNamespace
+
+import kubernetes as k8s
+import pytest
+from trac.runtime import staging
+from trac.runtime.staging import (
+    INPUT_VOLUME,
+    OUTPUT_DIR,
+    ObjectStoreStager,
+    PVCStager,
+    create_stager,
+)
+from trac.schema.task import FILE_TYPE, TaskDef
+
+
+def make_job_spec(name):
+    """
+    A bare job spec, as compiled by the k8s executor
+    """
+    return k8s.client.V1Job(
+        metadata=k8s.client.V1ObjectMeta(name=name),
+        spec=k8s.client.V1JobSpec(
+            template=k8s.client.V1PodTemplateSpec(
+                spec=k8s.client.V1PodSpec(
+                    containers=[k8s.client.V1Container(name="task1", volume_mounts=[])],
+                    volumes=[],
+                )
+            )
+        ),
+    )
+
+
+class FakeObjectStore:
+    """
+    An in-memory S3-compatible store, answering the requests of the stager
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, url, data, headers):
+        # the store rejects a chunk that does not match its Content-MD5
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        assert headers["Content-MD5"] == md5
+        self.objects[url] = data
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+    def get(self, url, stream=False):
+        data = self.objects.get(url)
+        return SimpleNamespace(
+            status_code=200 if data is not None else 404,
+            raise_for_status=lambda: None,
+            json=lambda: json.loads(data),
+            raw=io.BytesIO(data),
+        )
+
+    def delete(self, url):
+        self.objects.pop(url, None)
+
+
+@pytest.fixture
+def object_store(monkeypatch):
+    store = FakeObjectStore()
+    monkeypatch.setattr(staging, "requests", store)
+    return store
+
+
+def test_pvc_stager(tmp_path, task_spec, run_config):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = SimpleNamespace(k8s_client=k8s.client, task_spec=task_spec)
+    stager = create_stager(
+        executor,
+        "pvc",
+        staging_pvc="trac-staging",
+        staging_dir=str(tmp_path / "staging"),
+        staging_chunk_size="4",
+    )
+    assert isinstance(stager, PVCStager)
+
+    job_spec = make_job_spec("task1-abcdef")
+    inputs = [f for f in task_spec.io.files if f.type == FILE_TYPE.INPUT]
+    stager.stage_inputs(job_spec, inputs, run_config["input_files"])
+
+    # the file is copied to the shared volume in chunks
+    staged = tmp_path / "staging" / "task1-abcdef" / "inputs" / "file1"
+    assert staged.read_text() == "hello world"
+
+    # the init container copies it into the emptyDir and verifies the checksum
+    pod_spec = job_spec.spec.template.spec
+    init_container = pod_spec.init_containers[0]
+    checksum = hashlib.sha256(b"hello world").hexdigest()
+    assert checksum in init_container.args[0]
+    assert {v.name for v in pod_spec.volumes} == {INPUT_VOLUME, "trac-staging"}
+
+    mount = pod_spec.containers[0].volume_mounts[0]
+    assert mount.name == INPUT_VOLUME
+    assert mount.mount_path == "/mnt/file1"
+    assert mount.sub_path == "file1"
+
+    stager.cleanup("task1-abcdef")
+    assert not staged.exists()
+
+
+def test_pvc_stager_outputs(tmp_path, task_spec):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = SimpleNamespace(k8s_client=k8s.client, task_spec=task_spec)
+    stager = create_stager(
+        executor,
+        "pvc",
+        staging_pvc="trac-staging",
+        staging_dir=str(tmp_path / "staging"),
+    )
+
+    job_spec = make_job_spec("task1-abcdef")
+    outputs = [f for f in task_spec.io.files if f.type == FILE_TYPE.OUTPUT]
+    stager.collect_outputs(job_spec, outputs)
+
+    # the task writes its output straight to the shared volume
+    mount = job_spec.spec.template.spec.containers[0].volume_mounts[0]
+    assert mount.mount_path == "/mnt/file2"
+    assert mount.sub_path == "task1-abcdef/outputs/file2"
+
+    output_path = tmp_path / "staging" / "task1-abcdef" / "outputs" / "file2"
+    output_path.write_bytes(b"\x00hello world")
+
+    with stager.open_output("task1-abcdef", "file2") as output_file:
+        assert output_file.read() == b"\x00hello world"
+
+
+def test_configmap_stager_refuses_outputs(task_spec):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = SimpleNamespace(k8s_client=k8s.client, task_spec=task_spec)
+    stager = create_stager(executor)
+
+    # the outputs could only come back through the pod log
+    job_spec = make_job_spec("task1-abcdef")
+    outputs = [f for f in task_spec.io.files if f.type == FILE_TYPE.OUTPUT]
+    with pytest.raises(Exception, match="configmap staging"):
+        stager.collect_outputs(job_spec, outputs)
+
+    stager.collect_outputs(job_spec, [])
+    assert job_spec.spec.template.spec.containers[1:] == []
+
+
+def test_object_store_stager(object_store, task_spec, run_config):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = SimpleNamespace(k8s_client=k8s.client, task_spec=task_spec)
+    stager = create_stager(
+        executor,
+        "object_store",
+        staging_endpoint="http://minio:9000/",
+        staging_bucket="trac",
+        staging_chunk_size="4",
+    )
+    assert isinstance(stager, ObjectStoreStager)
+
+    job_spec = make_job_spec("task1-abcdef")
+    inputs = [f for f in task_spec.io.files if f.type == FILE_TYPE.INPUT]
+    stager.stage_inputs(job_spec, inputs, run_config["input_files"])
+
+    # the file is uploaded in numbered parts of chunk_size bytes
+    prefix = "http://minio:9000/trac/task1-abcdef"
+    parts = [f"{prefix}/inputs/file1/part-{idx:05d}" for idx in range(3)]
+    assert [object_store.objects[url] for url in parts] == [b"hell", b"o wo", b"rld"]
+
+    # the init container fetches the parts in order and verifies the checksum
+    pod_spec = job_spec.spec.template.spec
+    (init_container,) = pod_spec.init_containers
+    script = init_container.args[0]
+    assert [script.index(url) for url in parts] == sorted(
+        script.index(url) for url in parts
+    )
+    assert hashlib.sha256(b"hello world").hexdigest() in script
+    assert {v.name for v in pod_spec.volumes} == {INPUT_VOLUME}
+
+    mount = pod_spec.containers[0].volume_mounts[0]
+    assert mount.name == INPUT_VOLUME
+    assert mount.mount_path == "/mnt/file1"
+    assert mount.sub_path == "file1"
+
+
+def test_object_store_stager_outputs(object_store, task_spec):
+    task_spec = TaskDef.parse_obj(task_spec)
+    executor = SimpleNamespace(k8s_client=k8s.client, task_spec=task_spec)
+    stager = create_stager(
+        executor,
+        "object_store",
+        staging_endpoint="http://minio:9000",
+        staging_bucket="trac",
+        staging_upload_image="curl",
+    )
+
+    job_spec = make_job_spec("task1-abcdef")
+    outputs = [f for f in task_spec.io.files if f.type == FILE_TYPE.OUTPUT]
+    stager.collect_outputs(job_spec, outputs)
+
+    # a single sidecar uploads the output from disk once the task exits
+    pod_spec = job_spec.spec.template.spec
+    sidecar = pod_spec.containers[1]
+    assert sidecar.name == "trac-collect-outputs"
+    assert sidecar.image == "curl"
+    url = "http://minio:9000/trac/task1-abcdef/outputs/file2"
+    assert f"curl -sSf -T {OUTPUT_DIR}/file2 {url}" in sidecar.args[0]
+
+    # what the sidecar would upload is read back as a stream
+    object_store.objects[url] = b"\x00hello world"
+    assert stager.open_output("task1-abcdef", "file2").read() == b"\x00hello world"
+
+    # the manifest lists the objects of the job, cleanup removes all of them
+    stager.cleanup("task1-abcdef")
+    assert object_store.objects == {}
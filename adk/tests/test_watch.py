@@ -0,0 +1,106 @@
+import queue
+import threading
+
+import pytest
+from trac.runtime.base import JOB_STATUS
+from trac.runtime.watch import StatusWatcher
+
+
+class FakeExecutor:
+    """
+    An executor whose status transitions are fed by the test
+    """
+
+    def __init__(self, streaming=True):
+        self.streaming = streaming
+        self.events = queue.Queue()
+        self.statuses = {}
+
+    def get_status(self, job_handle):
+        return self.statuses.get(job_handle, JOB_STATUS.PENDING)
+
+    def watch_status(self):
+        if not self.streaming:
+            raise NotImplementedError
+        while True:
+            yield self.events.get()
+
+
+def test_status_watcher_fans_out_events():
+    executor = FakeExecutor()
+    watcher = StatusWatcher(executor)
+
+    job1 = [watcher.subscribe("job1"), watcher.subscribe("job1")]
+    job2 = watcher.subscribe("job2")
+
+    executor.events.put(("job1", JOB_STATUS.RUNNING))
+    executor.events.put(("job2", JOB_STATUS.FAILED))
+    executor.events.put(("job1", JOB_STATUS.SUCCESS))
+
+    # every subscriber sees the initial status and then the transitions of its job
+    for subscription in job1:
+        assert subscription.get(timeout=1) == JOB_STATUS.PENDING
+        assert subscription.get(timeout=1) == JOB_STATUS.RUNNING
+        assert subscription.get(timeout=1) == JOB_STATUS.SUCCESS
+
+    assert job2.get(timeout=1) == JOB_STATUS.PENDING
+    assert job2.get(timeout=1) == JOB_STATUS.FAILED
+    assert job2.empty()
+
+
+def test_status_watcher_sees_finished_job():
+    """
+    A job that finished before the subscription is reported right away
+    """
+    executor = FakeExecutor()
+    executor.statuses["job1"] = JOB_STATUS.SUCCESS
+    watcher = StatusWatcher(executor)
+
+    assert watcher.wait("job1", timeout=1) == JOB_STATUS.SUCCESS
+
+
+def test_status_watcher_resyncs_after_reconnect():
+    """
+    A job finishing while the event stream is down is reported on reconnect
+    """
+
+    class FlakyExecutor(FakeExecutor):
+        def __init__(self):
+            super().__init__()
+            self.subscribed = threading.Event()
+            self.connections = 0
+
+        def watch_status(self):
+            self.connections += 1
+            if self.connections == 1:
+                # the job finishes before the stream is connected, no event
+                self.subscribed.wait(timeout=1)
+                self.statuses["job1"] = JOB_STATUS.SUCCESS
+                raise ConnectionError("stream lost")
+            return super().watch_status()
+
+    executor = FlakyExecutor()
+    watcher = StatusWatcher(executor, retry_interval=0.01)
+
+    subscription = watcher.subscribe("job1")
+    executor.subscribed.set()
+    assert subscription.get(timeout=1) == JOB_STATUS.PENDING
+    assert subscription.get(timeout=1) == JOB_STATUS.SUCCESS
+
+
+def test_status_watcher_polls_without_event_api():
+    executor = FakeExecutor(streaming=False)
+    watcher = StatusWatcher(executor, poll_interval=0.01)
+
+    subscription = watcher.subscribe("job1")
+    assert subscription.get(timeout=1) == JOB_STATUS.PENDING
+
+    executor.statuses["job1"] = JOB_STATUS.FAILED
+    assert watcher.wait("job1", timeout=1) == JOB_STATUS.FAILED
+
+
+def test_status_watcher_timeout():
+    watcher = StatusWatcher(FakeExecutor())
+
+    with pytest.raises(TimeoutError):
+        watcher.wait("job1", timeout=0.05)
@@ -4,13 +4,19 @@
 # TODO: we should write a buildpack instead of a script file
 
 import json
+import logging
 import shutil
 import subprocess
 import tempfile
 from pathlib import Path
 
+import docker
+
+from ..runtime.spec import SPEC_LABEL, SpecCache, encode_spec_label
 from ..schema.task import AppDef
 
+LOG = logging.getLogger(__name__)
+
 MY_PATH = Path(__file__).parent.resolve()
 
 
@@ -107,6 +113,12 @@ def build_app_image(folder, image_name, clear_cache):
             image_name,
             "--buildpack",
             "gcr.io/paketo-buildpacks/python",
+            # embed the compiled trac.json as an image label, so that the spec
+            # can be read from the image metadata without running a container
+            "--buildpack",
+            "gcr.io/paketo-buildpacks/image-labels",
+            "--env",
+            f"BP_IMAGE_LABELS={SPEC_LABEL}={encode_spec_label(app_spec)}",
             "--builder",
             "docker.io/paketobuildpacks/builder:base",
             "--path",
@@ -133,6 +145,14 @@ def build_app_image(folder, image_name, clear_cache):
         if process.returncode != 0:
             raise Exception("Error building the image")
 
+        # warm the spec cache, so that the first submit does not need to
+        # start a container just to read the spec back
+        try:
+            image = docker.from_env().images.get(f"{image_name}:latest")
+            SpecCache().put(image.id, app_spec)
+        except Exception as e:
+            LOG.warning(f"Failed to warm the spec cache for {image_name}: {e}")
+
         # print the image name
         print(f"Image {image_name} built successfully")
         print(f"Run the image with the following command:")
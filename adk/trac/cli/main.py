@@ -6,9 +6,11 @@ import click
 from ..builder.build import build_app_image
 from ..deploy.deploy import deploy as deploy_app
 from ..deploy.deploy import undeploy as undeploy_app
-from ..runtime.run import get_logs, get_output, get_status, get_task_spec
+from ..runtime.batch import expand_parameter_grid, run_batch
+from ..runtime.run import get_logs, get_output, get_status, get_task_spec, save_output
 from ..runtime.run import submit as submit_task
-from ..schema.task import RunConfig
+from ..schema.data import check_input_files
+from ..schema.task import FILE_TYPE, RunConfig
 
 
 @click.group()
@@ -44,8 +46,21 @@ def task():
     required=False,
     help="Parameter json file, with key as the parameter name and value as the value",
 )
+@click.option(
+    "--skip-data-validation",
+    is_flag=True,
+    default=False,
+    help="Do not check the input files against the file schemas of the task",
+)
 def submit(
-    app_name, tag, task_name, backend, backend_config, input_json, parameter_json
+    app_name,
+    tag,
+    task_name,
+    backend,
+    backend_config,
+    input_json,
+    parameter_json,
+    skip_data_validation,
 ):
     """
     Submit a task
@@ -86,6 +101,11 @@ def submit(
     if tag:
         task_spec.container.tag = tag
 
+    # report all the problems of the run config at once, before the backend
+    task_spec.run_config_validator().validate(run_config)
+    if not skip_data_validation:
+        check_input_files(task_spec, input_files)
+
     # submit the task
     job_handle = submit_task(
         task_spec=task_spec,
@@ -97,6 +117,103 @@ def submit(
     print(f"Job submitted with handle {job_handle}")
 
 
+@task.command("submit-batch")
+@click.option(
+    "--app-name", required=True, help="name of the app, also the name of the image"
+)
+@click.option("--tag", required=False, default="latest", help="Image tag")
+@click.option("--task-name", "--n", required=True, help="Task name")
+@click.option("--backend", required=False, default="docker", help="Backend to use")
+@click.option(
+    "--backend-config",
+    required=False,
+    multiple=True,
+    help="Backend config in the form of key=value",
+)
+@click.option(
+    "--input-json",
+    required=False,
+    help="Input json file, with key as the input name and value as the path to the file",
+)
+@click.option(
+    "--grid-json",
+    required=True,
+    help="Parameter grid json file, either a dict whose list values are swept, "
+    "or a list of parameter dicts",
+)
+@click.option(
+    "--max-concurrency",
+    required=False,
+    default=4,
+    type=int,
+    help="Maximum number of runs at a time",
+)
+@click.option(
+    "--skip-data-validation",
+    is_flag=True,
+    default=False,
+    help="Do not check the input files against the file schemas of the task",
+)
+def submit_batch(
+    app_name,
+    tag,
+    task_name,
+    backend,
+    backend_config,
+    input_json,
+    grid_json,
+    max_concurrency,
+    skip_data_validation,
+):
+    """
+    Run a task once per parameter set of a parameter grid, and wait for all the runs
+    """
+    # create a dict for backend config
+    backend_config_dict = {}
+    for config in backend_config:
+        key, value = config.split("=")
+        backend_config_dict[key] = value
+
+    # create a dict for input files
+    input_files = {}
+    if input_json:
+        with open(input_json) as f:
+            input_files = json.load(f)
+
+    # for each value in the input_files dict, verify if the file exists
+    for input_file in input_files:
+        if not os.path.exists(input_files[input_file]):
+            raise Exception(f"Input file {input_files[input_file]} not found")
+
+    with open(grid_json) as f:
+        parameter_sets = expand_parameter_grid(json.load(f))
+
+    # get the task spec
+    task_spec = get_task_spec(app_name, tag, task_name)
+
+    # if tag is specified, override the tag in the task spec
+    if tag:
+        task_spec.container.tag = tag
+
+    # the runs share the input files, check them once
+    if not skip_data_validation:
+        check_input_files(task_spec, input_files)
+
+    print(f"Running {len(parameter_sets)} parameter sets")
+    results = run_batch(
+        task_spec,
+        parameter_sets,
+        input_files,
+        backend=backend,
+        backend_config=backend_config_dict,
+        max_concurrency=max_concurrency,
+    )
+
+    for result in results:
+        status = result["status"].value if result["status"] else result["error"]
+        print(f"{result['job_handle']}\t{status}\t{json.dumps(result['parameters'])}")
+
+
 @task.command()
 @click.argument("job_handle")
 @click.option(
@@ -139,7 +256,13 @@ def status(job_handle, backend, backend_config):
     multiple=True,
     help="Backend config in the form of key=value",
 )
-def output(job_handle, app_name, tag, task_name, backend, backend_config):
+@click.option(
+    "--output-dir",
+    required=False,
+    default=None,
+    help="Directory to write the output files to, instead of printing them",
+)
+def output(job_handle, app_name, tag, task_name, backend, backend_config, output_dir):
     """
     Get the output of a task
     """
@@ -151,6 +274,23 @@ def output(job_handle, app_name, tag, task_name, backend, backend_config):
 
     task_spec = get_task_spec(app_name, tag, task_name)
 
+    if output_dir:
+        # stream the output files to disk
+        os.makedirs(output_dir, exist_ok=True)
+        for file in task_spec.io.files:
+            if file.type == FILE_TYPE.OUTPUT:
+                path = os.path.join(output_dir, os.path.basename(file.mount_path))
+                save_output(
+                    job_handle,
+                    file.name,
+                    path,
+                    task_spec,
+                    backend,
+                    backend_config_dict,
+                )
+                print(f"Saved {file.name} to {path}")
+        return
+
     # get the output
     output = get_output(job_handle, task_spec, backend, backend_config_dict)
     print(f"Output: {output}")
@@ -1,9 +1,12 @@
 # runtime takes care of the actual execution of the app image
 
+import shutil
 from abc import ABC, abstractmethod
 from enum import Enum
+from typing import BinaryIO, Iterator, Tuple
 
 from ..schema import RunConfig, TaskDef
+from ..schema.task import FILE_TYPE
 
 
 class JOB_STATUS(Enum):
@@ -33,48 +36,8 @@ class BaseExecutor(ABC):
         """
         Validate if run_config is valid for task_spec
         """
-        # check if the parameters provided in run_config comply with the task_spec
-        for param in self.run_config.parameters:
-            # find the parameter definition in task_spec
-            param_def = None
-            for param_def in self.task_spec.parameter.parameters:
-                if param_def.name == param:
-                    break
-
-            if param_def is None:
-                raise Exception(f"Parameter {param} not found in task_spec")
-
-            # check if the type is correct
-            actual_type = type(self.run_config.parameters[param])
-            expected_type = param_def.type
-            # map the expected type to python type
-            if expected_type == "integer":
-                expected_type = int
-            elif expected_type == "number":
-                expected_type = float
-            elif expected_type == "float":
-                expected_type = float
-            elif expected_type == "string":
-                expected_type = str
-            elif expected_type == "boolean":
-                expected_type = bool
-            else:
-                raise Exception(f"Unknown parameter type {expected_type}")
-
-            if actual_type != expected_type:
-                msg = f"Parameter {param} has type {actual_type}, expected {expected_type}"
-                raise Exception(msg)
-
-        # check if the input files provided in run_config comply with the task_spec
-        for file in self.run_config.input_files:
-            # find the file definition in task_spec
-            file_def = None
-            for file_def in self.task_spec.io.files:
-                if file_def.name == file:
-                    break
-
-            if file_def is None:
-                raise Exception(f"Input file {file} not found in task_spec")
+        # the validator is compiled once per task spec
+        self.task_spec.run_config_validator().validate(self.run_config)
 
         # task_spec should always have container field defined since
         # the spec is processed by the compiler, so the handler field
@@ -108,6 +71,42 @@ class BaseExecutor(ABC):
         Get the status of the task
         """
 
+    def watch_status(self) -> Iterator[Tuple[str, JOB_STATUS]]:
+        """
+        Stream the status transitions of all the jobs of this backend
+        as (job_handle, status) pairs
+        The stream is connected before it is returned, the transitions before
+        that are read by the status watcher with get_status
+
+        Backends without an event API leave it unimplemented, and the
+        status watcher falls back to polling get_status
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_output(self, job_handle: str, name: str) -> BinaryIO:
+        """
+        Open an output file of the task as a binary file object
+        The content is streamed from the backend as it is read
+        """
+
+    def iter_outputs(self, job_handle: str) -> Iterator[Tuple[str, BinaryIO]]:
+        """
+        Iterate over the output files of the task as (name, file object) pairs
+        """
+        for file in self.task_spec.io.files:
+            if file.type == FILE_TYPE.OUTPUT:
+                with self.open_output(job_handle, file.name) as output_file:
+                    yield file.name, output_file
+
+    def save_output(self, job_handle: str, name: str, path: str) -> str:
+        """
+        Write an output file of the task to path, without holding it in memory
+        """
+        with self.open_output(job_handle, name) as output_file, open(path, "wb") as f:
+            shutil.copyfileobj(output_file, f)
+        return path
+
     @abstractmethod
     def get_output(self, job_handle: str) -> None:
         """
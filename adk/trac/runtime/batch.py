@@ -0,0 +1,97 @@
+# run a task once per parameter set of a sweep, sharing the input files
+
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+from ..schema.task import RunConfig, TaskDef
+from .scheduler import PRIORITY, JobScheduler, get_scheduler
+
+LOG = logging.getLogger(__name__)
+
+
+def expand_parameter_grid(grid: Union[Dict[str, Any], List[Dict]]) -> List[Dict]:
+    """
+    Expand a parameter grid to the list of parameter sets it describes
+
+    A dict is a grid: the parameters with a list of values are swept, and the
+    parameter sets are the cartesian product of those lists; the other
+    parameters are the same in every set.
+    A list is taken as the parameter sets themselves.
+    """
+    if isinstance(grid, list):
+        return [dict(parameters) for parameters in grid]
+
+    if not isinstance(grid, dict):
+        raise Exception("A parameter grid is either a dict or a list of dicts")
+
+    names = list(grid)
+    values = [value if isinstance(value, list) else [value] for value in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run_batch(
+    task_spec: TaskDef,
+    parameter_sets: List[Dict],
+    input_files: Dict[str, str],
+    backend: str = "docker",
+    backend_config: Optional[Dict] = None,
+    max_concurrency: int = 4,
+    timeout: Optional[float] = None,
+    priority: PRIORITY = PRIORITY.NORMAL,
+    scheduler: Optional[JobScheduler] = None,
+) -> List[Dict]:
+    """
+    Run the task once per parameter set, at most max_concurrency at a time
+    All the runs share the same input files, and nothing is submitted unless
+    all the parameter sets are valid
+    The runs are submitted through the scheduler, the one of the process by
+    default, so that they are admitted within its limits
+
+    Return one result per parameter set, in order, with the parameters,
+    the job handle, the final status and the error if the run could not finish
+    """
+
+    # check all the parameter sets before submitting any of them
+    validator = task_spec.run_config_validator()
+    run_configs = [
+        RunConfig(parameters=parameters, input_files=input_files)
+        for parameters in parameter_sets
+    ]
+    errors = [
+        f"parameter set {idx}: {error}"
+        for idx, run_config in enumerate(run_configs)
+        for error in validator.errors(run_config)
+    ]
+    if errors:
+        raise Exception("Invalid parameter sets: " + "; ".join(errors))
+
+    scheduler = scheduler or get_scheduler()
+
+    def run_one(run_config):
+        result = {
+            "parameters": run_config.parameters,
+            "job_handle": None,
+            "status": None,
+            "error": None,
+        }
+        try:
+            job = scheduler.submit(
+                task_spec,
+                run_config,
+                backend=backend,
+                backend_config=backend_config,
+                priority=priority,
+            )
+            result["job_handle"] = job.wait_submitted()
+            result["status"] = job.wait(timeout=timeout)
+        except Exception as e:
+            LOG.warning(f"Run with parameters {run_config.parameters} failed: {e}")
+            result["error"] = str(e)
+        return result
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, max_concurrency), thread_name_prefix="trac-batch"
+    ) as executor:
+        return list(executor.map(run_one, run_configs))
@@ -1,26 +1,78 @@
 import io
 import json
 import logging
+import os
 import pathlib
 import tarfile
 import tempfile
+import uuid
+from typing import Dict
 
 import docker
 
-from ..schema.task import FILE_TYPE, RunConfig, TaskDef
+from ..schema.task import FILE_TYPE, RunConfig, TaskDef, parse_memory
 from .base import JOB_STATUS, BaseExecutor
+from .session import BackendSession, get_session
 
 LOG = logging.getLogger(__name__)
 
+# label holding the host directory the outputs of a container are mounted from
+OUTPUT_DIR_LABEL = "trac.output_dir"
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    A read-only binary stream over an iterator of byte chunks,
+    e.g., the archive stream returned by docker
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
 
 class LocalDockerExecutor(BaseExecutor):
     """
     Executor for running tasks locally using docker
     """
 
-    def __init__(self, task_def: TaskDef, run_config: RunConfig, **kwargs):
+    def __init__(
+        self,
+        task_def: TaskDef,
+        run_config: RunConfig,
+        session: BackendSession = None,
+        output_dir: str = None,
+        output_volume: str = None,
+        **kwargs,
+    ):
         super().__init__(task_def, run_config, **kwargs)
-        self.docker_client = docker.from_env()
+        self.session = session or get_session("docker")
+        # when set, the output files are bind-mounted from the host
+        # instead of being copied out of the container after it exits
+        self.output_dir = output_dir
+        self.output_volume = output_volume
+
+    @property
+    def docker_client(self):
+        """
+        The docker client shared by all the executors of the session
+        """
+        return self.session.client
 
     def compile(self):
         """
@@ -41,10 +93,16 @@ class LocalDockerExecutor(BaseExecutor):
         command = compiled_task.container.args
         image = compiled_task.container.image
         tag = compiled_task.container.tag
-        envs = compiled_task.container.envs
+        envs = compiled_task.container.resolved_envs()
         envs = [f"{env[0]}={env[1]}" for env in envs]
 
         vols = self.preprocess()
+        labels = {"app": "trac"}
+
+        job_output_dir = self.prepare_outputs()
+        if job_output_dir:
+            vols.update(self.output_volumes(job_output_dir))
+            labels[OUTPUT_DIR_LABEL] = job_output_dir
 
         # create a container on the background
         container = client.containers.run(
@@ -54,10 +112,26 @@ class LocalDockerExecutor(BaseExecutor):
             detach=True,
             volumes=vols,
             environment=envs,
+            labels=labels,
+            **self.resource_kwargs(),
         )
 
         return container.id
 
+    def resource_kwargs(self) -> Dict:
+        """
+        The resource limits of the container, as docker run kwargs
+        """
+        container = self.task_spec.container
+        kwargs = {}
+        if container.cpu:
+            kwargs["nano_cpus"] = int(container.cpu * 1e9)
+        if container.memory:
+            kwargs["mem_limit"] = parse_memory(container.memory)
+        if container.shm_size:
+            kwargs["shm_size"] = parse_memory(container.shm_size)
+        return kwargs
+
     def preprocess(self):
         """
         For preprocess step, we save all the parameter as a temp json file that won't be deleted
@@ -103,6 +177,80 @@ class LocalDockerExecutor(BaseExecutor):
 
         return vols
 
+    def resolve_output_dir(self):
+        """
+        Return the host directory the outputs are written to, if any
+        A named volume resolves to its mount point on the host, which must be
+        writable from here
+        """
+        if self.output_dir:
+            return os.path.abspath(self.output_dir)
+
+        if self.output_volume:
+            client = self.docker_client
+            try:
+                volume = client.volumes.get(self.output_volume)
+            except docker.errors.NotFound:
+                volume = client.volumes.create(self.output_volume)
+
+            # the mount point is a path on the docker host, it is only usable
+            # by a client sharing its filesystem, i.e., not with a remote
+            # daemon, docker desktop or a volume driver other than local
+            mountpoint = volume.attrs.get("Mountpoint")
+            if (
+                volume.attrs.get("Driver") != "local"
+                or not mountpoint
+                or not os.access(mountpoint, os.W_OK)
+            ):
+                raise Exception(
+                    f"Output volume {self.output_volume} is not a local volume "
+                    "writable from this host, use an output_dir instead"
+                )
+            return mountpoint
+
+        return None
+
+    def prepare_outputs(self):
+        """
+        Create an empty host file for each output file in a per-job directory,
+        so that the container writes its outputs straight to the host
+        Return the per-job directory, or None if outputs are not mounted
+        """
+        output_dir = self.resolve_output_dir()
+        if not output_dir:
+            return None
+
+        job_output_dir = os.path.join(output_dir, uuid.uuid4().hex)
+        os.makedirs(job_output_dir)
+
+        for file in self.task_spec.io.files:
+            if file.type == FILE_TYPE.OUTPUT:
+                path = os.path.join(job_output_dir, file.name)
+                # create the file upfront, otherwise docker creates a
+                # directory at the bind source
+                open(path, "wb").close()
+                # the task may not run as the current user
+                os.chmod(path, 0o666)
+
+        return job_output_dir
+
+    def output_volumes(self, job_output_dir):
+        """
+        Bind-mount the host file of each output file at its mount_path
+        """
+        vols = {}
+        for file in self.task_spec.io.files:
+            if file.type == FILE_TYPE.OUTPUT:
+                mount_path = file.mount_path
+                if not mount_path.startswith("/"):
+                    mount_path = "/workspace/" + mount_path
+
+                vols[os.path.join(job_output_dir, file.name)] = {
+                    "bind": mount_path,
+                    "mode": "rw",
+                }
+        return vols
+
     def get_status(self, job_handle):
         """
         Given a container id, return its status
@@ -126,34 +274,106 @@ class LocalDockerExecutor(BaseExecutor):
         else:
             return JOB_STATUS.FAILED
 
-    def get_output(self, job_handle):
+    def watch_status(self):
         """
-        Given a container id, return the output files as a dictionary
+        Stream the status transitions of the containers created by trac,
+        using the docker events api
+        """
+        # connect right away, rather than on the first read of the stream
+        events = self.docker_client.events(
+            decode=True,
+            filters={
+                "type": "container",
+                "event": ["start", "die"],
+                "label": "app=trac",
+            },
+        )
+        return self._iter_events(events)
+
+    @staticmethod
+    def _iter_events(events):
+        """
+        Map the docker events of the containers to job status transitions
+        """
+        try:
+            for event in events:
+                job_handle = event["Actor"]["ID"]
+                if event["Action"] == "start":
+                    yield job_handle, JOB_STATUS.RUNNING
+                elif event["Action"] == "die":
+                    exit_code = event["Actor"]["Attributes"].get("exitCode", "1")
+                    if exit_code == "0":
+                        yield job_handle, JOB_STATUS.SUCCESS
+                    else:
+                        yield job_handle, JOB_STATUS.FAILED
+        finally:
+            events.close()
+
+    def open_output(self, job_handle, name):
+        """
+        Given a container id, open an output file as a binary file object
+        The file is untarred on the fly from the archive streamed by docker
         """
         client = self.docker_client
         container = client.containers.get(job_handle)
+
+        for file in self.task_spec.io.files:
+            if file.type == FILE_TYPE.OUTPUT and file.name == name:
+                break
+        else:
+            raise Exception(f"Output file {name} not found in task_spec")
+
+        output_path = self._output_path(container, name)
+        if output_path:
+            # the output is on the host already, it can be read
+            # while the task is still writing it
+            return open(output_path, "rb")
+
         # make sure the container is finished
         if container.status != "exited":
             raise Exception("Container not finished yet")
 
-        output_files = {}
+        mount_path = file.mount_path
+        if not mount_path.startswith("/"):
+            mount_path = "/workspace/" + mount_path
+
+        bits, stat = container.get_archive(mount_path)
+
+        # read the tar stream sequentially, and return its first (and only) file
+        tar_file = tarfile.open(fileobj=ChunkStream(bits), mode="r|")
+        tar_info = tar_file.next()
+        return tar_file.extractfile(tar_info)
 
+    def get_output(self, job_handle):
+        """
+        Given a container id, return the output files as a dictionary
+        """
+        return {name: f.read() for name, f in self.iter_outputs(job_handle)}
+
+    def get_output_paths(self, job_handle):
+        """
+        Given a container id, return the host paths of the output files
+        Only available if the outputs are mounted from an output_dir or output_volume
+        """
+        container = self.docker_client.containers.get(job_handle)
+
+        paths = {}
         for file in self.task_spec.io.files:
             if file.type == FILE_TYPE.OUTPUT:
-                mount_path = file.mount_path
-                if not mount_path.startswith("/"):
-                    mount_path = "/workspace/" + mount_path
-
-                bits, stat = container.get_archive(mount_path)
+                output_path = self._output_path(container, file.name)
+                if not output_path:
+                    raise Exception(f"Outputs of job {job_handle} are not mounted")
+                paths[file.name] = output_path
 
-                # create a tar file from the bits
-                tar_file = tarfile.open(fileobj=io.BytesIO(b"".join(bits)), mode="r")
-                # get the first file in the tar file
-                tar_info = tar_file.next()
-                # read the file
-                output_files[file.name] = tar_file.extractfile(tar_info).read()
+        return paths
 
-        return output_files
+    @staticmethod
+    def _output_path(container, name):
+        labels = container.labels or {}
+        job_output_dir = labels.get(OUTPUT_DIR_LABEL)
+        if not job_output_dir:
+            return None
+        return os.path.join(job_output_dir, name)
 
     def get_logs(self, job_handle):
         """
@@ -6,8 +6,10 @@ import string
 
 import kubernetes as k8s
 
-from ..schema.task import FILE_TYPE, RunConfig, TaskDef
+from ..schema.task import FILE_TYPE, RunConfig, TaskDef, parse_memory
 from .base import JOB_STATUS, BaseExecutor
+from .session import BackendSession, get_session
+from .staging import create_stager
 
 LOG = logging.getLogger(__name__)
 
@@ -17,12 +19,33 @@ class K8sExecutor(BaseExecutor):
     Executor for running tasks on kubernetes, as job resources
     """
 
-    def __init__(self, task_spec, run_config, **kwargs):
+    def __init__(
+        self,
+        task_spec,
+        run_config,
+        session: BackendSession = None,
+        input_staging="configmap",
+        **kwargs,
+    ):
         super().__init__(task_spec, run_config, **kwargs)
-        # initialize kubernetes client
-        k8s.config.load_kube_config()
+        # the api client is shared by all the executors of the session,
+        # k8s_client is only used to build the kubernetes models
+        self.session = session or get_session("k8s")
         self.k8s_client = k8s.client
 
+        # input_staging picks how input files get into the pod, configured by
+        # the staging_* options of the backend config
+        staging_config = {k: v for k, v in kwargs.items() if k.startswith("staging_")}
+        self.stager = create_stager(self, input_staging, **staging_config)
+
+    @property
+    def batch_api(self):
+        return self.session.client.batch_api
+
+    @property
+    def core_api(self):
+        return self.session.client.core_api
+
     def compile(self):
         """
         For the compile step, we generate a kubernetes job spec
@@ -42,6 +65,7 @@ class K8sExecutor(BaseExecutor):
                 "app": "trac",
             },
         )
+        container = self.task_spec.container
         # set the spec of the job
         job_spec.spec = self.k8s_client.V1JobSpec(
             template=self.k8s_client.V1PodTemplateSpec(
@@ -49,25 +73,48 @@ class K8sExecutor(BaseExecutor):
                     containers=[
                         self.k8s_client.V1Container(
                             name=self.task_spec.name,
-                            image=self.task_spec.container.image
-                            + ":"
-                            + self.task_spec.container.tag,
-                            command=self.task_spec.container.command,
-                            args=self.task_spec.container.args,
+                            image=container.image + ":" + container.tag,
+                            command=container.command,
+                            args=container.args,
                             env=[
                                 self.k8s_client.V1EnvVar(
                                     name=env[0],
                                     value=env[1],
                                 )
-                                for env in self.task_spec.container.envs
+                                for env in container.resolved_envs()
                             ],
+                            resources=self.compile_resources(),
                             volume_mounts=[],
                         )
                     ],
                     volumes=[],
+                    node_selector=container.node_selector,
+                    tolerations=[
+                        self.k8s_client.V1Toleration(**toleration.dict())
+                        for toleration in container.tolerations
+                    ]
+                    if container.tolerations
+                    else None,
                 ),
             ),
         )
+
+        if container.shm_size:
+            # back /dev/shm with memory, the default of 64M is too small
+            # for the solvers sharing data between processes
+            pod_spec = job_spec.spec.template.spec
+            pod_spec.volumes.append(
+                self.k8s_client.V1Volume(
+                    name="dshm",
+                    empty_dir=self.k8s_client.V1EmptyDirVolumeSource(
+                        medium="Memory",
+                        size_limit=str(parse_memory(container.shm_size)),
+                    ),
+                )
+            )
+            pod_spec.containers[0].volume_mounts.append(
+                self.k8s_client.V1VolumeMount(name="dshm", mount_path="/dev/shm")
+            )
         # set restart policy to never, so that the job will not restart if it fails
         job_spec.spec.template.spec.restart_policy = "Never"
 
@@ -76,6 +123,24 @@ class K8sExecutor(BaseExecutor):
 
         return job_spec
 
+    def compile_resources(self):
+        """
+        The resources of the container, requested and capped at the same values
+        """
+        container = self.task_spec.container
+        resources = {}
+        if container.cpu:
+            resources["cpu"] = str(container.cpu)
+        if container.memory:
+            # a plain number of bytes, the suffixes accepted by the spec do not
+            # all mean the same in kubernetes, e.g., "m" is milli there
+            resources["memory"] = str(parse_memory(container.memory))
+        if not resources:
+            return None
+        return self.k8s_client.V1ResourceRequirements(
+            requests=resources, limits=dict(resources)
+        )
+
     def submit(self):
         """
         For submit step, we create a kubernetes job as specified by compiled_task
@@ -85,7 +150,7 @@ class K8sExecutor(BaseExecutor):
         self.preprocess()
         job_spec = self.compiled_task
         # create the job
-        job = self.k8s_client.BatchV1Api().create_namespaced_job(
+        job = self.batch_api.create_namespaced_job(
             namespace="default",
             body=job_spec,
         )
@@ -97,8 +162,7 @@ class K8sExecutor(BaseExecutor):
         parameter files as specified by task_spec, and later mount it to the job
 
 
-        For input files, we create a configmap that contains all the file contents, and mount it to the job
-        (THIS IS QUITE HACKY, NEED TO FIND A BETTER WAY)
+        Input files are moved into the pod by the configured stager
         """
         # check if compile has been called
         if not self.compiled_task:
@@ -121,65 +185,16 @@ class K8sExecutor(BaseExecutor):
             data={os.path.basename(parameter_mount_path): json.dumps(parameters)},
         )
 
-        param_config_map = self.k8s_client.CoreV1Api().create_namespaced_config_map(
+        param_config_map = self.core_api.create_namespaced_config_map(
             namespace="default",
             body=param_config_map,
         )
 
+        # stage the input files into the pod
         input_files = [f for f in self.task_spec.io.files if f.type == FILE_TYPE.INPUT]
-        # get the location of the input files from run_config
-        for f in input_files:
-            # TODO: when the output file is located under the same directory as the input file
-            # it will be read only, we need to fix the permission
-            file_path_on_host = self.run_config.input_files[f.name]
-            print(f)
-            # read the file content and save it to the configmap
-            with open(file_path_on_host, "r") as file_on_host:
-                vol_name = f.name
-                # vol_name can only contain lower case letters, numbers, and dashes
-                vol_name = vol_name.lower().replace("_", "-")
-
-                mount_path = f.mount_path
-                if not mount_path.startswith("/"):
-                    mount_path = "/workspace/" + mount_path
-
-                # create a configmap for input files
-                input_file_config_map = self.k8s_client.V1ConfigMap(
-                    metadata=self.k8s_client.V1ObjectMeta(
-                        generate_name=self.task_spec.name + "-input-",
-                        labels={
-                            "owned_by": compiled_task.metadata.name,
-                            "app": "trac",
-                        },
-                    ),
-                    data={os.path.basename(mount_path): file_on_host.read()},
-                )
-
-                input_file_config_map = (
-                    self.k8s_client.CoreV1Api().create_namespaced_config_map(
-                        namespace="default",
-                        body=input_file_config_map,
-                    )
-                )
-
-                # mount the configmap to the job, and set the file path to the file.mount_path
-                compiled_task.spec.template.spec.volumes.append(
-                    self.k8s_client.V1Volume(
-                        name=vol_name,
-                        config_map=self.k8s_client.V1ConfigMapVolumeSource(
-                            name=input_file_config_map.metadata.name,
-                        ),
-                    )
-                )
-
-                # for the mount_path, since the key of the configmap is the file name, we use the directory of the mount_path as the mount_path
-                compiled_task.spec.template.spec.containers[0].volume_mounts.append(
-                    self.k8s_client.V1VolumeMount(
-                        name=vol_name,
-                        mount_path=mount_path,
-                        sub_path=os.path.basename(mount_path),
-                    )
-                )
+        self.stager.stage_inputs(
+            compiled_task, input_files, self.run_config.input_files
+        )
 
         # mount the configmap to the job
         compiled_task.spec.template.spec.volumes.append(
@@ -201,58 +216,11 @@ class K8sExecutor(BaseExecutor):
             )
         )
 
-        # for each output file, create a sidecar container that will monitor the file and cat the file content to stdout
-        # this is a hacky way to get the output file content, need to find a better way
+        # collect the output files through the stager
         output_files = [
             f for f in self.task_spec.io.files if f.type == FILE_TYPE.OUTPUT
         ]
-        for f in output_files:
-            mount_path = f.mount_path
-            if not mount_path.startswith("/"):
-                mount_path = "/workspace/" + mount_path
-            compiled_task.spec.template.spec.containers.append(
-                self.k8s_client.V1Container(
-                    name=f.name,
-                    image="busybox",
-                    command=["sh", "-c"],
-                    # wait for the file to be created, and then cat the file content to stdout
-                    args=[
-                        "while [ ! -f "
-                        + mount_path
-                        + " ]; do sleep 1; done; cat "
-                        + mount_path
-                    ],
-                    volume_mounts=[],
-                )
-            )
-
-            # create an emptyDir volume for the output file and mount it to the sidecar container and the main container
-            vol_name = f.name.lower().replace("_", "-")
-
-            # TODO: this is currently broken, need to fix it
-            # need to mount an empty file to the output file path
-            # then let the app write to the file
-
-            compiled_task.spec.template.spec.volumes.append(
-                self.k8s_client.V1Volume(
-                    name=vol_name,
-                    empty_dir=self.k8s_client.V1EmptyDirVolumeSource(),
-                )
-            )
-
-            compiled_task.spec.template.spec.containers[-1].volume_mounts.append(
-                self.k8s_client.V1VolumeMount(
-                    name=vol_name,
-                    mount_path=os.path.dirname(f.mount_path),
-                )
-            )
-
-            compiled_task.spec.template.spec.containers[0].volume_mounts.append(
-                self.k8s_client.V1VolumeMount(
-                    name=vol_name,
-                    mount_path=os.path.dirname(f.mount_path),
-                )
-            )
+        self.stager.collect_outputs(compiled_task, output_files)
 
         return compiled_task
 
@@ -260,14 +228,46 @@ class K8sExecutor(BaseExecutor):
         """
         Given a job handle (in this case, the name of the kubernetes job), get the status of the job
         """
-        status = (
-            self.k8s_client.BatchV1Api()
-            .read_namespaced_job_status(
-                name=job_handle,
-                namespace="default",
-            )
-            .status
+        status = self.batch_api.read_namespaced_job_status(
+            name=job_handle,
+            namespace="default",
+        ).status
+        return self._map_status(status)
+
+    def watch_status(self):
+        """
+        Stream the status transitions of the jobs created by trac,
+        using a kubernetes watch on the jobs
+        """
+        # list the jobs to connect right away, and watch from the version of
+        # the list, so that no transition falls in between
+        jobs = self.batch_api.list_namespaced_job(
+            namespace="default", label_selector="app=trac"
         )
+        return self._iter_job_events(jobs.metadata.resource_version)
+
+    def _iter_job_events(self, resource_version):
+        """
+        Map the kubernetes job events after resource_version to job status transitions
+        """
+        watch = k8s.watch.Watch()
+        try:
+            for event in watch.stream(
+                self.batch_api.list_namespaced_job,
+                namespace="default",
+                label_selector="app=trac",
+                resource_version=resource_version,
+            ):
+                job = event["object"]
+                yield job.metadata.name, self._map_status(job.status)
+        finally:
+            watch.stop()
+
+    @staticmethod
+    def _map_status(status):
+        """
+        Map a kubernetes job status to job status
+        """
         if status.succeeded == 1:
             return JOB_STATUS.SUCCESS
         elif status.failed == 1:
@@ -275,58 +275,45 @@ class K8sExecutor(BaseExecutor):
         else:
             return JOB_STATUS.RUNNING
 
-    def get_output(self, job_handle):
+    def get_pod(self, job_handle):
         """
-        Get the content of the output files as specified by task_spec from the job pod
-        and return it as a dictionary
+        Given a job handle (in this case, the name of the kubernetes job), get the pod of the job
+        """
+        return self.core_api.list_namespaced_pod(
+            namespace="default",
+            label_selector="job-name=" + job_handle,
+        ).items[0]
+
+    def open_output(self, job_handle, name):
+        """
+        Open an output file of the job as a binary file object, streamed from
+        where the stager collected it
         """
-        # get the log of the job pod, with container name as the output file name
         output_files = [
-            f for f in self.task_spec.io.files if f.type == FILE_TYPE.OUTPUT
+            f.name for f in self.task_spec.io.files if f.type == FILE_TYPE.OUTPUT
         ]
-        output = {}
+        if name not in output_files:
+            raise Exception(f"Output file {name} not found in task_spec")
 
-        # find the pod name of the job
-        pod_name = (
-            self.k8s_client.CoreV1Api()
-            .list_namespaced_pod(
-                namespace="default",
-                label_selector="job-name=" + job_handle,
-            )
-            .items[0]
-            .metadata.name
-        )
-
-        for f in output_files:
-            log = self.k8s_client.CoreV1Api().read_namespaced_pod_log(
-                name=pod_name,
-                namespace="default",
-                container=f.name,
-            )
-            # return the log as bytes
-            output[f.name] = log.encode("utf-8")
+        return self.stager.open_output(job_handle, name)
 
-        return output
+    def get_output(self, job_handle):
+        """
+        Get the content of the output files as specified by task_spec from the job pod
+        and return it as a dictionary
+        """
+        return {name: f.read() for name, f in self.iter_outputs(job_handle)}
 
     def get_logs(self, job_handle):
         """
         Given a job handle (in this case, the name of the kubernetes job), get the logs of the job
         """
-        # find the pod name of the job
-        pod_name = (
-            self.k8s_client.CoreV1Api()
-            .list_namespaced_pod(
-                namespace="default",
-                label_selector="job-name=" + job_handle,
-            )
-            .items[0]
-            .metadata.name
-        )
-        # get the logs of the pod, with the container name as the task name
-        logs = self.k8s_client.CoreV1Api().read_namespaced_pod_log(
-            name=pod_name,
+        pod = self.get_pod(job_handle)
+        # get the logs of the task container, which is the first container of the pod
+        logs = self.core_api.read_namespaced_pod_log(
+            name=pod.metadata.name,
             namespace="default",
-            container=self.task_spec.name,
+            container=pod.spec.containers[0].name,
         )
         return logs
 
@@ -334,12 +321,12 @@ class K8sExecutor(BaseExecutor):
         """
         Given a job handle (in this case, the name of the kubernetes job), cancel the job
         """
-        job = self.k8s_client.BatchV1Api().read_namespaced_job(
+        job = self.batch_api.read_namespaced_job(
             name=job_handle,
             namespace="default",
         )
         job.spec.active_deadline_seconds = 0
-        self.k8s_client.BatchV1Api().replace_namespaced_job(
+        self.batch_api.replace_namespaced_job(
             name=job_handle,
             namespace="default",
             body=job,
@@ -349,23 +336,26 @@ class K8sExecutor(BaseExecutor):
         """
         Given a job handle (in this case, the name of the kubernetes job), delete the job
         """
-        job = self.k8s_client.BatchV1Api().read_namespaced_job(
+        job = self.batch_api.read_namespaced_job(
             name=job_handle,
             namespace="default",
         )
-        self.k8s_client.BatchV1Api().delete_namespaced_job(
+        self.batch_api.delete_namespaced_job(
             name=job_handle,
             namespace="default",
         )
 
         # delete the configmaps with label owned_by = job_handle
-        configmaps = self.k8s_client.CoreV1Api().list_namespaced_config_map(
+        configmaps = self.core_api.list_namespaced_config_map(
             namespace="default",
             label_selector="owned_by=" + job_handle,
         )
         for configmap in configmaps.items:
             LOG.info(f"Deleting configmap {configmap.metadata.name}")
-            self.k8s_client.CoreV1Api().delete_namespaced_config_map(
+            self.core_api.delete_namespaced_config_map(
                 name=configmap.metadata.name,
                 namespace="default",
             )
+
+        # delete the staged input and output files
+        self.stager.cleanup(job_handle)
@@ -1,52 +1,38 @@
 # the entry point to trigger the runtime
 
-import json
-from typing import Dict, Optional
-
-import docker
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
 
 from ..schema.task import AppDef, RunConfig, TaskDef
 from .base import JOB_STATUS, BaseExecutor
 from .docker import LocalDockerExecutor
 from .k8s import K8sExecutor
+from .session import config_key, get_session
+from .spec import read_app_spec
+from .watch import StatusWatcher
 
 BACKENDS = {
     "docker": LocalDockerExecutor,
     "k8s": K8sExecutor,
 }
 
+# one status watcher per backend and backend config
+_WATCHERS: Dict[Tuple[str, str], StatusWatcher] = {}
+_WATCHERS_LOCK = threading.Lock()
+
 
 def get_task_spec(image, tag, task_name) -> TaskDef:
     """
     Get the task spec for the given image
     """
-    # create a docker client
-    client = docker.from_env()
-
-    # verify if the image tag exists, if not, try to pull it. If it fails, throw an error
-    try:
-        client.images.get(image + ":" + tag)
-    except docker.errors.ImageNotFound:
-        try:
-            client.images.pull(image, tag=tag)
-        except docker.errors.ImageNotFound:
-            raise Exception(f"Image {image}:{tag} not found")
-
-    # docker run --rm image:tag -- spec
-    result = client.containers.run(
-        image=image + ":" + tag,
-        command="-- spec",
-        detach=False,
-        remove=True,
-    )
+    app_spec = read_app_spec(image, tag)
 
     # parse the result to get the task spec
     try:
-        app_spec = json.loads(result)
         app_spec = AppDef.parse_obj(app_spec)
     except:
         print("Error parsing the app spec")
-        print(result)
+        print(app_spec)
         raise Exception("Error parsing the app spec")
 
     # create a task spec
@@ -77,14 +63,20 @@ def create_executor(
         raise Exception(f"Backend {backend} not supported")
 
     backend_config = backend_config or {}
+    # executors are cheap, the backend clients are pooled in the sessions
+    session = get_session(backend, backend_config)
 
     if not task_spec or not run_config:
         # skip the validation
         return BACKENDS[backend](
-            task_spec, run_config, skip_validation=True, **backend_config
+            task_spec,
+            run_config,
+            session=session,
+            skip_validation=True,
+            **backend_config,
         )
 
-    return BACKENDS[backend](task_spec, run_config, **backend_config)
+    return BACKENDS[backend](task_spec, run_config, session=session, **backend_config)
 
 
 def submit(
@@ -130,6 +122,37 @@ def get_output(
     return output
 
 
+def open_output(
+    job_handle: str,
+    name: str,
+    task_spec: TaskDef,
+    backend: str = "docker",
+    backend_config: Optional[Dict] = None,
+) -> BinaryIO:
+    """
+    Open an output file of a task as a binary file object
+    """
+    executor = create_executor(task_spec, None, backend, backend_config)
+
+    return executor.open_output(job_handle, name)
+
+
+def save_output(
+    job_handle: str,
+    name: str,
+    path: str,
+    task_spec: TaskDef,
+    backend: str = "docker",
+    backend_config: Optional[Dict] = None,
+) -> str:
+    """
+    Write an output file of a task to path
+    """
+    executor = create_executor(task_spec, None, backend, backend_config)
+
+    return executor.save_output(job_handle, name, path)
+
+
 def get_logs(
     job_handle: str, backend: str = "docker", backend_config: Optional[Dict] = None
 ) -> str:
@@ -140,3 +163,31 @@ def get_logs(
 
     logs = executor.get_logs(job_handle)
     return logs
+
+
+def get_watcher(
+    backend: str = "docker", backend_config: Optional[Dict] = None
+) -> StatusWatcher:
+    """
+    Get the status watcher shared by all the jobs of the given backend
+    """
+    backend_config = backend_config or {}
+    key = config_key(backend, backend_config)
+    with _WATCHERS_LOCK:
+        if key not in _WATCHERS:
+            executor = create_executor(None, None, backend, backend_config)
+            _WATCHERS[key] = StatusWatcher(executor)
+        return _WATCHERS[key]
+
+
+def wait_for_completion(
+    job_handle: str,
+    backend: str = "docker",
+    backend_config: Optional[Dict] = None,
+    timeout: Optional[float] = None,
+) -> JOB_STATUS:
+    """
+    Wait till a task succeeds or fails, and return its final status
+    """
+    watcher = get_watcher(backend, backend_config)
+    return watcher.wait(job_handle, timeout=timeout)
@@ -0,0 +1,371 @@
+# admission control in front of the backends
+#
+# jobs are queued in the scheduler and only handed over to their backend when
+# the concurrency caps of the backend and of the app, and the cpu / memory
+# capacity of the backend allow it, so that a burst of submissions does not
+# oversubscribe the hosts
+#
+# the scheduler only sees the jobs submitted in its own process, so its limits
+# apply per process
+
+import heapq
+import itertools
+import logging
+import threading
+from collections import Counter
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from ..schema.task import RunConfig, TaskDef, parse_memory
+from .base import JOB_STATUS
+from .run import submit, wait_for_completion
+
+LOG = logging.getLogger(__name__)
+
+
+class PRIORITY(IntEnum):
+    """
+    Priority classes, higher priority jobs are admitted first
+    """
+
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+SCHEDULING_POLICIES = ("fifo", "fair")
+
+
+class ScheduledJob:
+    """
+    A job queued in the scheduler
+    """
+
+    def __init__(
+        self,
+        seq: int,
+        task_spec: TaskDef,
+        run_config: RunConfig,
+        backend: str,
+        backend_config: Optional[Dict],
+        priority: PRIORITY,
+        app: str,
+    ):
+        self.seq = seq
+        self.task_spec = task_spec
+        self.run_config = run_config
+        self.backend = backend
+        self.backend_config = backend_config
+        self.priority = priority
+        self.app = app
+
+        container = task_spec.container
+        self.cpu = (container.cpu if container else None) or 0
+        self.memory = (
+            parse_memory(container.memory) if container and container.memory else 0
+        )
+
+        self.job_handle = None
+        self.status = JOB_STATUS.PENDING
+        self.error = None
+        self.cancelled = False
+        self._submitted = threading.Event()
+        self._finished = threading.Event()
+
+    def wait_submitted(self, timeout: Optional[float] = None) -> str:
+        """
+        Block till the job is handed over to its backend, and return its handle
+        Raise TimeoutError if it is still queued after timeout seconds
+        """
+        if not self._submitted.wait(timeout):
+            raise TimeoutError(f"Job was not submitted in {timeout} seconds")
+        if self.job_handle is None:
+            raise Exception(f"Job could not be submitted: {self.error}")
+        return self.job_handle
+
+    def wait(self, timeout: Optional[float] = None) -> JOB_STATUS:
+        """
+        Block till the job succeeds or fails, and return its final status
+        Raise TimeoutError if it is still going after timeout seconds
+        """
+        if not self._finished.wait(timeout):
+            raise TimeoutError(f"Job did not finish in {timeout} seconds")
+        return self.status
+
+
+class JobScheduler:
+    """
+    Queue jobs and submit them to their backend once they are admitted
+
+    backend_limits caps each backend, e.g.,
+    {"docker": {"max_jobs": 8, "cpu": 16, "memory": "64Gi"}}
+    where cpu and memory are the capacity shared by the requests of the
+    containers declared in their ContainerSpec.
+    app_limits caps the number of running jobs per app, default_app_limit
+    applies to the apps without an entry.
+
+    Among the admissible jobs, the highest priority class goes first. Within
+    a class, the "fifo" policy picks the oldest job, and the "fair" policy
+    the oldest job of the app with the fewest running jobs.
+
+    The limits only count the jobs of this scheduler, i.e., of this process.
+    Several processes submitting to the same backend (e.g., web servers and
+    job workers) each get the full limits.
+    """
+
+    def __init__(
+        self,
+        backend_limits: Optional[Dict[str, Dict]] = None,
+        app_limits: Optional[Dict[str, int]] = None,
+        default_app_limit: Optional[int] = None,
+        policy: str = "fifo",
+    ):
+        if policy not in SCHEDULING_POLICIES:
+            raise Exception(f"Scheduling policy {policy} not supported")
+
+        self.backend_limits = {}
+        for backend, limits in (backend_limits or {}).items():
+            limits = dict(limits)
+            if limits.get("memory") is not None:
+                limits["memory"] = parse_memory(limits["memory"])
+            self.backend_limits[backend] = limits
+        self.app_limits = app_limits or {}
+        self.default_app_limit = default_app_limit
+        self.policy = policy
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        # queued jobs by seq, and a heap of (-priority, seq, job) per app
+        # cancelled jobs are dropped from the heaps when they reach the top
+        self._queue: Dict[int, ScheduledJob] = {}
+        self._heaps: Dict[str, List[Tuple[int, int, ScheduledJob]]] = {}
+        self._queued_backends: Counter = Counter()
+        self._running: Dict[int, ScheduledJob] = {}
+
+    def submit(
+        self,
+        task_spec: TaskDef,
+        run_config: RunConfig,
+        backend: str = "docker",
+        backend_config: Optional[Dict] = None,
+        priority: PRIORITY = PRIORITY.NORMAL,
+        app: Optional[str] = None,
+    ) -> ScheduledJob:
+        """
+        Queue a task for the given backend
+        The app defaults to the image of the task
+        """
+        if app is None:
+            app = task_spec.container.image if task_spec.container else task_spec.name
+
+        job = ScheduledJob(
+            next(self._seq),
+            task_spec,
+            run_config,
+            backend,
+            backend_config,
+            PRIORITY(priority),
+            app,
+        )
+
+        # a job that can never fit would block its backend forever
+        limits = self.backend_limits.get(backend, {})
+        for resource in ("cpu", "memory"):
+            capacity = limits.get(resource)
+            if capacity is not None and getattr(job, resource) > capacity:
+                raise Exception(
+                    f"Job requests more {resource} than backend {backend} has"
+                )
+
+        with self._lock:
+            self._queue[job.seq] = job
+            self._queued_backends[backend] += 1
+            heapq.heappush(
+                self._heaps.setdefault(app, []), (-job.priority, job.seq, job)
+            )
+            self._schedule()
+        return job
+
+    def cancel(self, job: ScheduledJob) -> bool:
+        """
+        Remove a job from the queue
+        Return False if the job is not queued anymore
+        """
+        with self._lock:
+            if self._queue.pop(job.seq, None) is None:
+                return False
+            self._queued_backends[job.backend] -= 1
+
+        job.cancelled = True
+        job.error = "cancelled"
+        job.status = JOB_STATUS.FAILED
+        job._submitted.set()
+        job._finished.set()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of queued and running jobs
+        """
+        with self._lock:
+            return {"queued": len(self._queue), "running": len(self._running)}
+
+    def _usage(self):
+        """
+        Running jobs, cpu and memory by backend, and running jobs by app
+        """
+        backends = {}
+        apps = {}
+        for job in self._running.values():
+            usage = backends.setdefault(job.backend, [0, 0, 0])
+            usage[0] += 1
+            usage[1] += job.cpu
+            usage[2] += job.memory
+            apps[job.app] = apps.get(job.app, 0) + 1
+        return backends, apps
+
+    def _admissible(self, job: ScheduledJob, backends, apps) -> bool:
+        limits = self.backend_limits.get(job.backend, {})
+        num_jobs, cpu, memory = backends.get(job.backend, (0, 0, 0))
+
+        if limits.get("max_jobs") is not None and num_jobs >= limits["max_jobs"]:
+            return False
+        if limits.get("cpu") is not None and cpu + job.cpu > limits["cpu"]:
+            return False
+        if limits.get("memory") is not None and memory + job.memory > limits["memory"]:
+            return False
+
+        app_limit = self.app_limits.get(job.app, self.default_app_limit)
+        if app_limit is not None and apps.get(job.app, 0) >= app_limit:
+            return False
+        return True
+
+    def _saturated(self, backend: str, backends) -> bool:
+        max_jobs = self.backend_limits.get(backend, {}).get("max_jobs")
+        return max_jobs is not None and backends.get(backend, (0,))[0] >= max_jobs
+
+    def _schedule(self) -> None:
+        """
+        Admit as many queued jobs as the limits allow
+        Must be called with the lock held
+        """
+        backends, apps = self._usage()
+        # jobs set aside during this pass, the usage only grows within a pass
+        # so a job that is not admissible now will not be in this pass
+        skipped = []
+        # apps at their limit, none of their jobs is admissible in this pass
+        blocked_apps = set()
+
+        while True:
+            # nothing fits when the backends of all the queued jobs are full
+            if all(
+                self._saturated(backend, backends)
+                for backend, count in self._queued_backends.items()
+                if count > 0
+            ):
+                break
+
+            heads = {}
+            for app, heap in self._heaps.items():
+                while heap and heap[0][1] not in self._queue:
+                    heapq.heappop(heap)
+                if heap and app not in blocked_apps:
+                    heads[app] = heap[0]
+            if not heads:
+                break
+
+            # the order depends on the running jobs under the fair policy
+            def order(app):
+                neg_priority, seq, _ = heads[app]
+                share = apps.get(app, 0) if self.policy == "fair" else 0
+                return (neg_priority, share, seq)
+
+            app = min(heads, key=order)
+            app_limit = self.app_limits.get(app, self.default_app_limit)
+            if app_limit is not None and apps.get(app, 0) >= app_limit:
+                blocked_apps.add(app)
+                continue
+
+            entry = heapq.heappop(self._heaps[app])
+            job = entry[2]
+            if not self._admissible(job, backends, apps):
+                skipped.append(entry)
+                continue
+
+            del self._queue[job.seq]
+            self._queued_backends[job.backend] -= 1
+            self._running[job.seq] = job
+            usage = backends.setdefault(job.backend, [0, 0, 0])
+            usage[0] += 1
+            usage[1] += job.cpu
+            usage[2] += job.memory
+            apps[job.app] = apps.get(job.app, 0) + 1
+
+            threading.Thread(
+                target=self._run_job,
+                args=(job,),
+                name="trac-scheduled-job",
+                daemon=True,
+            ).start()
+
+        for entry in skipped:
+            heapq.heappush(self._heaps[entry[2].app], entry)
+        for app in [app for app, heap in self._heaps.items() if not heap]:
+            del self._heaps[app]
+
+    def _run_job(self, job: ScheduledJob) -> None:
+        """
+        Submit an admitted job, and release its slot once it finishes
+        """
+        try:
+            job.job_handle = submit(
+                job.task_spec,
+                job.run_config,
+                backend=job.backend,
+                backend_config=job.backend_config,
+            )
+            job.status = JOB_STATUS.RUNNING
+            job._submitted.set()
+
+            job.status = wait_for_completion(
+                job.job_handle, backend=job.backend, backend_config=job.backend_config
+            )
+        except Exception as e:
+            LOG.warning(f"Scheduled job {job.seq} failed: {e}")
+            job.error = str(e)
+            job.status = JOB_STATUS.FAILED
+        finally:
+            job._submitted.set()
+            with self._lock:
+                self._running.pop(job.seq, None)
+                self._schedule()
+            job._finished.set()
+
+
+# the scheduler shared by the submissions of the whole process
+_SCHEDULER: Optional[JobScheduler] = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler() -> JobScheduler:
+    """
+    Get the scheduler shared by the whole process
+    Unless configure_scheduler is called, it only orders the jobs by priority
+    """
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = JobScheduler()
+        return _SCHEDULER
+
+
+def configure_scheduler(**kwargs) -> JobScheduler:
+    """
+    Replace the scheduler of the process by a JobScheduler(**kwargs)
+    The jobs of the previous scheduler keep running
+    """
+    global _SCHEDULER
+    scheduler = JobScheduler(**kwargs)
+    with _SCHEDULER_LOCK:
+        _SCHEDULER = scheduler
+    return scheduler
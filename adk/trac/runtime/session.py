@@ -0,0 +1,152 @@
+# process-wide registry of backend sessions
+#
+# a session owns the client of a backend (the docker client, or the kubernetes
+# api client and the api objects built on it), so that executors created for
+# every submit / status / output / logs call reuse the same connection pool
+# instead of re-connecting and re-parsing kubeconfig each time
+
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+import docker
+import kubernetes as k8s
+
+LOG = logging.getLogger(__name__)
+
+
+class BackendSession(ABC):
+    """
+    A health-checked, lazily (re)connected client of a backend
+    """
+
+    # seconds between two health checks of the connection
+    health_check_interval = 30
+
+    def __init__(self, **backend_config):
+        self.backend_config = backend_config
+        self._lock = threading.Lock()
+        self._client = None
+        self._last_checked = 0
+
+    @abstractmethod
+    def connect(self):
+        """
+        Create a new client of the backend
+        """
+
+    @abstractmethod
+    def ping(self, client) -> None:
+        """
+        Raise if the client can not talk to the backend
+        """
+
+    def close(self, client) -> None:
+        """
+        Release the resources held by a client that is dropped
+        """
+
+    @property
+    def client(self):
+        """
+        Return the client of the session, reconnect if the health check fails
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._client is not None
+                and now - self._last_checked > self.health_check_interval
+            ):
+                try:
+                    self.ping(self._client)
+                except Exception as e:
+                    LOG.warning(f"Backend connection is unhealthy, reconnecting: {e}")
+                    self.reset()
+                self._last_checked = now
+
+            if self._client is None:
+                self._client = self.connect()
+                self._last_checked = now
+
+            return self._client
+
+    def reset(self) -> None:
+        """
+        Drop the current client, the next access reconnects
+        """
+        if self._client is not None:
+            try:
+                self.close(self._client)
+            except Exception:
+                pass
+        self._client = None
+
+
+class DockerSession(BackendSession):
+    def connect(self):
+        return docker.from_env()
+
+    def ping(self, client):
+        client.ping()
+
+    def close(self, client):
+        client.close()
+
+
+class K8sApis:
+    """
+    The kubernetes api objects sharing one api client
+    """
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+        self.batch_api = k8s.client.BatchV1Api(api_client)
+        self.core_api = k8s.client.CoreV1Api(api_client)
+
+
+class K8sSession(BackendSession):
+    def connect(self):
+        return K8sApis(k8s.config.new_client_from_config())
+
+    def ping(self, client):
+        k8s.client.VersionApi(client.api_client).get_code()
+
+    def close(self, client):
+        client.api_client.close()
+
+
+SESSIONS = {
+    "docker": DockerSession,
+    "k8s": K8sSession,
+}
+
+_SESSIONS: Dict[Tuple[str, str], BackendSession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def config_key(backend: str, backend_config: Dict) -> Tuple[str, str]:
+    """
+    Key of a backend and its config in the registries of the process
+    The config is serialized, as it may hold dicts or lists, e.g., k8s auth
+    """
+    return backend, json.dumps(backend_config, sort_keys=True, default=str)
+
+
+def get_session(
+    backend: str = "docker", backend_config: Optional[Dict] = None
+) -> BackendSession:
+    """
+    Get the session shared by the whole process for a backend and backend config
+    """
+    if backend not in SESSIONS:
+        raise Exception(f"Backend {backend} not supported")
+
+    backend_config = backend_config or {}
+    key = config_key(backend, backend_config)
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key] = SESSIONS[backend](**backend_config)
+        return _SESSIONS[key]
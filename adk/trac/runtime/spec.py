@@ -0,0 +1,165 @@
+# helpers to read the app spec (the compiled trac.json) bundled in an app image
+#
+# the builder embeds the spec as an image label, so reading it only costs an
+# image inspect. Images built before that are read from the image layers of a
+# created-but-never-started container, and specs are cached on disk keyed by the
+# image digest. The cache is shared by the ADK cli and trac-ui, and it is warmed
+# by the builder right after an image is built.
+
+import base64
+import io
+import json
+import logging
+import os
+import tarfile
+from pathlib import Path
+from typing import Optional
+
+import docker
+
+from .session import get_session
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "trac" / "specs"
+
+# image label holding the base64 encoded trac.json
+SPEC_LABEL = "ai.convect.trac.spec"
+
+# location of trac.json in the image, buildpacks put the app under /workspace
+SPEC_PATH = "/workspace/trac.json"
+
+
+class SpecCache:
+    """
+    On-disk cache of app specs, keyed by image digest.
+
+    The digest (image id) is content addressed, so rebuilding or re-tagging an
+    image yields a new key and stale entries are never served.
+    """
+
+    def __init__(self, cache_dir=None):
+        cache_dir = (
+            cache_dir or os.environ.get("TRAC_SPEC_CACHE_DIR") or DEFAULT_CACHE_DIR
+        )
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, digest: str) -> Path:
+        # digest takes the form of sha256:<hex>
+        return self.cache_dir / (digest.replace(":", "-") + ".json")
+
+    def get(self, digest: str) -> Optional[dict]:
+        """
+        Return the cached app spec for the digest, or None if it is not cached
+        """
+        try:
+            with open(self._path(digest)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            LOG.warning(f"Ignoring corrupted spec cache entry for {digest}")
+            return None
+
+    def put(self, digest: str, spec: dict) -> None:
+        """
+        Save the app spec for the digest
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(digest)
+        # write to a temp file and rename it, so that concurrent readers
+        # never see a partially written entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(spec, f)
+        os.replace(tmp_path, path)
+
+
+def get_image(client, image, tag):
+    """
+    Get the image with the given tag, try to pull it if it does not exist locally
+    """
+    try:
+        return client.images.get(image + ":" + tag)
+    except docker.errors.ImageNotFound:
+        try:
+            return client.images.pull(image, tag=tag)
+        except docker.errors.ImageNotFound:
+            raise Exception(f"Image {image}:{tag} not found")
+
+
+def encode_spec_label(spec: dict) -> str:
+    """
+    Encode the app spec as the value of the spec label
+    """
+    return base64.b64encode(json.dumps(spec).encode()).decode()
+
+
+def _spec_from_label(image) -> Optional[dict]:
+    """
+    Read the spec from the image labels, available when the image is built by trac
+    """
+    label = (image.labels or {}).get(SPEC_LABEL)
+    if not label:
+        return None
+    return json.loads(base64.b64decode(label))
+
+
+def _spec_from_layers(client, image) -> Optional[dict]:
+    """
+    Read trac.json out of the image layers, the container is created but never started
+    """
+    container = client.containers.create(image.id)
+    try:
+        bits, _ = container.get_archive(SPEC_PATH)
+        tar_file = tarfile.open(fileobj=io.BytesIO(b"".join(bits)), mode="r")
+        return json.load(tar_file.extractfile(tar_file.next()))
+    except docker.errors.NotFound:
+        return None
+    finally:
+        container.remove()
+
+
+def _spec_from_run(client, image) -> dict:
+    """
+    Ask the launcher in the image to print the spec, the last resort for images
+    that keep trac.json somewhere else
+    """
+    # docker run --rm image@digest -- spec
+    # run the digest instead of the tag, so that the cached spec always
+    # belongs to the image it is keyed by
+    result = client.containers.run(
+        image=image.id,
+        command="-- spec",
+        detach=False,
+        remove=True,
+    )
+    return json.loads(result)
+
+
+def read_app_spec(image, tag, client=None, cache: SpecCache = None) -> dict:
+    """
+    Return the app spec bundled in image:tag as a dict
+    """
+    client = client or get_session("docker").client
+    cache = cache or SpecCache()
+
+    docker_image = get_image(client, image, tag)
+    digest = docker_image.id
+
+    spec = cache.get(digest)
+    if spec is not None:
+        return spec
+
+    try:
+        spec = (
+            _spec_from_label(docker_image)
+            or _spec_from_layers(client, docker_image)
+            or _spec_from_run(client, docker_image)
+        )
+    except json.JSONDecodeError as e:
+        LOG.error(f"Error parsing the app spec of {image}:{tag}: {e}")
+        raise Exception("Error parsing the app spec")
+
+    cache.put(digest, spec)
+    return spec
@@ -0,0 +1,538 @@
+# staging of the input and output files of a kubernetes job
+#
+# a stager moves the input files from the submitting host into the job pod,
+# and the output files back. The streaming stagers upload the inputs in chunks
+# to a store the cluster can reach (a shared PVC, or an S3-compatible object
+# store such as MinIO), and add an init container that streams them into an
+# emptyDir volume and verifies their checksums before the task starts.
+#
+# Outputs are written to the PVC directly, or collected in one pass by a single
+# sidecar that uploads all of them once the task container exits. The configmap
+# stager has no store to collect them to, so it refuses tasks with outputs.
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Dict, List
+
+import requests
+
+from ..schema.task import FileDef
+
+LOG = logging.getLogger(__name__)
+
+# default size of the chunks files are streamed in
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# configmaps are stored in etcd, which limits their size to 1MiB
+CONFIGMAP_MAX_SIZE = 1024 * 1024
+
+# where the init container puts the input files
+INPUT_VOLUME = "trac-inputs"
+INPUT_DIR = "/trac/inputs"
+
+# where the task writes the output files, when they are collected by a sidecar
+OUTPUT_VOLUME = "trac-outputs"
+OUTPUT_DIR = "/trac/outputs"
+
+# shell snippet blocking till the task container exits
+# the pod shares its process namespace, and the task container is started
+# before the sidecar, so every process alive when the sidecar starts (except
+# the pause process and the sidecar itself) belongs to the task
+WAIT_FOR_TASK = (
+    "set -- /proc/[0-9]*; "
+    'for p in "$@"; do p=${p#/proc/}; '
+    '[ "$p" = 1 ] || [ "$p" = $$ ] && continue; '
+    "while [ -e /proc/$p ]; do sleep 1; done; "
+    "done"
+)
+
+
+def resolve_mount_path(mount_path):
+    """
+    Relative mount paths are relative to the app workspace
+    """
+    if not mount_path.startswith("/"):
+        mount_path = "/workspace/" + mount_path
+    return mount_path
+
+
+def iter_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterate over the content of a file in chunks
+    """
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class BaseStager(ABC):
+    """
+    Stage the input files of a job into its pod
+    """
+
+    def __init__(self, executor, staging_chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        self.executor = executor
+        self.chunk_size = int(staging_chunk_size)
+
+    @property
+    def k8s_client(self):
+        return self.executor.k8s_client
+
+    @abstractmethod
+    def stage_inputs(self, job_spec, inputs: List[FileDef], input_files: Dict):
+        """
+        Move the input files (name -> path on host) into the store, and add
+        what is needed to the job spec to mount them at their mount paths
+        """
+
+    @abstractmethod
+    def collect_outputs(self, job_spec, outputs: List[FileDef]):
+        """
+        Add what is needed to the job spec to collect the output files
+        """
+
+    @abstractmethod
+    def open_output(self, job_name, name) -> BinaryIO:
+        """
+        Open a collected output file of a job as a binary file object
+        """
+
+    def cleanup(self, job_name) -> None:
+        """
+        Remove the staged files of a job
+        """
+
+    def add_output_sidecar(self, job_spec, outputs, image, upload_command):
+        """
+        Let the task write its outputs to an emptyDir volume, and add a single
+        sidecar that runs upload_command once the task container exits
+        """
+        pod_spec = job_spec.spec.template.spec
+
+        pod_spec.volumes.append(
+            self.k8s_client.V1Volume(
+                name=OUTPUT_VOLUME,
+                empty_dir=self.k8s_client.V1EmptyDirVolumeSource(),
+            )
+        )
+
+        # the output files are mounted as files into the task container, so
+        # they need to exist beforehand, and be writable by the app user
+        targets = " ".join(shlex.quote(f"{OUTPUT_DIR}/{f.name}") for f in outputs)
+        pod_spec.init_containers = (pod_spec.init_containers or []) + [
+            self.k8s_client.V1Container(
+                name="trac-prepare-outputs",
+                image="busybox",
+                command=["sh", "-c"],
+                args=[f"touch {targets} && chmod 666 {targets}"],
+                volume_mounts=[
+                    self.k8s_client.V1VolumeMount(
+                        name=OUTPUT_VOLUME, mount_path=OUTPUT_DIR
+                    )
+                ],
+            )
+        ]
+
+        for f in outputs:
+            pod_spec.containers[0].volume_mounts.append(
+                self.k8s_client.V1VolumeMount(
+                    name=OUTPUT_VOLUME,
+                    mount_path=resolve_mount_path(f.mount_path),
+                    sub_path=f.name,
+                )
+            )
+
+        pod_spec.share_process_namespace = True
+        pod_spec.containers.append(
+            self.k8s_client.V1Container(
+                name="trac-collect-outputs",
+                image=image,
+                command=["sh", "-c"],
+                args=[WAIT_FOR_TASK + "; set -e; " + upload_command],
+                volume_mounts=[
+                    self.k8s_client.V1VolumeMount(
+                        name=OUTPUT_VOLUME, mount_path=OUTPUT_DIR, read_only=True
+                    )
+                ],
+            )
+        )
+
+
+class ConfigMapStager(BaseStager):
+    """
+    Put each input file into a configmap mounted into the pod
+
+    Only suitable for small text files, since configmaps are capped at 1MiB
+    and live in etcd. Use the pvc or object_store stagers for real datasets,
+    and for tasks with output files, which configmaps cannot bring back.
+    """
+
+    def stage_inputs(self, job_spec, inputs, input_files):
+        pod_spec = job_spec.spec.template.spec
+        job_name = job_spec.metadata.name
+
+        for f in inputs:
+            file_path_on_host = input_files[f.name]
+            if os.path.getsize(file_path_on_host) > CONFIGMAP_MAX_SIZE:
+                raise Exception(
+                    f"Input file {f.name} is too large for configmap staging, "
+                    "use the pvc or object_store input staging instead"
+                )
+
+            # read the file content and save it to the configmap
+            with open(file_path_on_host, "r") as file_on_host:
+                content = file_on_host.read()
+
+            # vol_name can only contain lower case letters, numbers, and dashes
+            vol_name = f.name.lower().replace("_", "-")
+            mount_path = resolve_mount_path(f.mount_path)
+
+            # create a configmap for input files
+            input_file_config_map = self.k8s_client.V1ConfigMap(
+                metadata=self.k8s_client.V1ObjectMeta(
+                    generate_name=self.executor.task_spec.name + "-input-",
+                    labels={
+                        "owned_by": job_name,
+                        "app": "trac",
+                    },
+                ),
+                data={os.path.basename(mount_path): content},
+            )
+            input_file_config_map = self.executor.core_api.create_namespaced_config_map(
+                namespace="default",
+                body=input_file_config_map,
+            )
+
+            # mount the configmap to the job, and set the file path to the file.mount_path
+            pod_spec.volumes.append(
+                self.k8s_client.V1Volume(
+                    name=vol_name,
+                    config_map=self.k8s_client.V1ConfigMapVolumeSource(
+                        name=input_file_config_map.metadata.name,
+                    ),
+                )
+            )
+
+            # since the key of the configmap is the file name, mount the key as a sub path
+            pod_spec.containers[0].volume_mounts.append(
+                self.k8s_client.V1VolumeMount(
+                    name=vol_name,
+                    mount_path=mount_path,
+                    sub_path=os.path.basename(mount_path),
+                )
+            )
+
+        # the configmaps are deleted together with the parameter configmap,
+        # by the owned_by label
+
+    def collect_outputs(self, job_spec, outputs):
+        # the pod log is the only way back without a store, and it is subject
+        # to log rotation and size limits, so the outputs would be truncated
+        if outputs:
+            raise Exception(
+                f"Output file {outputs[0].name} cannot be collected with configmap "
+                "staging, use the pvc or object_store input staging instead"
+            )
+
+    def open_output(self, job_name, name):
+        raise Exception(f"Output file {name} was not collected by configmap staging")
+
+
+class StreamingStager(BaseStager):
+    """
+    Upload the input files in chunks, and stream them into an emptyDir volume
+    of the pod with an init container that verifies their sha256 checksums
+    """
+
+    def __init__(self, executor, staging_image="busybox", **kwargs):
+        super().__init__(executor, **kwargs)
+        self.staging_image = staging_image
+        # the object keys of the uploaded chunks, by file name
+        self._parts: Dict[str, List[str]] = {}
+
+    @abstractmethod
+    def upload(self, job_name, name, path) -> str:
+        """
+        Upload a file in chunks, and return its sha256 checksum
+        """
+
+    @abstractmethod
+    def fetch_command(self, job_name, name, target) -> str:
+        """
+        Shell command run by the init container to stream a file to target
+        """
+
+    def volumes(self, job_name) -> list:
+        """
+        Additional volumes needed by the init container
+        """
+        return []
+
+    def volume_mounts(self, job_name) -> list:
+        """
+        Additional volume mounts of the init container
+        """
+        return []
+
+    def stage_inputs(self, job_spec, inputs, input_files):
+        pod_spec = job_spec.spec.template.spec
+        job_name = job_spec.metadata.name
+
+        commands = []
+        for f in inputs:
+            checksum = self.upload(job_name, f.name, input_files[f.name])
+            target = f"{INPUT_DIR}/{f.name}"
+            commands.append(self.fetch_command(job_name, f.name, target))
+            commands.append(
+                f"echo {shlex.quote(checksum + '  ' + target)} | sha256sum -c -"
+            )
+
+            pod_spec.containers[0].volume_mounts.append(
+                self.k8s_client.V1VolumeMount(
+                    name=INPUT_VOLUME,
+                    mount_path=resolve_mount_path(f.mount_path),
+                    sub_path=f.name,
+                )
+            )
+
+        if not commands:
+            return
+
+        pod_spec.volumes.append(
+            self.k8s_client.V1Volume(
+                name=INPUT_VOLUME,
+                empty_dir=self.k8s_client.V1EmptyDirVolumeSource(),
+            )
+        )
+        pod_spec.volumes.extend(self.volumes(job_name))
+        pod_spec.init_containers = (pod_spec.init_containers or []) + [
+            self.k8s_client.V1Container(
+                name="trac-stage-inputs",
+                image=self.staging_image,
+                command=["sh", "-c"],
+                args=["set -e; " + "; ".join(commands)],
+                volume_mounts=[
+                    self.k8s_client.V1VolumeMount(
+                        name=INPUT_VOLUME,
+                        mount_path=INPUT_DIR,
+                    )
+                ]
+                + self.volume_mounts(job_name),
+            )
+        ]
+
+
+class PVCStager(StreamingStager):
+    """
+    Stage the input files on a persistent volume claim shared with the host
+
+    staging_pvc is the name of the claim, and staging_dir is where the same
+    volume is mounted on the submitting host (e.g., an NFS share)
+    """
+
+    def __init__(self, executor, staging_pvc, staging_dir, **kwargs):
+        super().__init__(executor, **kwargs)
+        self.staging_pvc = staging_pvc
+        self.staging_dir = Path(staging_dir)
+
+    def upload(self, job_name, name, path):
+        target = self.staging_dir / job_name / "inputs" / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        checksum = hashlib.sha256()
+        with open(target, "wb") as f:
+            for chunk in iter_chunks(path, self.chunk_size):
+                checksum.update(chunk)
+                f.write(chunk)
+        return checksum.hexdigest()
+
+    def fetch_command(self, job_name, name, target):
+        return f"cp /trac/staging/inputs/{shlex.quote(name)} {shlex.quote(target)}"
+
+    def volumes(self, job_name):
+        return [
+            self.k8s_client.V1Volume(
+                name="trac-staging",
+                persistent_volume_claim=self.k8s_client.V1PersistentVolumeClaimVolumeSource(
+                    claim_name=self.staging_pvc,
+                    read_only=True,
+                ),
+            )
+        ]
+
+    def volume_mounts(self, job_name):
+        return [
+            self.k8s_client.V1VolumeMount(
+                name="trac-staging",
+                mount_path="/trac/staging",
+                sub_path=job_name,
+                read_only=True,
+            )
+        ]
+
+    def collect_outputs(self, job_spec, outputs):
+        # the task writes its outputs straight to the shared volume, so there
+        # is nothing to collect after the run
+        pod_spec = job_spec.spec.template.spec
+        job_name = job_spec.metadata.name
+
+        for f in outputs:
+            # the outputs are mounted as files, so they need to exist
+            # beforehand, and be writable by the app user
+            path = self.staging_dir / job_name / "outputs" / f.name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+            path.chmod(0o666)
+
+            pod_spec.containers[0].volume_mounts.append(
+                self.k8s_client.V1VolumeMount(
+                    name="trac-staging-outputs",
+                    mount_path=resolve_mount_path(f.mount_path),
+                    sub_path=f"{job_name}/outputs/{f.name}",
+                )
+            )
+
+        if outputs:
+            pod_spec.volumes.append(
+                self.k8s_client.V1Volume(
+                    name="trac-staging-outputs",
+                    persistent_volume_claim=self.k8s_client.V1PersistentVolumeClaimVolumeSource(
+                        claim_name=self.staging_pvc,
+                    ),
+                )
+            )
+
+    def open_output(self, job_name, name):
+        return open(self.staging_dir / job_name / "outputs" / name, "rb")
+
+    def cleanup(self, job_name):
+        shutil.rmtree(self.staging_dir / job_name, ignore_errors=True)
+
+
+class ObjectStoreStager(StreamingStager):
+    """
+    Stage the input files in a bucket of an S3-compatible object store
+
+    Each file is uploaded as numbered parts of chunk_size bytes, and a
+    manifest of all the objects of a job is kept to clean them up. The
+    bucket is expected to allow anonymous reads and writes from the host and
+    the cluster, e.g. a MinIO server dedicated to staging.
+    """
+
+    def __init__(
+        self,
+        executor,
+        staging_endpoint,
+        staging_bucket,
+        staging_upload_image="curlimages/curl",
+        **kwargs,
+    ):
+        super().__init__(executor, **kwargs)
+        self.staging_endpoint = staging_endpoint.rstrip("/")
+        self.staging_bucket = staging_bucket
+        self.staging_upload_image = staging_upload_image
+
+    def object_url(self, key):
+        return f"{self.staging_endpoint}/{self.staging_bucket}/{key}"
+
+    def _put(self, key, data):
+        # Content-MD5 lets the store reject a chunk corrupted on the way
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        resp = requests.put(
+            self.object_url(key), data=data, headers={"Content-MD5": md5}
+        )
+        resp.raise_for_status()
+
+    def _manifest(self, job_name) -> List[str]:
+        resp = requests.get(self.object_url(f"{job_name}/manifest.json"))
+        if resp.status_code == 404:
+            return []
+        resp.raise_for_status()
+        return resp.json()
+
+    def upload(self, job_name, name, path):
+        checksum = hashlib.sha256()
+        keys = []
+        for idx, chunk in enumerate(iter_chunks(path, self.chunk_size)):
+            checksum.update(chunk)
+            key = f"{job_name}/inputs/{name}/part-{idx:05d}"
+            self._put(key, chunk)
+            keys.append(key)
+        self._parts[name] = keys
+
+        self._record(job_name, keys)
+        return checksum.hexdigest()
+
+    def _record(self, job_name, keys):
+        """
+        Record the objects of the job, so that cleanup can find them
+        """
+        manifest = self._manifest(job_name) + keys
+        self._put(f"{job_name}/manifest.json", json.dumps(manifest).encode())
+
+    def fetch_command(self, job_name, name, target):
+        # an empty file has no parts, make sure the target exists anyway
+        commands = [f": > {shlex.quote(target)}"]
+        for key in self._parts[name]:
+            url = shlex.quote(self.object_url(key))
+            commands.append(f"wget -q -O - {url} >> {shlex.quote(target)}")
+        return "; ".join(commands)
+
+    def collect_outputs(self, job_spec, outputs):
+        if not outputs:
+            return
+
+        job_name = job_spec.metadata.name
+        keys = [f"{job_name}/outputs/{f.name}" for f in outputs]
+        self._record(job_name, keys)
+
+        # the sidecar streams each output file to the store from disk
+        upload_command = "; ".join(
+            f"curl -sSf -T {shlex.quote(OUTPUT_DIR + '/' + f.name)} "
+            f"{shlex.quote(self.object_url(key))}"
+            for f, key in zip(outputs, keys)
+        )
+        self.add_output_sidecar(
+            job_spec,
+            outputs,
+            image=self.staging_upload_image,
+            upload_command=upload_command,
+        )
+
+    def open_output(self, job_name, name):
+        resp = requests.get(self.object_url(f"{job_name}/outputs/{name}"), stream=True)
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        return resp.raw
+
+    def cleanup(self, job_name):
+        keys = self._manifest(job_name) + [f"{job_name}/manifest.json"]
+        for key in keys:
+            requests.delete(self.object_url(key))
+
+
+STAGERS = {
+    "configmap": ConfigMapStager,
+    "pvc": PVCStager,
+    "object_store": ObjectStoreStager,
+}
+
+
+def create_stager(executor, input_staging="configmap", **config) -> BaseStager:
+    """
+    Create the input stager configured for the executor
+    config takes the staging_* options of the backend config
+    """
+    if input_staging not in STAGERS:
+        raise Exception(f"Input staging {input_staging} not supported")
+    return STAGERS[input_staging](executor, **config)
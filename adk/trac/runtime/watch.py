@@ -0,0 +1,142 @@
+# fan out job status transitions from a single backend watch to all the
+# callers waiting for a job, so that waiting for N jobs costs one connection
+# to the backend instead of N pollers
+
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .base import JOB_STATUS, BaseExecutor
+
+LOG = logging.getLogger(__name__)
+
+FINAL_STATUSES = (JOB_STATUS.SUCCESS, JOB_STATUS.FAILED)
+
+
+class StatusWatcher:
+    """
+    Watch the status transitions of all the jobs of a backend, and dispatch
+    them to the subscribers of each job handle
+    """
+
+    def __init__(self, executor: BaseExecutor, poll_interval=1, retry_interval=5):
+        self.executor = executor
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[queue.Queue]] = {}
+        self._thread = None
+
+    def subscribe(self, job_handle: str) -> queue.Queue:
+        """
+        Subscribe to the status transitions of a job
+        Return a queue that receives the statuses of the job
+        """
+        subscription = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_handle, []).append(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="trac-status-watcher", daemon=True
+                )
+                self._thread.start()
+
+        # seed the subscription with the current status, in case the job
+        # moved before the subscription is registered
+        try:
+            subscription.put(self.executor.get_status(job_handle))
+        except Exception as e:
+            LOG.warning(f"Failed to get the status of job {job_handle}: {e}")
+
+        return subscription
+
+    def unsubscribe(self, job_handle: str, subscription: queue.Queue) -> None:
+        """
+        Stop receiving the status transitions of a job
+        """
+        with self._lock:
+            subscriptions = self._subscribers.get(job_handle, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscribers.pop(job_handle, None)
+
+    def wait(self, job_handle: str, timeout: Optional[float] = None) -> JOB_STATUS:
+        """
+        Block till the job succeeds or fails, and return its final status
+        Raise TimeoutError if it is still going after timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        subscription = self.subscribe(job_handle)
+        try:
+            while True:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.monotonic(), 0)
+                try:
+                    status = subscription.get(timeout=remaining)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"Job {job_handle} did not finish in {timeout} seconds"
+                    )
+                if status in FINAL_STATUSES:
+                    return status
+        finally:
+            self.unsubscribe(job_handle, subscription)
+
+    def _dispatch(self, job_handle, status):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(job_handle, []))
+        for subscription in subscriptions:
+            subscription.put(status)
+
+    def _resync(self):
+        """
+        Re-read the status of the subscribed jobs, and dispatch the final ones
+        The jobs finishing while the event stream is not connected, e.g.,
+        before the first connection or between two, are not missed this way
+        """
+        with self._lock:
+            job_handles = list(self._subscribers)
+        for job_handle in job_handles:
+            try:
+                status = self.executor.get_status(job_handle)
+            except Exception as e:
+                LOG.warning(f"Failed to get the status of job {job_handle}: {e}")
+                continue
+            if status in FINAL_STATUSES:
+                self._dispatch(job_handle, status)
+
+    def _run(self):
+        while True:
+            try:
+                # the executor connects before returning the stream, so the
+                # events after the resync are all received
+                events = self.executor.watch_status()
+                self._resync()
+                for job_handle, status in events:
+                    self._dispatch(job_handle, status)
+                # the backend closed the stream (e.g. a k8s watch timeout),
+                # start watching again
+            except NotImplementedError:
+                self._poll()
+            except Exception as e:
+                LOG.warning(f"Status watch failed, retrying: {e}")
+                time.sleep(self.retry_interval)
+
+    def _poll(self):
+        """
+        Poll the subscribed jobs, for backends without an event api
+        """
+        while True:
+            with self._lock:
+                job_handles = list(self._subscribers)
+            for job_handle in job_handles:
+                try:
+                    self._dispatch(job_handle, self.executor.get_status(job_handle))
+                except Exception as e:
+                    LOG.warning(f"Failed to get the status of job {job_handle}: {e}")
+            time.sleep(self.poll_interval)
@@ -0,0 +1,267 @@
+# validation of the input data files against the file schemas of a task
+#
+# the csv files are streamed row by row, and each cell is checked by a
+# converter compiled from the file_schema once per file, so that bad data is
+# reported before a container is started for it. The files in other formats
+# (json, parquet, ...) are left to the task
+
+import ast
+import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .task import FILE_TYPE, FileDef, TaskDef, get_validator
+
+LOG = logging.getLogger(__name__)
+
+INTEGER_PATTERN = re.compile(r"^[+-]?\d+$")
+BOOLEAN_VALUES = {
+    "true": True,
+    "false": False,
+    "1": True,
+    "0": False,
+}
+# extensions of the files checked as csv, on the host or in the container
+CSV_EXTENSIONS = {".csv"}
+# keywords of a property schema that do not constrain its values
+ANNOTATION_KEYWORDS = {"type", "title", "description", "default", "examples", "format"}
+
+
+def _to_integer(value: str):
+    if not INTEGER_PATTERN.match(value.strip()):
+        raise ValueError
+    return int(value)
+
+
+def _to_number(value: str):
+    return float(value)
+
+
+def _to_boolean(value: str):
+    return BOOLEAN_VALUES[value.strip().lower()]
+
+
+def _to_json(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    # csv writers format lists and dicts as python literals
+    try:
+        return ast.literal_eval(value)
+    except SyntaxError:
+        raise ValueError
+
+
+# converters of the csv cells, by json schema type
+CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    "string": str,
+    "integer": _to_integer,
+    "number": _to_number,
+    "boolean": _to_boolean,
+    "array": _to_json,
+    "object": _to_json,
+}
+
+
+class ColumnValidator:
+    """
+    Check the cells of a column against its property schema
+    """
+
+    def __init__(self, name: str, prop_schema: Dict):
+        self.name = name
+        types = prop_schema.get("type", "string")
+        types = types if isinstance(types, list) else [types]
+        self.nullable = "null" in types
+        self.types = [type_ for type_ in types if type_ in CONVERTERS]
+
+        # constraints beyond the type, e.g., enum or minimum, are checked
+        # on the converted value
+        self.validator = None
+        if set(prop_schema) - ANNOTATION_KEYWORDS:
+            self.validator = get_validator(prop_schema)
+
+    def error(self, value: str) -> Optional[str]:
+        """
+        Return the problem of a cell, None if it is valid
+        """
+        for type_ in self.types:
+            try:
+                converted = CONVERTERS[type_](value)
+                break
+            except (ValueError, KeyError):
+                continue
+        else:
+            if not self.types:
+                return None
+            return f"{value!r} is not of type {' or '.join(self.types)}"
+
+        if self.validator is not None:
+            error = next(self.validator.iter_errors(converted), None)
+            if error is not None:
+                return error.message
+        return None
+
+
+class FileValidator:
+    """
+    Check the rows of a csv file against the file_schema of a FileDef
+    """
+
+    def __init__(self, file_def: FileDef):
+        self.name = file_def.name
+        file_schema = file_def.file_schema
+        self.columns = {
+            name: ColumnValidator(name, prop_schema)
+            for name, prop_schema in file_schema.get("properties", {}).items()
+        }
+        self.required = list(file_schema.get("required", []))
+        self.additional_properties = file_schema.get("additionalProperties", True)
+
+    def validate_file(self, path: str, max_errors: int = 100) -> List[str]:
+        """
+        Stream a csv file and return its problems, at most max_errors of them
+        The rows are numbered as the lines of the file, the header being line 1
+        """
+        errors = []
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return [f"{self.name}: the file is empty"]
+
+            for name in self.required:
+                if name not in header:
+                    errors.append(f"{self.name}: column {name} is missing")
+            if self.additional_properties is False:
+                for name in header:
+                    if name not in self.columns:
+                        errors.append(f"{self.name}: column {name} is not expected")
+
+            # the checks of each position of the header
+            checks = [
+                (idx, self.columns[name], name in self.required)
+                for idx, name in enumerate(header)
+                if name in self.columns
+            ]
+
+            for row in reader:
+                if len(errors) > max_errors:
+                    break
+                if not row:
+                    continue
+                if len(row) != len(header):
+                    errors.append(
+                        f"{self.name} line {reader.line_num}: "
+                        f"{len(row)} cells, expected {len(header)}"
+                    )
+                    continue
+
+                for idx, column, required in checks:
+                    value = row[idx]
+                    if value == "":
+                        # empty cells are missing values
+                        if required and not column.nullable:
+                            errors.append(
+                                f"{self.name} line {reader.line_num} "
+                                f"column {column.name}: missing value"
+                            )
+                        continue
+
+                    error = column.error(value)
+                    if error is not None:
+                        errors.append(
+                            f"{self.name} line {reader.line_num} "
+                            f"column {column.name}: {error}"
+                        )
+
+        if len(errors) > max_errors:
+            errors = errors[:max_errors]
+            errors.append(f"{self.name}: too many errors, stopped checking")
+        return errors
+
+
+def is_csv_file(file_def: FileDef, path: str) -> bool:
+    """
+    Whether an input file is a csv file whose rows follow the file_schema
+    """
+    if file_def.file_schema.get("type", "object") != "object":
+        # the schema does not describe rows, e.g., a json array
+        return False
+    extensions = {os.path.splitext(p)[1].lower() for p in (path, file_def.mount_path)}
+    return bool(extensions & CSV_EXTENSIONS)
+
+
+def _validate_file(file_def: FileDef, path: str, max_errors: int) -> List[str]:
+    """
+    Check one input file, in the calling process or in a worker process
+    """
+    LOG.info(f"Validating input file {file_def.name}")
+    return FileValidator(file_def).validate_file(path, max_errors=max_errors)
+
+
+def validate_input_files(
+    task_spec: TaskDef,
+    input_files: Dict[str, str],
+    max_workers: int = 4,
+    max_errors: int = 100,
+) -> Dict[str, List[str]]:
+    """
+    Check the csv input files of a run against the file schemas of the task,
+    the files being checked in parallel processes
+    Return the problems by file name, only for the files having some
+    """
+    file_defs = {
+        file_def.name: file_def
+        for file_def in (task_spec.io.files if task_spec.io else [])
+        if file_def.type == FILE_TYPE.INPUT
+    }
+    names = []
+    for name, path in input_files.items():
+        if name not in file_defs:
+            continue
+        if not is_csv_file(file_defs[name], path):
+            LOG.info(f"Skipping the validation of input file {name}, not a csv file")
+            continue
+        names.append(name)
+    args = (
+        [file_defs[name] for name in names],
+        [input_files[name] for name in names],
+        itertools.repeat(max_errors),
+    )
+
+    if max_workers <= 1 or len(names) <= 1:
+        results = list(map(_validate_file, *args))
+    else:
+        # the checks are cpu bound python code, which threads would run one at
+        # a time, each worker process caches its own compiled validators
+        # the workers are spawned rather than forked, the callers (e.g. the
+        # trac-ui job workers) being multithreaded
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(names)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            results = list(executor.map(_validate_file, *args))
+
+    return {name: errors for name, errors in zip(names, results) if errors}
+
+
+def check_input_files(task_spec: TaskDef, input_files: Dict[str, str], **kwargs):
+    """
+    Raise an exception listing the problems of the input files, if any
+    """
+    errors = validate_input_files(task_spec, input_files, **kwargs)
+    if errors:
+        raise Exception(
+            "Invalid input data:\n"
+            + "\n".join(
+                error for file_errors in errors.values() for error in file_errors
+            )
+        )
@@ -1,11 +1,47 @@
 # definitions about tasks and apps
 
+import hashlib
+import json
 import re
+import threading
 from enum import Enum
 from typing import Any, Dict, List, Optional, Tuple
 
 from jsonschema import Draft202012Validator
-from pydantic import BaseModel, Field, root_validator, validator
+from pydantic import BaseModel, Field, PrivateAttr, root_validator, validator
+
+# compiled validators by canonical schema hash, shared by the meta-validation
+# of the specs and the validation of the data
+_VALIDATORS: Dict[str, Draft202012Validator] = {}
+_VALIDATORS_LOCK = threading.Lock()
+# number of validators kept, the oldest ones are dropped beyond it
+VALIDATOR_CACHE_SIZE = 1024
+
+
+def canonical_hash(schema: dict) -> str:
+    """
+    Hash of a json schema, the same whatever the order of its keys
+    """
+    canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_validator(schema: dict) -> Draft202012Validator:
+    """
+    Return the compiled validator of a json schema
+    The schema is checked against the meta schema the first time it is seen,
+    raise jsonschema.SchemaError if it is invalid
+    """
+    key = canonical_hash(schema)
+    validator = _VALIDATORS.get(key)
+    if validator is None:
+        Draft202012Validator.check_schema(schema)
+        validator = Draft202012Validator(schema)
+        with _VALIDATORS_LOCK:
+            if len(_VALIDATORS) >= VALIDATOR_CACHE_SIZE:
+                _VALIDATORS.pop(next(iter(_VALIDATORS)))
+            _VALIDATORS[key] = validator
+    return validator
 
 
 class FILE_TYPE(str, Enum):
@@ -42,7 +78,8 @@ class FileDef(BaseModel):
         Validate if schema is a valid json schema object
         """
         try:
-            Draft202012Validator.check_schema(v)
+            # the same schemas are parsed over and over, check each one once
+            get_validator(v)
         except Exception as e:
             raise ValueError(f"Invalid schema: {e}")
         return v
@@ -52,6 +89,55 @@ class FilesSpec(BaseModel):
     files: List[FileDef]
 
 
+# suffixes of memory quantities, case insensitive, docker style: m is mega
+# the backends are given the number of bytes, never the suffixed value
+MEMORY_UNITS = {
+    "": 1,
+    "k": 1000,
+    "m": 1000**2,
+    "g": 1000**3,
+    "t": 1000**4,
+    "ki": 1024,
+    "mi": 1024**2,
+    "gi": 1024**3,
+    "ti": 1024**4,
+}
+
+
+def parse_memory(value) -> int:
+    """
+    Parse a memory quantity to a number of bytes
+    e.g., 512Mi, 2G, 1.5gi, 1024
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = re.match(r"^\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*?)[bB]?\s*$", str(value))
+    if not match or match.group(2).lower() not in MEMORY_UNITS:
+        raise ValueError(f"Invalid memory quantity {value}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).lower()])
+
+
+# env variables sizing the thread pools of the numerical libraries
+THREAD_ENVS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+class Toleration(BaseModel):
+    """
+    A kubernetes toleration, letting the task run on tainted nodes
+    """
+
+    key: Optional[str] = None
+    operator: str = "Equal"
+    value: Optional[str] = None
+    effect: Optional[str] = None
+
+
 class ContainerSpec(BaseModel):
     image: str
     tag: str
@@ -59,6 +145,43 @@ class ContainerSpec(BaseModel):
     args: Optional[List[str]]
     # envs, a list of (name, value) pairs
     envs: Optional[List[Tuple[str, str]]] = []
+    # resources of the container, number of cpus and memory quantity
+    # the backends both request and cap the container at these values
+    cpu: Optional[float] = None
+    memory: Optional[str] = None
+    # size of /dev/shm, a memory quantity
+    shm_size: Optional[str] = None
+    # kubernetes node labels and tolerations, ignored by docker
+    node_selector: Optional[Dict[str, str]] = None
+    tolerations: Optional[List[Toleration]] = None
+    # number of threads of the numerical libraries, defaults to the cpus
+    threads: Optional[int] = None
+
+    @validator("memory", "shm_size")
+    def validate_memory(cls, v):
+        """
+        Validate if memory is a valid memory quantity
+        """
+        if v is not None:
+            parse_memory(v)
+        return v
+
+    def resolved_envs(self) -> List[Tuple[str, str]]:
+        """
+        The envs of the container, plus the thread counts of the numerical
+        libraries unless the envs set them already
+        """
+        envs = list(self.envs or [])
+        threads = self.threads
+        if threads is None and self.cpu:
+            threads = max(1, int(self.cpu))
+        if threads is None:
+            return envs
+
+        names = {env[0] for env in envs}
+        return envs + [
+            (name, str(threads)) for name in THREAD_ENVS if name not in names
+        ]
 
 
 class PythonHandlerSpec(BaseModel):
@@ -97,6 +220,18 @@ class TaskDef(BaseModel):
     # handler definition
     handler: Optional[PythonHandlerSpec] = None
 
+    # compiled on first use, see run_config_validator
+    _run_config_validator = PrivateAttr(default=None)
+
+    def run_config_validator(self) -> "RunConfigValidator":
+        """
+        Return the validator of the run configs of the task
+        It is compiled once, and shared by all the validations of the task
+        """
+        if self._run_config_validator is None:
+            self._run_config_validator = RunConfigValidator(self)
+        return self._run_config_validator
+
     @validator("name")
     def validate_name(cls, v):
         """
@@ -134,3 +269,112 @@ class RunConfig(BaseModel):
 
     parameters: Dict[str, Any] = Field(..., description="Parameter values")
     input_files: Dict[str, str] = Field(..., description="Input file locations")
+
+
+# python types of the parameter types
+PARAMETER_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "float": (int, float),
+    "boolean": (bool,),
+}
+
+
+class ParametersValidator:
+    """
+    Check parameter values against a list of parameter definitions
+
+    The definitions are indexed by name once, so that checking a parameter
+    set costs a dict lookup per parameter
+    """
+
+    def __init__(self, parameter_defs: List[ParameterDef]):
+        self.param_defs = {param_def.name: param_def for param_def in parameter_defs}
+
+        self.types = {}
+        for param_def in parameter_defs:
+            if param_def.type not in PARAMETER_TYPES:
+                raise Exception(f"Unknown parameter type {param_def.type}")
+            self.types[param_def.name] = PARAMETER_TYPES[param_def.type]
+
+        # the parameters without a default have to be provided
+        self.defaults = {
+            param_def.name: param_def.default
+            for param_def in parameter_defs
+            if param_def.default is not None
+        }
+        self.required = [name for name in self.param_defs if name not in self.defaults]
+
+    def errors(self, parameters: Dict[str, Any]) -> List[str]:
+        """
+        Return all the problems of a parameter set, empty if it is valid
+        """
+        errors = []
+        for name, value in parameters.items():
+            expected_types = self.types.get(name)
+            if expected_types is None:
+                errors.append(f"Parameter {name} not found in task_spec")
+            # bool is an int in python, but not in json schema
+            elif not isinstance(value, expected_types) or (
+                isinstance(value, bool) and bool not in expected_types
+            ):
+                errors.append(
+                    f"Parameter {name} has type {type(value).__name__}, "
+                    f"expected {self.param_defs[name].type}"
+                )
+
+        for name in self.required:
+            if name not in parameters:
+                errors.append(f"Parameter {name} is missing")
+        return errors
+
+    def with_defaults(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the parameter set completed with the defaults
+        """
+        return {**self.defaults, **parameters}
+
+
+class RunConfigValidator:
+    """
+    Check run configs against a task spec
+    """
+
+    def __init__(self, task_spec: TaskDef):
+        self.parameters = ParametersValidator(
+            task_spec.parameter.parameters if task_spec.parameter else []
+        )
+
+        files = task_spec.io.files if task_spec.io else []
+        self.input_files = {
+            file_def.name for file_def in files if file_def.type == FILE_TYPE.INPUT
+        }
+        self.output_files = {
+            file_def.name for file_def in files if file_def.type == FILE_TYPE.OUTPUT
+        }
+
+    def errors(self, run_config: RunConfig) -> List[str]:
+        """
+        Return all the problems of a run config, empty if it is valid
+        """
+        errors = self.parameters.errors(run_config.parameters)
+
+        for name in run_config.input_files:
+            if name in self.output_files:
+                errors.append(f"File {name} is an output of the task")
+            elif name not in self.input_files:
+                errors.append(f"Input file {name} not found in task_spec")
+
+        for name in self.input_files:
+            if name not in run_config.input_files:
+                errors.append(f"Input file {name} is missing")
+        return errors
+
+    def validate(self, run_config: RunConfig) -> None:
+        """
+        Raise an exception listing all the problems of a run config
+        """
+        errors = self.errors(run_config)
+        if errors:
+            raise Exception("Invalid run config: " + "; ".join(errors))
@@ -1,14 +1,16 @@
-from typing import List
+import json
 
 from apps.data_gateway.models import DataSet
 from django import forms
-from trac.schema.task import ParameterDef
+from trac.runtime.batch import expand_parameter_grid
+from trac.schema.task import TaskDef
 
 
-def create_form_from_parameter_schema(
-    parameter_schema: List[ParameterDef], instance_id
-):
-    # paramter_schema is a jsonschema
+def create_form_from_task_spec(task_spec: TaskDef, instance_id):
+    parameter_schema = task_spec.parameter.parameters if task_spec.parameter else []
+    # compiled once per task spec, see TaskDef.run_config_validator
+    validator = task_spec.run_config_validator().parameters
+
     # create a dynamic form based on the parameter_schema
     class AppRunForm(forms.Form):
 
@@ -59,9 +61,81 @@ def create_form_from_parameter_schema(
             parameters = {}
             param_names = [param_def.name for param_def in parameter_schema]
             for field in param_names:
-                value = cleaned_data.pop(field)
-                parameters[field] = value
+                value = cleaned_data.pop(field, None)
+                # the fields left empty take the default of the parameter
+                if value is not None and value != "":
+                    parameters[field] = value
+            if any(field in self.errors for field in param_names):
+                return cleaned_data
+
+            parameters = validator.with_defaults(parameters)
+            errors = validator.errors(parameters)
+            if errors:
+                raise forms.ValidationError(errors)
             cleaned_data["parameters"] = parameters
             return cleaned_data
 
     return AppRunForm
+
+
+def create_batch_form_from_task_spec(task_spec: TaskDef, instance_id):
+    parameter_schema = task_spec.parameter.parameters if task_spec.parameter else []
+    # compiled once per task spec, and used for all the parameter sets of the grid
+    validator = task_spec.run_config_validator().parameters
+
+    # a form taking a grid or a list of parameter sets as json
+    class BatchRunForm(forms.Form):
+
+        name = forms.CharField(max_length=100)
+        description = forms.CharField(max_length=100)
+        dataset = forms.ModelChoiceField(
+            queryset=DataSet.objects.filter(app__pk=instance_id).all(),
+        )
+        parameter_grid = forms.CharField(
+            widget=forms.Textarea,
+            help_text="A json dict whose list values are swept, "
+            "or a json list of parameter dicts",
+            initial=json.dumps(
+                {param_def.name: [param_def.default] for param_def in parameter_schema},
+                indent=4,
+            ),
+        )
+        max_concurrency = forms.IntegerField(
+            min_value=1,
+            initial=4,
+            help_text="Maximum number of runs at a time",
+        )
+
+        def clean(self):
+            cleaned_data = super(BatchRunForm, self).clean()
+            if "parameter_grid" not in cleaned_data:
+                return cleaned_data
+
+            try:
+                parameter_grid = json.loads(cleaned_data["parameter_grid"])
+                parameter_sets = expand_parameter_grid(parameter_grid)
+            except Exception as e:
+                raise forms.ValidationError({"parameter_grid": str(e)})
+
+            if not parameter_sets:
+                raise forms.ValidationError(
+                    {"parameter_grid": "The grid has no parameter set"}
+                )
+
+            parameter_sets = [
+                validator.with_defaults(parameters) for parameters in parameter_sets
+            ]
+            # report each problem once, however many sets share it
+            errors = []
+            for parameters in parameter_sets:
+                for error in validator.errors(parameters):
+                    if error not in errors:
+                        errors.append(error)
+            if errors:
+                raise forms.ValidationError({"parameter_grid": errors})
+
+            cleaned_data["parameter_grid"] = parameter_grid
+            cleaned_data["parameter_sets"] = parameter_sets
+            return cleaned_data
+
+    return BatchRunForm
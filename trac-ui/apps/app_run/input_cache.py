@@ -0,0 +1,202 @@
+"""
+Cache of the input files materialized for app runs
+
+The files of a dataset are written once per content version, identified by
+the dataset id, its revision and its schema hash, and reused by all the runs
+on that version. Least recently used entries are evicted once the cache grows
+over its size budget.
+
+The entries in use are pinned: an entry is never evicted while the input
+files of a PENDING or RUNNING run, or of the batch of such a run, point to it.
+Pinning an entry and evicting entries hold a lock on the cache directory, so
+that an entry cannot be evicted between its lookup and its pinning, even by
+another process.
+"""
+
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Set
+
+from django.conf import settings
+
+from ..data_gateway.models import DataSet
+from ..data_gateway.storage import STORAGE_ENGINES
+from .models import AppRun, RunBatch
+
+LOG = logging.getLogger(__name__)
+
+# entries being written are prefixed, and never served
+PARTIAL_PREFIX = ".partial-"
+# seconds after which a partial entry is considered abandoned
+PARTIAL_MAX_AGE = 3600
+
+
+class InputCache:
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = (
+            cache_dir
+            or getattr(settings, "TRAC_INPUT_CACHE_DIR", None)
+            or os.path.join(tempfile.gettempdir(), "trac-inputs")
+        )
+        if max_bytes is None:
+            max_bytes = getattr(settings, "TRAC_INPUT_CACHE_MAX_BYTES", 10 * 1024**3)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, dataset: DataSet) -> str:
+        """
+        The cache key of the current content of a dataset
+        """
+        if dataset.backend not in STORAGE_ENGINES:
+            # the content of external backends is not versioned, never reuse it
+            return f"{dataset.id}-{uuid.uuid4().hex}"
+        return f"{dataset.id}-{dataset.revision}-{dataset.schema_hash()[:16]}"
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the lock of the cache, shared by all the processes using it
+        """
+        fd = os.open(self.cache_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def get_or_create(
+        self,
+        dataset: DataSet,
+        materialize,
+        pin: Optional[Callable[[Dict[str, str]], None]] = None,
+    ) -> Dict[str, str]:
+        """
+        Return the input files of the dataset, as a dict of file_name: file_path
+        materialize(dataset, dir) writes them to dir on a cache miss
+        pin(files) records the users of the files, e.g., as the input files of
+        a run, it is called before any eviction can remove them
+        """
+        # read the revision before the records, a write in between only
+        # makes the entry newer than its key
+        dataset.refresh_from_db(fields=["revision"])
+        key = self.key(dataset)
+        path = os.path.join(self.cache_dir, key)
+
+        files = {
+            file_def.name: os.path.join(path, file_def.name + ".csv")
+            for file_def in dataset.schema["input_schema"]
+        }
+
+        with self._locked():
+            if os.path.isdir(path):
+                LOG.info(f"Reusing the input files of dataset {dataset.id} in {path}")
+                # mark the entry as recently used
+                os.utime(path)
+                if pin is not None:
+                    pin(files)
+                return files
+
+        partial_path = tempfile.mkdtemp(prefix=PARTIAL_PREFIX, dir=self.cache_dir)
+        try:
+            materialize(dataset, partial_path)
+        except Exception:
+            shutil.rmtree(partial_path, ignore_errors=True)
+            raise
+
+        with self._locked():
+            if os.path.isdir(path):
+                # another worker published the same entry first
+                shutil.rmtree(partial_path, ignore_errors=True)
+            else:
+                try:
+                    # publish the entry atomically
+                    os.rename(partial_path, path)
+                except OSError:
+                    shutil.rmtree(partial_path, ignore_errors=True)
+                    raise
+            if pin is not None:
+                pin(files)
+            self._evict(keep=key)
+        return files
+
+    def pinned(self) -> Set[str]:
+        """
+        Names of the entries used by the runs that are not finished
+        """
+        active = AppRun.objects.filter(status__in=["PENDING", "RUNNING"])
+        mappings = list(
+            active.filter(input_files__isnull=False).values_list(
+                "input_files", flat=True
+            )
+        )
+        mappings += RunBatch.objects.filter(
+            id__in=active.values("batch_id"), input_files__isnull=False
+        ).values_list("input_files", flat=True)
+
+        cache_dir = os.path.realpath(self.cache_dir)
+        names = set()
+        for mapping in mappings:
+            for file_path in mapping.values():
+                entry_path = os.path.dirname(os.path.realpath(file_path))
+                if os.path.dirname(entry_path) == cache_dir:
+                    names.add(os.path.basename(entry_path))
+        return names
+
+    def evict(self, keep=None) -> None:
+        """
+        Remove the least recently used entries till the cache fits its budget
+        The pinned entries are kept
+        """
+        with self._locked():
+            self._evict(keep=keep)
+
+    def _evict(self, keep=None) -> None:
+        """
+        Must be called with the lock held
+        """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+
+            if name.startswith(PARTIAL_PREFIX):
+                if now - mtime > PARTIAL_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+
+            entries.append((mtime, name, path, _dir_size(path)))
+
+        total = sum(size for _, _, _, size in entries)
+        if total <= self.max_bytes:
+            return
+
+        pinned = self.pinned()
+        for _, name, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep or name in pinned:
+                continue
+            LOG.info(f"Evicting the input files in {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def _dir_size(path) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
@@ -0,0 +1,155 @@
+"""
+Background job manager for app runs
+
+App runs are queued in the database as AppRun rows in PENDING status.
+A dispatcher thread claims them one by one and hands them over to a pool
+of worker threads, so that creating a run returns right away instead of
+pinning a web worker for the whole model run.
+
+The manager starts with the web server processes, from the wsgi and asgi
+entry points, or runs on its own with `python manage.py run_jobs`.
+
+The jobs of the runs are submitted through the scheduler of the adk, set up
+from the TRAC_SCHEDULER setting, which holds them back till the backend and
+app limits allow them.
+
+Claimed runs are leased: a heartbeat thread renews the runs executed by the
+process, and recovers the RUNNING runs of the workers that stopped renewing
+theirs, e.g., because their process died.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from trac.runtime.scheduler import configure_scheduler
+
+from .services import claim_next_run, execute_run, recover_stale_runs, renew_runs
+
+LOG = logging.getLogger(__name__)
+
+
+class JobManager:
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, max_workers, poll_interval=5, lease=60):
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        configure_scheduler(**getattr(settings, "TRAC_SCHEDULER", {}))
+
+        # the runs executed by this process
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._slots = threading.Semaphore(max_workers)
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="trac-job"
+        )
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name="trac-job-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+        self._heartbeat = threading.Thread(
+            target=self._heartbeat_loop, name="trac-job-heartbeat", daemon=True
+        )
+        self._heartbeat.start()
+
+    @classmethod
+    def instance(cls) -> "JobManager":
+        """
+        Return the job manager of this process, start it if needed
+        """
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(
+                    max_workers=getattr(settings, "TRAC_JOB_WORKERS", 4),
+                    poll_interval=getattr(settings, "TRAC_JOB_POLL_INTERVAL", 5),
+                    lease=getattr(settings, "TRAC_JOB_LEASE", 60),
+                )
+            return cls._instance
+
+    @classmethod
+    def start(cls) -> None:
+        """
+        Start the job manager of a web server process, so that the runs queued
+        or left running before the process started are picked up right away
+        """
+        if getattr(settings, "TRAC_JOB_WORKERS", 4) == 0:
+            # runs are executed by a dedicated `manage.py run_jobs` process
+            return
+        cls.instance()
+
+    @classmethod
+    def enqueue(cls, app_run) -> None:
+        """
+        Queue a saved app run for execution
+        The run is persisted as PENDING already, so here we only make sure
+        a dispatcher is around to pick it up
+        """
+        if getattr(settings, "TRAC_JOB_WORKERS", 4) == 0:
+            # runs are executed by a dedicated `manage.py run_jobs` process
+            return
+        cls.instance()._wakeup.set()
+
+    def join(self) -> None:
+        """
+        Block till the dispatcher exits, which is never
+        """
+        self._dispatcher.join()
+
+    def _dispatch_loop(self):
+        while True:
+            # wait for a free worker before claiming a run, so that claimed
+            # runs never sit in the local pool while other processes are idle
+            self._slots.acquire()
+            self._wakeup.clear()
+            try:
+                app_run = claim_next_run()
+            except Exception:
+                LOG.exception("Failed to claim the next run")
+                app_run = None
+            finally:
+                close_old_connections()
+
+            if app_run is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=self.poll_interval)
+                continue
+
+            LOG.info(f"Starting run {app_run.id}")
+            with self._active_lock:
+                self._active.add(app_run.id)
+            self._pool.submit(self._execute, app_run)
+
+    def _heartbeat_loop(self):
+        while True:
+            try:
+                with self._active_lock:
+                    run_ids = list(self._active)
+                renew_runs(run_ids)
+                if recover_stale_runs(self.lease):
+                    self._wakeup.set()
+            except Exception:
+                LOG.exception("Failed to renew the leases of the runs")
+            finally:
+                close_old_connections()
+            time.sleep(self.poll_interval)
+
+    def _execute(self, app_run):
+        try:
+            execute_run(app_run)
+        except Exception:
+            LOG.exception(f"Unexpected error while executing run {app_run.id}")
+        finally:
+            with self._active_lock:
+                self._active.discard(app_run.id)
+            # each worker thread owns its db connection
+            connection.close()
+            self._slots.release()
+            self._wakeup.set()
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...jobs import JobManager
+
+
+class Command(BaseCommand):
+    help = "Run the app run workers, executing the runs queued in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Number of worker threads"
+        )
+
+    def handle(self, *args, **options):
+        manager = JobManager(
+            max_workers=options["workers"],
+            poll_interval=getattr(settings, "TRAC_JOB_POLL_INTERVAL", 5),
+            lease=getattr(settings, "TRAC_JOB_LEASE", 60),
+        )
+        self.stdout.write(f"Running with {manager.max_workers} workers")
+        manager.join()
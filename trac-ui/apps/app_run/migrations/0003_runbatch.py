@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0007_dataset_revision"),
+        ("trac_app", "0001_initial"),
+        ("app_run", "0002_apprun_job_handle_apprun_output_dataset"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RunBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("description", models.CharField(max_length=100)),
+                ("parameter_grid", models.JSONField()),
+                ("max_concurrency", models.PositiveIntegerField(default=4)),
+                ("input_files", models.JSONField(blank=True, null=True)),
+                (
+                    "app",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="batches",
+                        to="trac_app.appinstance",
+                    ),
+                ),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="batches",
+                        to="data_gateway.dataset",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="apprun",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="runs",
+                to="app_run.runbatch",
+            ),
+        ),
+    ]
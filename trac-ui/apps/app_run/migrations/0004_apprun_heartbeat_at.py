@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0003_runbatch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apprun",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def fail_legacy_runs(apps, schema_editor):
+    """
+    Close the PENDING runs left by the previous versions, which never executed
+    them, so that the job manager does not start them now
+    """
+    AppRun = apps.get_model("app_run", "AppRun")
+    AppRun.objects.filter(
+        status="PENDING", batch__isnull=True, job_handle__isnull=True
+    ).update(status="FAILED", logs="The run was created but never executed")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0004_apprun_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_legacy_runs, migrations.RunPython.noop),
+    ]
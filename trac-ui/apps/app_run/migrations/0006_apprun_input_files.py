@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0005_fail_legacy_pending_runs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="apprun",
+            name="input_files",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
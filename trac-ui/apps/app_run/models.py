@@ -3,6 +3,30 @@ from apps.trac_app.models import AppInstance
 from django.db import models
 
 
+class RunBatch(models.Model):
+    """
+    A sweep of runs of an app over one dataset, one run per parameter set
+    """
+
+    name = models.CharField(max_length=100)
+    description = models.CharField(max_length=100)
+    app = models.ForeignKey(
+        AppInstance, on_delete=models.CASCADE, related_name="batches"
+    )
+    dataset = models.ForeignKey(
+        DataSet, on_delete=models.CASCADE, related_name="batches"
+    )
+    # the grid or list of parameter sets, as submitted
+    parameter_grid = models.JSONField()
+    # maximum number of runs of the batch running at a time
+    max_concurrency = models.PositiveIntegerField(default=4)
+    # the input files shared by all the runs, set by the first run
+    input_files = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
 class AppRun(models.Model):
     name = models.CharField(max_length=100)
     description = models.CharField(max_length=100)
@@ -25,6 +49,13 @@ class AppRun(models.Model):
     output_artifacts = models.JSONField(null=True, blank=True)
     logs = models.TextField(null=True, blank=True)
     job_handle = models.CharField(max_length=100, null=True, blank=True)
+    # renewed by the worker executing the run, while it is RUNNING
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # the input files of the run, kept in the input cache till it finishes
+    input_files = models.JSONField(null=True, blank=True)
+    batch = models.ForeignKey(
+        RunBatch, on_delete=models.CASCADE, related_name="runs", null=True, blank=True
+    )
 
     def __str__(self):
         return self.name
@@ -1,75 +1,111 @@
 import csv
 import io
+import itertools
+import json
 import logging
-import tempfile
-import time
+import os
 import uuid
-from typing import Dict, List
-
-from trac.runtime.run import JOB_STATUS, RunConfig, get_output, get_status, submit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from trac.runtime.run import (
+    JOB_STATUS,
+    RunConfig,
+    get_logs,
+    open_output,
+    wait_for_completion,
+)
+from trac.runtime.scheduler import PRIORITY, get_scheduler
+from trac.schema.data import check_input_files
 from trac.schema.task import FileDef
 
-from ..data_gateway.models import DataSet, Resource
+from ..data_gateway.export import iter_csv
+from ..data_gateway.models import DataSet
 from ..data_gateway.services.gsheet import GoogleSheetsDataBackend
+from ..data_gateway.storage import STORAGE_ENGINES, get_storage
 from ..trac_app.models import AppDefinition, AppInstance
-from .models import AppRun
+from .input_cache import InputCache
+from .models import AppRun, RunBatch
 
 LOG = logging.getLogger(__name__)
 
 
-def pull_data_to_local_tempdir(dataset: DataSet, tempdir) -> Dict[str, str]:
+def write_csv_file(file_def: FileDef, records: Iterable[Dict], path: str) -> int:
     """
-    Pull the data files to a local temp dir
-    Return a dict of file_name: file_path
+    Stream records to a csv file
+    Return the number of rows written
     """
+    num_rows = 0
 
-    input_schema: List[FileDef] = dataset.schema["input_schema"]
-    result = {}
+    def counted(records):
+        nonlocal num_rows
+        for record in records:
+            num_rows += 1
+            yield record
 
-    if dataset.backend == "db":
-        # get the data from the db
-        for file_def in input_schema:
-            resource_type = file_def.name
+    with open(path, "wb") as f:
+        for chunk in iter_csv(file_def, counted(records)):
+            f.write(chunk)
 
-            # get the data from the db
-            resources = dataset.resources.filter(resource_type=resource_type)
-            file_name = resource_type + ".csv"
+    return num_rows
 
-            LOG.info(f"Writing {file_name} to {tempdir}")
 
-            with open(tempdir + "/" + file_name, "w") as f:
-                writer = csv.DictWriter(
-                    f, fieldnames=file_def.file_schema["properties"].keys()
-                )
-                writer.writeheader()
-                writer.writerows([resource.value for resource in resources])
+def pull_data_to_local_tempdir(dataset: DataSet, tempdir) -> Dict[str, str]:
+    """
+    Pull the data files to a local temp dir
+    Return a dict of file_name: file_path
+    """
+
+    input_schema: List[FileDef] = dataset.schema["input_schema"]
+    result = {
+        file_def.name: tempdir + "/" + file_def.name + ".csv"
+        for file_def in input_schema
+    }
+
+    if dataset.backend in STORAGE_ENGINES:
+        # get the data from the db, one thread per resource type
+        storage = get_storage(dataset)
+
+        def pull(file_def):
+            LOG.info(f"Writing {file_def.name}.csv to {tempdir}")
+            records = storage.iter_records(dataset, file_def.name)
+            num_rows = write_csv_file(file_def, records, result[file_def.name])
+            LOG.info(f"Number of rows of {file_def.name}: {num_rows}")
+
+        max_workers = getattr(settings, "TRAC_MATERIALIZE_WORKERS", 4)
+        if max_workers <= 1 or len(input_schema) <= 1:
+            for file_def in input_schema:
+                pull(file_def)
+        else:
 
-            LOG.info(f"Number of rows: {len(resources)}")
+            def pull_in_thread(file_def):
+                try:
+                    pull(file_def)
+                finally:
+                    # each thread owns its db connection
+                    connection.close()
 
-            result[resource_type] = tempdir + "/" + file_name
+            with ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="trac-pull"
+            ) as executor:
+                # raise the first error, if any
+                list(executor.map(pull_in_thread, input_schema))
 
     elif dataset.backend == "gsheet":
         # get the data from the gsheet
         records = GoogleSheetsDataBackend.read_spreadsheet(dataset.url)
 
         for file_def in input_schema:
-            resource_type = file_def.name
-
-            resources = records[resource_type]
-
-            file_name = resource_type + ".csv"
-            LOG.info(f"Writing {file_name} to {tempdir}")
-
-            with open(tempdir + "/" + file_name, "w") as f:
-                writer = csv.DictWriter(
-                    f, fieldnames=file_def.file_schema["properties"].keys()
-                )
-                writer.writeheader()
-                writer.writerows(resources)
-
-            LOG.info(f"Number of rows: {len(resources)}")
-
-            result[resource_type] = tempdir + "/" + file_name
+            LOG.info(f"Writing {file_def.name}.csv to {tempdir}")
+            num_rows = write_csv_file(
+                file_def, records[file_def.name], result[file_def.name]
+            )
+            LOG.info(f"Number of rows of {file_def.name}: {num_rows}")
 
     else:
         raise Exception("Unknown backend")
@@ -94,9 +130,36 @@ def run_app(
     # get the task spec
     task_spec = app_def.task_spec()
 
-    # pull the dataset files to a local temp folder
-    tempdir = tempfile.mkdtemp()
-    file_mapping = pull_data_to_local_tempdir(dataset, tempdir)
+    batch = app_run.batch
+    if (
+        batch
+        and batch.input_files
+        and all(os.path.exists(path) for path in batch.input_files.values())
+    ):
+        # the runs of a batch share the inputs of its first run, they stay in
+        # the input cache while the batch has runs going, this one included
+        file_mapping = batch.input_files
+        AppRun.objects.filter(id=app_run.id).update(input_files=file_mapping)
+    else:
+
+        def materialize(dataset, tempdir):
+            file_mapping = pull_data_to_local_tempdir(dataset, tempdir)
+            # check the data before paying for the container, invalid files
+            # are never cached
+            if getattr(settings, "TRAC_VALIDATE_INPUTS", True):
+                check_input_files(task_spec, file_mapping)
+            return file_mapping
+
+        def pin(file_mapping):
+            # the input cache keeps the files of the runs that are going
+            AppRun.objects.filter(id=app_run.id).update(input_files=file_mapping)
+            if batch:
+                RunBatch.objects.filter(id=batch.id, input_files__isnull=True).update(
+                    input_files=file_mapping
+                )
+
+        # pull the dataset files to a local folder, unless they are cached already
+        file_mapping = InputCache().get_or_create(dataset, materialize, pin=pin)
 
     # create a runconfig object
     run_config = RunConfig(
@@ -104,31 +167,179 @@ def run_app(
         input_files=file_mapping,
     )
 
-    job_handle = submit(
+    # the job is queued in the scheduler of the process till its limits
+    # allow it, the runs of a batch yield to the single runs
+    job = get_scheduler().submit(
         task_spec=task_spec,
         run_config=run_config,
         backend="docker",
+        priority=PRIORITY.LOW if batch else PRIORITY.NORMAL,
     )
+    job_handle = job.wait_submitted()
 
-    print(job_handle)
+    LOG.info(f"Submitted run {app_run.id} as job {job_handle}")
 
     return job_handle
 
 
-def wait_for_job_completion(job_handle):
+def wait_for_job_completion(job_handle, timeout=None):
     """
     Wait till the job to be finished, either succeed or failed
+    Wait forever when timeout is None
     """
-    # TODO: hardcoded timeout
-    for _ in range(10):
-        status = get_status(job_handle)
-        LOG.info(f"Job status: {status}")
-        if status == JOB_STATUS.SUCCESS:
-            return job_handle
-        elif status == JOB_STATUS.FAILED:
-            raise Exception("Job failed")
-        else:
-            time.sleep(1)
+    # all the waiting runs share one status watch on the backend
+    try:
+        status = wait_for_completion(job_handle, timeout=timeout)
+    except TimeoutError:
+        raise Exception(f"Job did not finish in {timeout} seconds")
+
+    LOG.info(f"Job status: {status}")
+    if status == JOB_STATUS.FAILED:
+        raise Exception("Job failed")
+    return job_handle
+
+
+def execute_run(app_run: AppRun) -> AppRun:
+    """
+    Run an app run to the end, and record its status, job handle and logs
+    The run is expected to be claimed (in RUNNING status) already
+    """
+    try:
+        job_handle = run_app(app_run)
+        app_run.job_handle = job_handle
+        app_run.save(update_fields=["job_handle"])
+
+        try:
+            wait_for_job_completion(
+                job_handle, timeout=getattr(settings, "TRAC_JOB_TIMEOUT", None)
+            )
+            app_run.status = "COMPLETED"
+        except Exception as e:
+            LOG.warning(f"Run {app_run.id} failed: {e}")
+            app_run.status = "FAILED"
+
+        app_run.logs = get_logs(job_handle)
+    except Exception as e:
+        LOG.exception(f"Failed to execute run {app_run.id}")
+        app_run.status = "FAILED"
+        app_run.logs = str(e)
+
+    app_run.save(update_fields=["status", "logs"])
+    return app_run
+
+
+def create_batch(
+    app: AppInstance,
+    dataset: DataSet,
+    name: str,
+    description: str,
+    parameter_grid,
+    parameter_sets: List[Dict],
+    max_concurrency: int = 4,
+) -> RunBatch:
+    """
+    Create a batch and queue one run per parameter set
+    """
+    # name the runs after the parameters that vary across the batch
+    swept = [
+        key
+        for key in parameter_sets[0]
+        if len({json.dumps(parameters[key]) for parameters in parameter_sets}) > 1
+    ]
+
+    with transaction.atomic():
+        batch = RunBatch.objects.create(
+            name=name,
+            description=description,
+            app=app,
+            dataset=dataset,
+            parameter_grid=parameter_grid,
+            max_concurrency=max_concurrency,
+        )
+        AppRun.objects.bulk_create(
+            [
+                AppRun(
+                    name=f"{name} #{idx + 1}",
+                    description=", ".join(f"{key}={parameters[key]}" for key in swept)[
+                        :100
+                    ]
+                    or description,
+                    app=app,
+                    dataset=dataset,
+                    parameters=parameters,
+                    batch=batch,
+                )
+                for idx, parameters in enumerate(parameter_sets)
+            ]
+        )
+
+    return batch
+
+
+def claim_next_run() -> Optional[AppRun]:
+    """
+    Pop the oldest pending run from the queue and mark it as RUNNING
+    The status update is atomic, so that one run is never claimed twice,
+    even by workers living in different processes
+    The concurrency limit of batches is best effort across processes
+    """
+    # skip the batches running as many runs as they are allowed to
+    running_batches = (
+        AppRun.objects.filter(status="RUNNING", batch__isnull=False)
+        .values("batch", "batch__max_concurrency")
+        .annotate(num_running=Count("id"))
+    )
+    full_batches = [
+        batch["batch"]
+        for batch in running_batches
+        if batch["num_running"] >= batch["batch__max_concurrency"]
+    ]
+
+    pending = (
+        AppRun.objects.filter(status="PENDING")
+        .exclude(batch__in=full_batches)
+        .order_by("id")
+    )
+    for run_id in pending.values_list("id", flat=True)[:10]:
+        if AppRun.objects.filter(id=run_id, status="PENDING").update(
+            status="RUNNING", heartbeat_at=timezone.now()
+        ):
+            return AppRun.objects.get(id=run_id)
+    return None
+
+
+def renew_runs(run_ids: List[int]) -> None:
+    """
+    Renew the heartbeat of the runs executed by this process
+    """
+    if run_ids:
+        AppRun.objects.filter(id__in=run_ids, status="RUNNING").update(
+            heartbeat_at=timezone.now()
+        )
+
+
+def recover_stale_runs(lease: float) -> int:
+    """
+    Release the RUNNING runs whose worker has not renewed them for lease seconds,
+    e.g., because its process died
+    Runs without a job handle never reached the backend and are queued again,
+    the others are marked as FAILED, as their job may or may not have run
+    Return the number of recovered runs
+    """
+    deadline = timezone.now() - timedelta(seconds=lease)
+    stale = AppRun.objects.filter(status="RUNNING").filter(
+        Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True)
+    )
+
+    requeued = stale.filter(job_handle__isnull=True).update(
+        status="PENDING", heartbeat_at=None
+    )
+    failed = stale.filter(job_handle__isnull=False).update(
+        status="FAILED", logs="The worker executing the run was lost"
+    )
+    if requeued or failed:
+        LOG.warning(f"Recovered stale runs: {requeued} requeued, {failed} failed")
+    return requeued + failed
 
 
 def fetch_job_output(app_run: AppRun) -> DataSet:
@@ -145,12 +356,6 @@ def fetch_job_output(app_run: AppRun) -> DataSet:
 
     job_handle = app_run.job_handle
 
-    output = get_output(
-        job_handle=job_handle,
-        task_spec=task_spec,
-        backend="docker",
-    )
-
     # get the output schema
     output_schema: List[FileDef] = app_run.dataset.schema["output_schema"]
     data_backend = app_run.dataset.backend
@@ -162,32 +367,10 @@ def fetch_job_output(app_run: AppRun) -> DataSet:
         app=app,
     )
 
-    # parse output as a list of dicts
-    resource_map = {}
-    for file_def in output_schema:
-        resource_type = file_def.name
-
-        contents = output[resource_type]
-        # parse the contents as a csv in bytes format
-        contents = io.StringIO(contents.decode("utf-8"))
-        reader = csv.DictReader(contents, delimiter=",")
-        records = [row for row in reader]
-
-        resource_map[resource_type] = records
-
-    if data_backend == "db":
-        # save the resources to db in bulk
-        for resource_type, records in resource_map.items():
-            Resource.objects.bulk_create(
-                [
-                    Resource(
-                        dataset=output_dataset,
-                        resource_type=resource_type,
-                        value=record,
-                    )
-                    for record in records
-                ]
-            )
+    if data_backend in STORAGE_ENGINES:
+        # the resources reference the dataset, save it first
+        storage = get_storage(output_dataset)
+        output_dataset.save()
     elif data_backend == "gsheet":
         uniq_identifier = str(uuid.uuid4())[:8]
         spreadsheet_name = output_dataset.name + "_" + uniq_identifier
@@ -195,21 +378,43 @@ def fetch_job_output(app_run: AppRun) -> DataSet:
             spreadsheet_name=spreadsheet_name,
             schemas=output_schema,
         )
+    else:
+        raise Exception("Unknown backend")
 
-        # fill in the data
-        for resource_type, records in resource_map.items():
-            GoogleSheetsDataBackend.write_records(
-                spreadsheet_url=sheet_url,
-                worksheet_name=resource_type,
-                records=records,
-            )
+    batch_size = getattr(settings, "TRAC_OUTPUT_BATCH_SIZE", 1000)
 
+    # stream each output file, and write its records in batches,
+    # so that large outputs are never held in memory as a whole
+    for file_def in output_schema:
+        resource_type = file_def.name
+
+        with open_output(
+            job_handle=job_handle,
+            name=resource_type,
+            task_spec=task_spec,
+            backend="docker",
+        ) as output_file:
+            contents = io.TextIOWrapper(output_file, encoding="utf-8", newline="")
+            reader = csv.DictReader(contents, delimiter=",")
+
+            while True:
+                records = list(itertools.islice(reader, batch_size))
+                if not records:
+                    break
+
+                if data_backend in STORAGE_ENGINES:
+                    storage.append_records(output_dataset, resource_type, records)
+                else:
+                    GoogleSheetsDataBackend.write_records(
+                        spreadsheet_url=sheet_url,
+                        worksheet_name=resource_type,
+                        records=records,
+                    )
+
+    if data_backend == "gsheet":
         output_dataset.url = sheet_url
         output_dataset.initialized = True
 
-    else:
-        raise Exception("Unknown backend")
-
     output_dataset.save()
 
     # return the new dataset
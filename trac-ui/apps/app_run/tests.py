@@ -1,8 +1,43 @@
-from apps.app_run.forms import create_form_from_parameter_schema
-from apps.data_gateway.models import DataSet
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from apps.app_run import services
+from apps.app_run.forms import (
+    create_batch_form_from_task_spec,
+    create_form_from_task_spec,
+)
+from apps.app_run.input_cache import InputCache
+from apps.app_run.jobs import JobManager
+from apps.app_run.models import AppRun, RunBatch
+from apps.app_run.services import (
+    claim_next_run,
+    create_batch,
+    execute_run,
+    pull_data_to_local_tempdir,
+    recover_stale_runs,
+    renew_runs,
+    run_app,
+)
+from apps.data_gateway.models import DataSet, Resource
+from apps.data_gateway.storage import get_storage
 from apps.trac_app.models import AppDefinition, AppInstance
-from django.test import SimpleTestCase, TestCase
-from trac.schema.task import ParameterDef
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from trac.runtime.scheduler import PRIORITY
+from trac.schema.task import FILE_TYPE, FileDef, ParameterDef, TaskDef
+
+
+def make_task_spec(params):
+    return TaskDef(
+        name="task",
+        description="task",
+        parameter={"mount_path": "/parameters.json", "parameters": params},
+        container={"image": "test_app", "tag": "latest"},
+    )
 
 
 class TestAppRunForm(TestCase):
@@ -21,7 +56,7 @@ class TestAppRunForm(TestCase):
         # create a dataset
         DataSet.objects.create(name="test_dataset", app=app_inst)
 
-    def test_create_form_from_parameter_schema(self):
+    def test_create_form_from_task_spec(self):
         """
         Test the dynamic form creation
         """
@@ -33,7 +68,7 @@ class TestAppRunForm(TestCase):
             ParameterDef(name="param4", type="boolean", default=True),
         ]
 
-        form_class = create_form_from_parameter_schema(params, 1)
+        form_class = create_form_from_task_spec(make_task_spec(params), 1)
 
         form = form_class()
 
@@ -59,3 +94,472 @@ class TestAppRunForm(TestCase):
         # print the form errors
         print(filled_form.errors)
         self.assertTrue(filled_form.is_valid())
+
+        # the fields left empty take their default
+        data.update(param1="", param2="")
+        filled_form = form_class(data=data)
+        self.assertTrue(filled_form.is_valid(), filled_form.errors)
+        self.assertEqual(filled_form.cleaned_data["parameters"]["param1"], "default1")
+        self.assertEqual(filled_form.cleaned_data["parameters"]["param2"], 2)
+
+    def test_forms_share_the_validator_of_the_spec(self):
+        """
+        The forms reuse the run config validator compiled for the task spec
+        """
+        task_spec = make_task_spec([ParameterDef(name="param1", type="string")])
+        task_spec.run_config_validator()
+
+        with patch("trac.schema.task.RunConfigValidator", side_effect=AssertionError):
+            create_form_from_task_spec(task_spec, 1)
+            create_batch_form_from_task_spec(task_spec, 1)
+
+
+class TestRunQueue(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        self.app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = DataSet.objects.create(name="test_dataset", app=self.app_inst)
+
+    def create_run(self, name):
+        return AppRun.objects.create(
+            name=name,
+            description=name,
+            app=self.app_inst,
+            dataset=self.dataset,
+            parameters={},
+        )
+
+    def test_claim_next_run(self):
+        """
+        Runs are claimed in FIFO order, and each run is claimed once
+        """
+        first = self.create_run("first")
+        second = self.create_run("second")
+
+        claimed = claim_next_run()
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual(claimed.status, "RUNNING")
+
+        self.assertEqual(claim_next_run().id, second.id)
+        self.assertIsNone(claim_next_run())
+
+    def test_execute_run_records_failure(self):
+        """
+        A run that cannot be started is marked as FAILED with the error as logs
+        """
+        app_run = self.create_run("broken")
+
+        with patch("apps.app_run.services.run_app", side_effect=Exception("boom")):
+            execute_run(claim_next_run())
+
+        app_run.refresh_from_db()
+        self.assertEqual(app_run.status, "FAILED")
+        self.assertEqual(app_run.logs, "boom")
+
+    def test_recover_stale_runs(self):
+        """
+        Runs whose worker stopped renewing them are released, the runs that
+        never reached the backend are queued again
+        """
+        lost = self.create_run("lost")
+        submitted = self.create_run("submitted")
+        alive = self.create_run("alive")
+        for _ in range(3):
+            claim_next_run()
+        AppRun.objects.filter(id=submitted.id).update(job_handle="docker-job")
+
+        stale = timezone.now() - timedelta(seconds=120)
+        AppRun.objects.filter(id__in=[lost.id, submitted.id, alive.id]).update(
+            heartbeat_at=stale
+        )
+        renew_runs([alive.id])
+
+        self.assertEqual(recover_stale_runs(lease=60), 2)
+        statuses = dict(AppRun.objects.values_list("name", "status"))
+        self.assertEqual(
+            statuses, {"lost": "PENDING", "submitted": "FAILED", "alive": "RUNNING"}
+        )
+        self.assertEqual(claim_next_run().id, lost.id)
+
+    def test_start_job_manager(self):
+        """
+        The server processes start the job manager, unless the runs are left
+        to the run_jobs workers
+        """
+        with patch.object(JobManager, "instance") as instance:
+            with override_settings(TRAC_JOB_WORKERS=0):
+                JobManager.start()
+            instance.assert_not_called()
+
+            JobManager.start()
+            instance.assert_called_once_with()
+
+    def test_update_run_edits_the_run(self):
+        """
+        Editing a run renames it in place, it neither queues a new run nor
+        changes the inputs its outputs were computed from
+        """
+        app_run = self.create_run("first")
+        other = DataSet.objects.create(name="other_dataset", app=self.app_inst)
+
+        with patch.object(AppDefinition, "task_spec", return_value=make_task_spec([])):
+            response = self.client.post(
+                reverse("app_run:update_run", args=[self.app_inst.id, app_run.id]),
+                {"name": "renamed", "description": "renamed", "dataset": other.id},
+            )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(AppRun.objects.count(), 1)
+        app_run.refresh_from_db()
+        self.assertEqual(app_run.name, "renamed")
+        self.assertEqual(app_run.dataset_id, self.dataset.id)
+
+
+class TestRunBatch(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        self.app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = DataSet.objects.create(name="test_dataset", app=self.app_inst)
+        self.params = [
+            ParameterDef(name="alpha", type="number", default=0.5),
+            ParameterDef(name="horizon", type="integer", default=7),
+        ]
+
+    def test_batch_form(self):
+        """
+        The grid is expanded and each parameter set is checked and completed
+        """
+        form_class = create_batch_form_from_task_spec(
+            make_task_spec(self.params), self.app_inst.id
+        )
+        data = {
+            "name": "sweep",
+            "description": "sweep",
+            "dataset": self.dataset.id,
+            "parameter_grid": '{"alpha": [0.1, 0.2, 0.3]}',
+            "max_concurrency": 2,
+        }
+
+        form = form_class(data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(
+            form.cleaned_data["parameter_sets"],
+            [{"alpha": alpha, "horizon": 7} for alpha in (0.1, 0.2, 0.3)],
+        )
+
+        data["parameter_grid"] = '{"alpha": ["high"], "beta": [1]}'
+        form = form_class(data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn(
+            "Parameter beta not found in task_spec", form.errors["parameter_grid"]
+        )
+        self.assertIn(
+            "Parameter alpha has type str, expected number",
+            form.errors["parameter_grid"],
+        )
+
+    def test_claim_respects_max_concurrency(self):
+        """
+        No more than max_concurrency runs of a batch run at a time
+        """
+        parameter_sets = [{"alpha": alpha, "horizon": 7} for alpha in (0.1, 0.2, 0.3)]
+        batch = create_batch(
+            app=self.app_inst,
+            dataset=self.dataset,
+            name="sweep",
+            description="sweep",
+            parameter_grid={"alpha": [0.1, 0.2, 0.3], "horizon": 7},
+            parameter_sets=parameter_sets,
+            max_concurrency=2,
+        )
+        runs = list(batch.runs.order_by("id"))
+        self.assertEqual([run.parameters for run in runs], parameter_sets)
+        self.assertEqual(runs[0].description, "alpha=0.1")
+
+        self.assertEqual(claim_next_run().id, runs[0].id)
+        self.assertEqual(claim_next_run().id, runs[1].id)
+        self.assertIsNone(claim_next_run())
+
+        # a slot is freed once a run finishes
+        AppRun.objects.filter(id=runs[0].id).update(status="COMPLETED")
+        self.assertEqual(claim_next_run().id, runs[2].id)
+
+
+def create_pull_dataset():
+    """
+    A dataset with two sheets, people having 3 rows and pets none
+    """
+    app_def = AppDefinition.objects.create(
+        name="test_app",
+        image_name="test_app",
+        image_tag="latest",
+        description="test app",
+    )
+    app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+    file_schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+    }
+    dataset = DataSet.objects.create(
+        name="test_dataset",
+        app=app_inst,
+        schema={
+            "input_schema": [
+                FileDef(
+                    name=name,
+                    description=name,
+                    type=FILE_TYPE.INPUT,
+                    mount_path=f"/{name}.csv",
+                    file_schema=file_schema,
+                )
+                for name in ["people", "pets"]
+            ],
+            "output_schema": [],
+        },
+    )
+    Resource.objects.bulk_create(
+        [
+            Resource(
+                dataset=dataset,
+                resource_type="people",
+                value={"name": f"person {idx}", "age": idx},
+            )
+            for idx in range(3)
+        ]
+    )
+    return dataset
+
+
+class TestPullData(TestCase):
+    def setUp(self):
+        self.dataset = create_pull_dataset()
+
+    @override_settings(TRAC_MATERIALIZE_WORKERS=1)
+    def test_pull_data_to_local_tempdir(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            result = pull_data_to_local_tempdir(self.dataset, tempdir)
+
+            self.assertEqual(set(result), {"people", "pets"})
+            with open(result["people"]) as f:
+                self.assertEqual(
+                    f.read().splitlines(),
+                    ["name,age", "person 0,0", "person 1,1", "person 2,2"],
+                )
+            with open(result["pets"]) as f:
+                self.assertEqual(f.read().splitlines(), ["name,age"])
+
+    def test_input_cache(self):
+        """
+        Inputs are materialized once per revision of the dataset
+        """
+        calls = []
+
+        def materialize(dataset, tempdir):
+            calls.append(dataset.revision)
+            return pull_data_to_local_tempdir(dataset, tempdir)
+
+        with tempfile.TemporaryDirectory() as cache_dir, self.settings(
+            TRAC_MATERIALIZE_WORKERS=1
+        ):
+            cache = InputCache(cache_dir, max_bytes=0)
+
+            first = cache.get_or_create(self.dataset, materialize)
+            self.assertEqual(cache.get_or_create(self.dataset, materialize), first)
+            self.assertEqual(len(calls), 1)
+
+            get_storage(self.dataset).append_records(
+                self.dataset, "people", [{"name": "new person", "age": 9}]
+            )
+            second = cache.get_or_create(self.dataset, materialize)
+            self.assertEqual(len(calls), 2)
+            with open(second["people"]) as f:
+                self.assertIn("new person", f.read())
+
+            # over the size budget, the least recently used entry is evicted
+            self.assertFalse(os.path.exists(first["people"]))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_input_cache_keeps_pinned_entries(self):
+        """
+        Over the size budget, the entries of the runs and batches going are kept
+        """
+        app_run = AppRun.objects.create(
+            name="run",
+            description="run",
+            app=self.dataset.app,
+            dataset=self.dataset,
+            parameters={},
+            status="RUNNING",
+        )
+
+        def pin(files):
+            AppRun.objects.filter(id=app_run.id).update(input_files=files)
+
+        with tempfile.TemporaryDirectory() as cache_dir, self.settings(
+            TRAC_MATERIALIZE_WORKERS=1
+        ):
+            cache = InputCache(cache_dir, max_bytes=0)
+            first = cache.get_or_create(
+                self.dataset, pull_data_to_local_tempdir, pin=pin
+            )
+            get_storage(self.dataset).append_records(
+                self.dataset, "people", [{"name": "new person", "age": 9}]
+            )
+            second = cache.get_or_create(self.dataset, pull_data_to_local_tempdir)
+            keep = os.path.basename(os.path.dirname(second["people"]))
+            self.assertTrue(os.path.exists(first["people"]))
+
+            # the run is over, but the batch sharing its files has a run left
+            AppRun.objects.filter(id=app_run.id).update(status="COMPLETED")
+            batch = RunBatch.objects.create(
+                name="batch",
+                description="batch",
+                app=self.dataset.app,
+                dataset=self.dataset,
+                parameter_grid={},
+                input_files=first,
+            )
+            AppRun.objects.create(
+                name="batch run",
+                description="batch run",
+                app=self.dataset.app,
+                dataset=self.dataset,
+                parameters={},
+                batch=batch,
+            )
+            cache.evict(keep=keep)
+            self.assertTrue(os.path.exists(first["people"]))
+
+            batch.runs.update(status="COMPLETED")
+            cache.evict(keep=keep)
+            self.assertFalse(os.path.exists(first["people"]))
+            self.assertTrue(os.path.exists(second["people"]))
+
+    def test_run_app_rejects_invalid_data(self):
+        """
+        Invalid input data fails the run before the job is submitted
+        """
+        Resource.objects.create(
+            dataset=self.dataset,
+            resource_type="people",
+            value={"name": "someone", "age": "old"},
+        )
+        app_run = AppRun.objects.create(
+            name="run",
+            description="run",
+            app=self.dataset.app,
+            dataset=self.dataset,
+            parameters={},
+        )
+        task_spec = TaskDef(
+            name="task",
+            description="task",
+            io={"files": self.dataset.schema["input_schema"]},
+            container={"image": "test_app", "tag": "latest"},
+        )
+
+        with tempfile.TemporaryDirectory() as cache_dir, self.settings(
+            TRAC_INPUT_CACHE_DIR=cache_dir, TRAC_MATERIALIZE_WORKERS=1
+        ), patch.object(AppDefinition, "task_spec", return_value=task_spec), patch(
+            "apps.app_run.services.get_scheduler"
+        ) as get_scheduler:
+            with self.assertRaisesMessage(Exception, "'old' is not of type integer"):
+                run_app(app_run)
+
+            get_scheduler.assert_not_called()
+            # the invalid files are not cached
+            self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_run_app_submits_through_scheduler(self):
+        """
+        The job of a run is queued in the scheduler of the process
+        """
+        app_run = AppRun.objects.create(
+            name="run",
+            description="run",
+            app=self.dataset.app,
+            dataset=self.dataset,
+            parameters={},
+        )
+        task_spec = TaskDef(
+            name="task",
+            description="task",
+            io={"files": self.dataset.schema["input_schema"]},
+            container={"image": "test_app", "tag": "latest"},
+        )
+
+        with tempfile.TemporaryDirectory() as cache_dir, self.settings(
+            TRAC_INPUT_CACHE_DIR=cache_dir, TRAC_MATERIALIZE_WORKERS=1
+        ), patch.object(AppDefinition, "task_spec", return_value=task_spec), patch(
+            "apps.app_run.services.get_scheduler"
+        ) as get_scheduler:
+            scheduler = get_scheduler.return_value
+            scheduler.submit.return_value.wait_submitted.return_value = "job-1"
+
+            self.assertEqual(run_app(app_run), "job-1")
+
+        _, kwargs = scheduler.submit.call_args
+        self.assertEqual(kwargs["priority"], PRIORITY.NORMAL)
+        self.assertEqual(set(kwargs["run_config"].input_files), {"people", "pets"})
+
+
+class TestPullDataInThreads(TransactionTestCase):
+    """
+    The sheets are written by a pool of threads, each with its own connection,
+    the rows are committed so that the threads see them
+    """
+
+    def setUp(self):
+        self.dataset = create_pull_dataset()
+
+    @override_settings(TRAC_MATERIALIZE_WORKERS=4)
+    def test_pull_data_in_threads(self):
+        threads = {}
+        write_csv_file = services.write_csv_file
+
+        def record_thread(file_def, records, path):
+            threads[file_def.name] = threading.current_thread().name
+            return write_csv_file(file_def, records, path)
+
+        with tempfile.TemporaryDirectory() as tempdir, patch(
+            "apps.app_run.services.write_csv_file", side_effect=record_thread
+        ):
+            result = pull_data_to_local_tempdir(self.dataset, tempdir)
+
+            with open(result["people"]) as f:
+                self.assertEqual(
+                    f.read().splitlines(),
+                    ["name,age", "person 0,0", "person 1,1", "person 2,2"],
+                )
+            with open(result["pets"]) as f:
+                self.assertEqual(f.read().splitlines(), ["name,age"])
+
+        self.assertEqual(set(threads), {"people", "pets"})
+        self.assertTrue(
+            all(name.startswith("trac-pull") for name in threads.values()), threads
+        )
+
+    @override_settings(TRAC_MATERIALIZE_WORKERS=4)
+    def test_pull_data_raises_thread_errors(self):
+        write_csv_file = services.write_csv_file
+
+        def fail_on_pets(file_def, records, path):
+            if file_def.name == "pets":
+                raise OSError("disk full")
+            return write_csv_file(file_def, records, path)
+
+        with tempfile.TemporaryDirectory() as tempdir, patch(
+            "apps.app_run.services.write_csv_file", side_effect=fail_on_pets
+        ):
+            with self.assertRaisesRegex(OSError, "disk full"):
+                pull_data_to_local_tempdir(self.dataset, tempdir)
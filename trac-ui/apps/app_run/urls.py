@@ -12,4 +12,6 @@ urlpatterns = [
         "<int:instance_id>/runs/<int:run_id>/view/", view_run_result, name="view_result"
     ),
     path("<int:instance_id>/runs/<int:run_id>/logs/", view_run_logs, name="view_logs"),
+    path("<int:instance_id>/batches/create/", create_batch, name="create_batch"),
+    path("<int:instance_id>/batches/<int:batch_id>/", view_batch, name="view_batch"),
 ]
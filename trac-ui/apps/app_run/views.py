@@ -2,11 +2,15 @@ import re
 
 from apps.trac_app.models import AppDefinition, AppInstance
 from django.shortcuts import redirect, render
-from trac.runtime.run import get_logs
 
-from .forms import create_form_from_parameter_schema
-from .models import AppRun
-from .services import fetch_job_output, run_app, wait_for_job_completion
+from .forms import (
+    create_batch_form_from_task_spec,
+    create_form_from_task_spec,
+)
+from .jobs import JobManager
+from .models import AppRun, RunBatch
+from .services import create_batch as create_run_batch
+from .services import fetch_job_output
 
 
 def create_run(request, instance_id):
@@ -16,10 +20,10 @@ def create_run(request, instance_id):
     # get the app_def from the instance_id
     app = AppInstance.objects.get(id=instance_id)
     app_def = app.app
-    # get the app_def's parameter schema
-    parameter_schema = app_def.parameter_schema()
+    # get the app_def's task spec, the validation of its parameters is cached
+    task_spec = app_def.task_spec()
 
-    form_cls = create_form_from_parameter_schema(parameter_schema, instance_id)
+    form_cls = create_form_from_task_spec(task_spec, instance_id)
 
     if request.method == "POST":
         form = form_cls(request.POST)
@@ -34,16 +38,8 @@ def create_run(request, instance_id):
                 parameters=data["parameters"],
             )
 
-            # run the app
-            job_handle = run_app(app_run)
-            app_run.job_handle = job_handle
-            # wait for the job to complete
-            wait_for_job_completion(job_handle)
-            app_run.status = "COMPLETED"
-            logs = get_logs(job_handle)
-            app_run.logs = logs
-
-            app_run.save()
+            # queue the run, it is picked up by the background job manager
+            JobManager.enqueue(app_run)
             return redirect("trac_app:dashboard", instance_id=instance_id)
 
     else:
@@ -58,39 +54,40 @@ def update_run(request, instance_id, run_id):
     """
     Update a run under an app instance when request is PUT
     """
-    # get the parameter_schema from the app_def
     # get the app_def from the instance_id
     app = AppInstance.objects.get(id=instance_id)
     app_def = app.app
-    # get the app_def's parameter schema
-    parameter_schema = app_def.parameter_schema()
+    # get the app_def's task spec, the validation of its parameters is cached
+    task_spec = app_def.task_spec()
 
-    form_cls = create_form_from_parameter_schema(parameter_schema, instance_id)
+    form_cls = create_form_from_task_spec(task_spec, instance_id)
 
-    if request.method == "POST":
-        form = form_cls(request.POST)
-        if form.is_valid():
-            data = form.cleaned_data
-            # create a new app run
-            app_run = AppRun.objects.create(
-                name=data["name"],
-                description=data["description"],
-                app=app,
-                dataset=data["dataset"],
-                parameters=data["parameters"],
-            )
-            return redirect("trac_app:dashboard", instance_id=instance_id)
+    app_run = AppRun.objects.get(id=run_id, app=app)
+    # prepopulate the form with the existing data
+    initial = {
+        "name": app_run.name,
+        "description": app_run.description,
+        "dataset": app_run.dataset,
+        **(app_run.parameters or {}),
+    }
 
+    if request.method == "POST":
+        form = form_cls(request.POST, initial=initial)
     else:
-        form = form_cls()
-        # prepopulate the form with the existing data
-        app_run = AppRun.objects.get(id=run_id)
-        form.fields["name"].initial = app_run.name
-        form.fields["description"].initial = app_run.description
-        form.fields["dataset"].initial = app_run.dataset
-        # for fields in app_run.parameters, set the initial value
-        for field, value in app_run.parameters.items():
-            form.fields[field].initial = value
+        form = form_cls(initial=initial)
+
+    # the outputs of the run were computed from its dataset and parameters,
+    # so only its name and description can be edited
+    for field_name, field in form.fields.items():
+        if field_name not in ("name", "description"):
+            field.disabled = True
+
+    if request.method == "POST" and form.is_valid():
+        data = form.cleaned_data
+        app_run.name = data["name"]
+        app_run.description = data["description"]
+        app_run.save(update_fields=["name", "description"])
+        return redirect("trac_app:dashboard", instance_id=instance_id)
 
     return render(
         request,
@@ -115,6 +112,10 @@ def view_run_result(request, instance_id, run_id):
     """
     app_run = AppRun.objects.get(id=run_id)
 
+    # there is no output to show until the run completes, show its logs instead
+    if app_run.status != "COMPLETED":
+        return redirect("app_run:view_logs", instance_id=instance_id, run_id=run_id)
+
     # check if the app_run already has an output dataset
     if not app_run.output_dataset:
         # fetch the output dataset
@@ -148,3 +149,85 @@ def view_run_logs(request, instance_id, run_id):
         "app_run/view_run_logs.html",
         {"logs": logs, "instance_id": instance_id, "run_id": run_id},
     )
+
+
+def create_batch(request, instance_id):
+    """
+    Create a batch of runs under an app instance when request is POST
+    One run is queued per parameter set of the grid
+    """
+    app = AppInstance.objects.get(id=instance_id)
+    task_spec = app.app.task_spec()
+
+    form_cls = create_batch_form_from_task_spec(task_spec, instance_id)
+
+    if request.method == "POST":
+        form = form_cls(request.POST)
+        if form.is_valid():
+            data = form.cleaned_data
+            batch = create_run_batch(
+                app=app,
+                dataset=data["dataset"],
+                name=data["name"],
+                description=data["description"],
+                parameter_grid=data["parameter_grid"],
+                parameter_sets=data["parameter_sets"],
+                max_concurrency=data["max_concurrency"],
+            )
+
+            # queue the runs, they are picked up by the background job manager
+            for app_run in batch.runs.all():
+                JobManager.enqueue(app_run)
+            return redirect(
+                "app_run:view_batch", instance_id=instance_id, batch_id=batch.id
+            )
+
+    else:
+        form = form_cls()
+
+    return render(
+        request, "app_run/create_run.html", {"form": form, "instance_id": instance_id}
+    )
+
+
+def view_batch(request, instance_id, batch_id):
+    """
+    Compare the runs of a batch side by side
+    """
+    batch = RunBatch.objects.get(id=batch_id, app__id=instance_id)
+    runs = list(batch.runs.order_by("id"))
+
+    # only show the parameters that vary across the batch
+    parameter_names = []
+    for app_run in runs:
+        for name in app_run.parameters or {}:
+            if name not in parameter_names:
+                parameter_names.append(name)
+    swept = [
+        name
+        for name in parameter_names
+        if len({repr((app_run.parameters or {}).get(name)) for app_run in runs}) > 1
+    ]
+
+    rows = [
+        {
+            "run": app_run,
+            "values": [(app_run.parameters or {}).get(name) for name in swept],
+        }
+        for app_run in runs
+    ]
+    status_counts = {}
+    for app_run in runs:
+        status_counts[app_run.status] = status_counts.get(app_run.status, 0) + 1
+
+    return render(
+        request,
+        "app_run/view_batch.html",
+        {
+            "batch": batch,
+            "swept": swept,
+            "rows": rows,
+            "status_counts": status_counts,
+            "instance_id": instance_id,
+        },
+    )
@@ -2,208 +2,390 @@
 API views for managing resource under a dataset
 """
 
+import codecs
+import csv
+import functools
+import itertools
+import json
 import re
+from typing import Dict, Tuple
 
-from django.http import Http404
-from rest_framework import generics, mixins, serializers
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, mixins, serializers, status
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from trac.schema.task import FileDef
 
-from .models import DataSet, Resource
+from .models import DataSet
+from .storage import STORAGE_ENGINES, StorageEngine, get_storage
+
+
+@functools.lru_cache(maxsize=None)
+def sanitize_field_name(field_name):
+    """
+    Replace all non-alphanumeric characters of a field name with _
+    """
+    return re.sub(r"\W+", "_", field_name)
 
 
 def convert_jsonschema_to_serializers(resource_schema):
     """
     Convert a JSON schema to a serializer
     """
-    # construct a serializer class, which is a subclass of serializers.Serializer
     # each field of the serializer corresponds to a property of the resource_schema
-    class ResourceSerializer(serializers.Serializer):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-
-            field_name_mapping = {}
-
-            for field_name, field_schema in resource_schema["properties"].items():
-                # sanitize the field_name, by replacing all non-alphanumeric characters with _
-                field_name_sanitized = re.sub(r"\W+", "_", field_name)
-                field_name_mapping[field_name_sanitized] = field_name
-
-                # map the field_schema to a serializer field
-                field_type = field_schema["type"]
-                if field_type == "string":
-                    serializer_field = serializers.CharField()
-                elif field_type == "integer":
-                    serializer_field = serializers.IntegerField()
-                elif field_type == "number":
-                    serializer_field = serializers.FloatField()
-                elif field_type == "boolean":
-                    serializer_field = serializers.BooleanField()
-                elif field_type == "array":
-                    serializer_field = serializers.ListField()
-                elif field_type == "object":
-                    serializer_field = serializers.DictField()
-                else:
-                    raise ValueError("Unsupported field type: {}".format(field_type))
-
-                self.fields[field_name_sanitized] = serializer_field
-
-            # add an id field
-            self.fields["id"] = serializers.IntegerField(required=False)
-
-            self.field_name_mapping = field_name_mapping
-
-        # def to_representation(self, instance):
-        #     """
-        #     Convert the instance to a dict, where the keys are the field names
-        #     """
-        #     res = super().to_representation(instance)
-        #     return {
-        #         field_name_sanitized: res[field_name]
-        #         for field_name_sanitized, field_name in self.field_name_mapping.items()
-        #     }
-
-        def to_internal_value(self, data):
-            """
-            Convert the data to a dict, where the keys are the field names
-            """
-            res = super().to_internal_value(data)
-            return {
-                field_name: res[field_name_sanitized]
-                for field_name_sanitized, field_name in self.field_name_mapping.items()
-            }
-
-    return ResourceSerializer
-
-
-class ResourceListCreateView(generics.ListCreateAPIView):
+    # the fields are declared on the class, so that instantiating the
+    # serializer only copies them instead of walking the schema again
+    declared_fields = {}
+    field_name_mapping = {}
+
+    for field_name, field_schema in resource_schema["properties"].items():
+        field_name_sanitized = sanitize_field_name(field_name)
+        field_name_mapping[field_name_sanitized] = field_name
+
+        # map the field_schema to a serializer field
+        field_type = field_schema["type"]
+        if field_type == "string":
+            serializer_field = serializers.CharField()
+        elif field_type == "integer":
+            serializer_field = serializers.IntegerField()
+        elif field_type == "number":
+            serializer_field = serializers.FloatField()
+        elif field_type == "boolean":
+            serializer_field = serializers.BooleanField()
+        elif field_type == "array":
+            serializer_field = serializers.ListField()
+        elif field_type == "object":
+            serializer_field = serializers.DictField()
+        else:
+            raise ValueError("Unsupported field type: {}".format(field_type))
+
+        declared_fields[field_name_sanitized] = serializer_field
+
+    # add an id field
+    declared_fields["id"] = serializers.IntegerField(required=False)
+
+    def to_internal_value(self, data):
+        """
+        Convert the data to a dict, where the keys are the field names
+        """
+        res = serializers.Serializer.to_internal_value(self, data)
+        return {
+            field_name: res[field_name_sanitized]
+            for field_name_sanitized, field_name in self.field_name_mapping.items()
+        }
+
+    # construct a serializer class, which is a subclass of serializers.Serializer
+    return type(
+        "ResourceSerializer",
+        (serializers.Serializer,),
+        {
+            **declared_fields,
+            "field_name_mapping": field_name_mapping,
+            "to_internal_value": to_internal_value,
+        },
+    )
+
+
+# serializer classes by (schema hash, resource type)
+_SERIALIZERS: Dict[Tuple[str, str], type] = {}
+
+
+def get_resource_serializer(dataset: DataSet, resource_schema: FileDef):
     """
-    List and create resources for a dataset
+    Return the serializer class of a resource type, shared by the datasets
+    with the same schema
     """
+    key = (dataset.schema_hash(), resource_schema.name)
+    if key not in _SERIALIZERS:
+        _SERIALIZERS[key] = convert_jsonschema_to_serializers(
+            resource_schema.file_schema
+        )
+    return _SERIALIZERS[key]
 
-    def get_queryset(self):
-        dataset_id = self.kwargs.get("dataset_id")
-        dataset = DataSet.objects.get(id=dataset_id)
-        resource_type = self.kwargs.get("resource_type")
 
+def sanitize_resource(resource_id, value):
+    """
+    Return the API representation of a resource
+    """
+    new_value = {
+        sanitize_field_name(field_name): field_value
+        for field_name, field_value in value.items()
+    }
+    return {"id": resource_id, **new_value}
+
+
+class ResourceTypeMixin:
+    """
+    Look up the dataset and the schema of the resource type in the url
+    """
+
+    def get_dataset(self):
+        # the view is instantiated per request, look the dataset up once
+        if not hasattr(self, "_dataset"):
+            dataset_id = self.kwargs.get("dataset_id")
+            self._dataset = get_object_or_404(DataSet, id=dataset_id)
+        return self._dataset
+
+    def get_resource_schema(self, dataset) -> FileDef:
         # check if dataset schema contains the resource_type
         # if not return a 404 error
-        schema = dataset.schema["input_schema"]
-        resource_schema = None
-        for resource_schema in schema:
-            if resource_schema["title"] == resource_type:
-                break
-        else:
-            raise Http404(f"Resource type {resource_type} not found")
-
-        resources = Resource.objects.filter(
-            dataset=dataset, resource_type=resource_type
-        ).all()
-        # sanitize the resource values
-        result = []
-        for resource in resources:
-            resource_id = resource.id
-            value = resource.value
-            new_value = {}
-            for field_name, field_value in value.items():
-                # replace all non-alphanumeric characters with _
-                field_name_sanitized = re.sub(r"\W+", "_", field_name)
-                new_value[field_name_sanitized] = field_value
-            result.append({"id": resource_id, **new_value})
-        return result
+        resource_type = self.kwargs.get("resource_type")
+        for resource_schema in dataset.schema["input_schema"]:
+            # the api docs use the lower case names
+            if resource_type in (resource_schema.name, resource_schema.name.lower()):
+                return resource_schema
+
+        raise Http404(f"Resource type {resource_type} not found")
+
+    def get_storage(self, dataset) -> StorageEngine:
+        # the records of the datasets kept outside of the database,
+        # e.g., in a google sheet, are not served by the api
+        if dataset.backend not in STORAGE_ENGINES:
+            raise ValidationError(
+                f"The resources of {dataset.backend} datasets are not in the api"
+            )
+        return get_storage(dataset)
 
     def get_serializer_class(self):
         """
         Return a dynamic serializer class based on the resource_type
         """
-        resource_type = self.kwargs.get("resource_type")
+        dataset = self.get_dataset()
+        return get_resource_serializer(dataset, self.get_resource_schema(dataset))
 
-        # schema of the resource_type
-        dataset_id = self.kwargs.get("dataset_id")
-        dataset = DataSet.objects.get(id=dataset_id)
-        schema = dataset.schema["input_schema"]
-        resource_schema = None
-        for resource_schema in schema:
-            if resource_schema["title"] == resource_type:
-                break
 
-        return convert_jsonschema_to_serializers(resource_schema)
+class ResourceListCreateView(ResourceTypeMixin, generics.ListCreateAPIView):
+    """
+    List and create resources for a dataset
+
+    The list is paginated by id: `limit` resources with an id greater than
+    `after` are returned, along with the url of the next page. The response
+    is streamed, so that the memory used does not grow with the page size.
+    The resources are read and written through the storage engine of the
+    dataset, so that the ids are the ids of its records.
+    """
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+            after = request.query_params.get("after")
+            after = int(after) if after is not None else None
+        except ValueError:
+            raise ValidationError("limit and after must be integers")
+        limit = max(1, min(limit, self.max_limit))
+
+        dataset = self.get_dataset()
+        resource_schema = self.get_resource_schema(dataset)
+        rows = self.get_storage(dataset).iter_rows(
+            dataset, resource_schema.name, after=after
+        )
+
+        return StreamingHttpResponse(
+            self.stream_page(request, itertools.islice(rows, limit), limit),
+            content_type="application/json",
+        )
+
+    @property
+    def default_limit(self):
+        return settings.REST_FRAMEWORK.get("PAGE_SIZE", 50)
+
+    @property
+    def max_limit(self):
+        return getattr(settings, "TRAC_API_MAX_PAGE_SIZE", 10000)
+
+    def stream_page(self, request, rows, limit):
+        """
+        Yield a page of resources as a json document, one resource at a time
+        """
+        yield '{"results": ['
+
+        count = 0
+        last_id = None
+        for resource_id, value in rows:
+            if count:
+                yield ","
+            yield json.dumps(sanitize_resource(resource_id, value))
+            count += 1
+            last_id = resource_id
+
+        # a full page may be followed by more resources
+        next_url = None
+        if count == limit:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "after", last_id
+            )
+
+        yield '], "next": ' + json.dumps(next_url) + "}"
 
     def perform_create(self, serializer):
-        dataset_id = self.kwargs.get("dataset_id")
-        dataset = DataSet.objects.get(id=dataset_id)
-        resource_type = self.kwargs.get("resource_type")
+        dataset = self.get_dataset()
+        resource_schema = self.get_resource_schema(dataset)
 
-        value = serializer.validated_data
-        resource = Resource(dataset=dataset, resource_type=resource_type, value=value)
-        resource.save()
+        try:
+            self.get_storage(dataset).append_records(
+                dataset, resource_schema.name, [serializer.validated_data]
+            )
+        except ValueError as e:
+            raise ValidationError(str(e))
 
 
-class ResourceDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ResourceDetailView(ResourceTypeMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update and delete a resource
     """
 
     lookup_field = "resource_id"
 
-    def get_queryset(self):
-        dataset_id = self.kwargs.get("dataset_id")
-        dataset = DataSet.objects.get(id=dataset_id)
-        resource_type = self.kwargs.get("resource_type")
-
-        # check if dataset schema contains the resource_type
-        # if not return a 404 error
-        schema = dataset.schema["input_schema"]
-        resource_schema = None
-        for resource_schema in schema:
-            if resource_schema["title"] == resource_type:
-                break
-        else:
-            raise Http404(f"Resource type {resource_type} not found")
-
-        resources = Resource.objects.filter(
-            dataset=dataset, resource_type=resource_type
-        ).all()
-        return resources
-
     def get_object(self):
-        resources = self.get_queryset()
-        resource_id = self.kwargs.get("resource_id")
-        resource = resources.get(id=resource_id)
+        dataset = self.get_dataset()
+        resource_schema = self.get_resource_schema(dataset)
+        resource_id = self.kwargs.get(self.lookup_field)
+        try:
+            value = self.get_storage(dataset).get_record(
+                dataset, resource_schema.name, resource_id
+            )
+        except KeyError:
+            raise Http404(f"Resource {resource_id} not found")
         # sanitize the resource values
-        resource_id = resource.id
-        value = resource.value
-        new_value = {}
-        for field_name, field_value in value.items():
-            # replace all non-alphanumeric characters with _
-            field_name_sanitized = re.sub(r"\W+", "_", field_name)
-            new_value[field_name_sanitized] = field_value
+        return sanitize_resource(resource_id, value)
+
+    def apply_changes(self, **changes):
+        dataset = self.get_dataset()
+        resource_schema = self.get_resource_schema(dataset)
+        changes = {"created": [], "updated": {}, "deleted": [], **changes}
+        try:
+            self.get_storage(dataset).apply_changes(
+                dataset, resource_schema.name, **changes
+            )
+        except KeyError:
+            raise Http404(f"Resource {self.kwargs.get(self.lookup_field)} not found")
+        except ValueError as e:
+            raise ValidationError(str(e))
 
-        return {"id": resource_id, **new_value}
+    def perform_update(self, serializer):
+        resource_id = self.kwargs.get(self.lookup_field)
+        self.apply_changes(updated={resource_id: serializer.validated_data})
 
-    def get_serializer_class(self):
-        """
-        Return a dynamic serializer class based on the resource_type
-        """
-        resource_type = self.kwargs.get("resource_type")
+    def perform_destroy(self, instance):
+        # get_object checked that the resource exists
+        self.apply_changes(deleted=[self.kwargs.get(self.lookup_field)])
 
-        # schema of the resource_type
-        dataset_id = self.kwargs.get("dataset_id")
-        dataset = DataSet.objects.get(id=dataset_id)
-        schema = dataset.schema["input_schema"]
-        resource_schema = None
-        for resource_schema in schema:
-            if resource_schema["title"] == resource_type:
-                break
 
-        return convert_jsonschema_to_serializers(resource_schema)
+class ResourceBulkView(ResourceTypeMixin, generics.GenericAPIView):
+    """
+    Create or update resources in bulk
 
-    def perform_update(self, serializer):
-        value = serializer.validated_data
-        resource_id = self.kwargs.get(self.lookup_field)
-        resource = Resource.objects.get(id=resource_id)
-        resource.value = value
-        resource.save()
+    The body is a JSON array, NDJSON (one object per line) or CSV with a
+    header row, picked by the content type. Objects with an id update the
+    resource with that id, the others are created. Objects are validated
+    and written `chunk_size` at a time, all in one transaction: the whole
+    request is rejected if any object is invalid.
+    """
 
-    def perform_destroy(self, instance):
-        resource_id = self.kwargs.get(self.lookup_field)
-        resource = Resource.objects.get(id=resource_id)
-        resource.delete()
+    def post(self, request, *args, **kwargs):
+        try:
+            chunk_size = int(
+                request.query_params.get(
+                    "chunk_size", getattr(settings, "TRAC_BULK_CHUNK_SIZE", 1000)
+                )
+            )
+        except ValueError:
+            raise ValidationError("chunk_size must be an integer")
+        chunk_size = max(1, chunk_size)
+
+        dataset = self.get_dataset()
+        resource_schema = self.get_resource_schema(dataset)
+        serializer_class = self.get_serializer_class()
+        storage = self.get_storage(dataset)
+
+        items = self.iter_items(request)
+        num_created = num_updated = 0
+        offset = 0
+        with transaction.atomic():
+            while True:
+                batch = list(itertools.islice(items, chunk_size))
+                if not batch:
+                    break
+
+                serializer = serializer_class(data=batch, many=True)
+                if not serializer.is_valid():
+                    # report the errors by position in the request
+                    raise ValidationError(
+                        {
+                            offset + idx: errors
+                            for idx, errors in enumerate(serializer.errors)
+                            if errors
+                        }
+                    )
+
+                created = []
+                updated = {}
+                for item, value in zip(batch, serializer.validated_data):
+                    if item.get("id") is not None:
+                        updated[int(item["id"])] = value
+                    else:
+                        created.append(value)
+
+                try:
+                    batch_created, batch_updated, _ = storage.apply_changes(
+                        dataset,
+                        resource_schema.name,
+                        created=created,
+                        updated=updated,
+                        deleted=[],
+                    )
+                except (KeyError, ValueError) as e:
+                    raise ValidationError(str(e.args[0]))
+
+                num_created += batch_created
+                num_updated += batch_updated
+                offset += len(batch)
+
+        return Response(
+            {"created": num_created, "updated": num_updated},
+            status=status.HTTP_201_CREATED if num_created else status.HTTP_200_OK,
+        )
+
+    def iter_items(self, request):
+        """
+        Iterate over the objects in the request body, without reading it at once
+        """
+        content_type = request.content_type.split(";")[0].strip()
+        stream = request.stream
+        lines = iter(stream.readline, b"") if stream is not None else iter(())
+
+        if content_type == "application/json":
+            try:
+                items = json.loads(b"".join(lines))
+            except ValueError as e:
+                raise ValidationError(f"Invalid JSON: {e}")
+            if not isinstance(items, list):
+                raise ValidationError("Expected a JSON array")
+            return iter(items)
+
+        elif content_type in ("application/x-ndjson", "application/ndjson"):
+            return self._iter_ndjson(lines)
+
+        elif content_type == "text/csv":
+            reader = csv.DictReader(codecs.iterdecode(lines, "utf-8"))
+            # empty cells are missing values
+            return (
+                {key: value for key, value in row.items() if value != ""}
+                for row in reader
+            )
+
+        raise UnsupportedMediaType(content_type)
+
+    @staticmethod
+    def _iter_ndjson(lines):
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValidationError(f"Invalid JSON on line {line_no}: {e}")
@@ -0,0 +1,170 @@
+"""
+Streaming export of the records of a dataset
+
+Each writer turns an iterator of records into an iterator of bytes, so that
+a sheet is exported with constant memory, whatever its size.
+"""
+
+import csv
+import io
+import itertools
+import json
+import zipfile
+from typing import Dict, Iterable, Iterator, Tuple
+
+from trac.schema.task import FileDef
+
+from .storage import coerce
+
+EXPORT_FORMATS = {
+    # format: (file extension, content type)
+    "csv": ("csv", "text/csv"),
+    "ndjson": ("ndjson", "application/x-ndjson"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    A write-only stream buffering what is written till it is drained
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_csv(file_def: FileDef, records: Iterable[Dict]) -> Iterator[bytes]:
+    """
+    Export records as csv, with a header row
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(
+        buffer,
+        fieldnames=list(file_def.file_schema["properties"].keys()),
+        extrasaction="ignore",
+    )
+    writer.writeheader()
+
+    for record in records:
+        writer.writerow(record)
+        # flush in blocks rather than per row
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(file_def: FileDef, records: Iterable[Dict]) -> Iterator[bytes]:
+    """
+    Export records as newline delimited json
+    """
+    for record in records:
+        yield (json.dumps(record) + "\n").encode("utf-8")
+
+
+def iter_parquet(
+    file_def: FileDef, records: Iterable[Dict], batch_size=10000
+) -> Iterator[bytes]:
+    """
+    Export records as parquet, one row group per batch of records
+    Requires pyarrow
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {
+        "string": pa.string(),
+        "integer": pa.int64(),
+        "number": pa.float64(),
+        "boolean": pa.bool_(),
+    }
+    columns = {
+        name: prop.get("type")
+        for name, prop in file_def.file_schema["properties"].items()
+    }
+    # arrays and objects are exported as json strings
+    schema = pa.schema(
+        [(name, types.get(type_, pa.string())) for name, type_ in columns.items()]
+    )
+
+    def to_cell(value, type_):
+        if type_ in types:
+            return coerce(value, type_)
+        return None if value is None else json.dumps(value)
+
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+
+            table = pa.Table.from_pydict(
+                {
+                    name: [to_cell(record.get(name), type_) for record in batch]
+                    for name, type_ in columns.items()
+                },
+                schema=schema,
+            )
+            writer.write_table(table)
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+EXPORT_WRITERS = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+    "parquet": iter_parquet,
+}
+
+
+def check_export_format(export_format: str) -> None:
+    """
+    Raise ValueError if the format can not be exported
+    """
+    if export_format not in EXPORT_WRITERS:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow to be installed")
+
+
+def iter_zip(members: Iterable[Tuple[str, Iterator[bytes]]]) -> Iterator[bytes]:
+    """
+    Stream a zip archive of (file name, content chunks) members
+    """
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in members:
+            # the size is unknown upfront, allow members over 2 GiB
+            with archive.open(name, "w", force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+
+    yield sink.drain()
@@ -7,3 +7,10 @@ class DatasetForm(forms.ModelForm):
     class Meta:
         model = DataSet
         fields = ["name", "description", "backend"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            # the records stay in the storage of the backend they were
+            # created with, so the backend of a dataset cannot be changed
+            self.fields["backend"].disabled = True
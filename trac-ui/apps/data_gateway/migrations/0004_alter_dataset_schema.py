@@ -1,7 +1,22 @@
 # Generated by Django 4.1.2 on 2022-10-28 00:10
 
+import json
+
 import apps.data_gateway.models
 from django.db import migrations, models
+from trac.schema.task import FileDef
+
+
+# custom json decoder for the schema type
+# schema takes the form {"input_schema": List[FileDef], "output_schema": List[FileDef]}
+class FileDefListDecoder(json.JSONDecoder):
+    def decode(self, s):
+        d = super().decode(s)
+        if isinstance(d, dict):
+            for k, v in d.items():
+                if isinstance(v, list):
+                    d[k] = [FileDef(**x) for x in v]
+        return d
 
 
 class Migration(migrations.Migration):
@@ -16,7 +31,7 @@ class Migration(migrations.Migration):
             name="schema",
             field=models.JSONField(
                 blank=True,
-                decoder=apps.data_gateway.models.FileDefListDecoder,
+                decoder=FileDefListDecoder,
                 encoder=apps.data_gateway.models.FileDefListEncoder,
                 null=True,
             ),
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0004_alter_dataset_schema"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dataset",
+            name="backend",
+            field=models.CharField(
+                choices=[
+                    ("excel", "Excel"),
+                    ("db", "Database"),
+                    ("columnar", "Columnar Database"),
+                    ("gsheet", "Google Sheet"),
+                ],
+                default="db",
+                max_length=100,
+            ),
+        ),
+        migrations.CreateModel(
+            name="ResourceChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource_type", models.CharField(max_length=100)),
+                ("seq", models.PositiveIntegerField()),
+                ("num_rows", models.PositiveIntegerField()),
+                ("columns", models.JSONField()),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="resource_chunks",
+                        to="data_gateway.dataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["seq"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="resourcechunk",
+            constraint=models.UniqueConstraint(
+                fields=("dataset", "resource_type", "seq"), name="unique_resource_chunk"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0005_resourcechunk"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="resource",
+            index=models.Index(
+                fields=["dataset", "resource_type", "id"], name="resource_sheet_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0006_resource_sheet_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="revision",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:39
+
+import apps.data_gateway.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0007_dataset_revision"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dataset",
+            name="schema",
+            field=apps.data_gateway.models.SchemaField(
+                blank=True,
+                encoder=apps.data_gateway.models.FileDefListEncoder,
+                null=True,
+            ),
+        ),
+    ]
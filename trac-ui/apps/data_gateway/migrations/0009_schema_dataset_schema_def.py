@@ -0,0 +1,39 @@
+import apps.data_gateway.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0008_dataset_schema_lazy"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Schema",
+            fields=[
+                (
+                    "hash",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                (
+                    "content",
+                    apps.data_gateway.models.SchemaField(
+                        encoder=apps.data_gateway.models.FileDefListEncoder
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="schema_def",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="datasets",
+                to="data_gateway.schema",
+            ),
+        ),
+    ]
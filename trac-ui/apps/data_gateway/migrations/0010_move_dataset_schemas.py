@@ -0,0 +1,76 @@
+import hashlib
+import json
+
+from django.db import migrations
+
+# copies of the schema helpers of apps.data_gateway.models, as of this
+# migration, so that later changes to the models do not change the hashes
+# given to the existing datasets
+
+
+def _sort_keys(value, keep_order=False):
+    if isinstance(value, dict):
+        # the order of the properties is the order of the columns
+        items = value.items() if keep_order else sorted(value.items())
+        return {k: _sort_keys(v, keep_order=k == "properties") for k, v in items}
+    elif isinstance(value, list):
+        return [_sort_keys(x) for x in value]
+    else:
+        return value
+
+
+def canonical_schema(schema):
+    """
+    The plain json form of a schema, with the keys sorted recursively,
+    except the properties of the file schemas which keep their order
+    """
+    # the schemas are read with values_list, so they are plain json already
+    return _sort_keys(json.loads(json.dumps(schema)))
+
+
+def hash_schema(schema) -> str:
+    """
+    Hash of the canonical form of a schema
+    """
+    canonical = json.dumps(canonical_schema(schema), separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def move_schemas(apps, schema_editor):
+    """
+    Move the schema of each dataset to the shared schema rows
+    """
+    DataSet = apps.get_model("data_gateway", "DataSet")
+    Schema = apps.get_model("data_gateway", "Schema")
+
+    # values_list skips the decoding of the schemas
+    for dataset_id, schema in DataSet.objects.values_list("id", "schema").iterator():
+        if schema is None:
+            continue
+        schema_hash = hash_schema(schema)
+        Schema.objects.get_or_create(
+            hash=schema_hash, defaults={"content": canonical_schema(schema)}
+        )
+        DataSet.objects.filter(id=dataset_id).update(schema_def_id=schema_hash)
+
+
+def restore_schemas(apps, schema_editor):
+    """
+    Copy the shared schema rows back to the datasets
+    """
+    DataSet = apps.get_model("data_gateway", "DataSet")
+    Schema = apps.get_model("data_gateway", "Schema")
+
+    for schema_hash, content in Schema.objects.values_list("hash", "content"):
+        DataSet.objects.filter(schema_def_id=schema_hash).update(schema=content)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0009_schema_dataset_schema_def"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_schemas, restore_schemas),
+    ]
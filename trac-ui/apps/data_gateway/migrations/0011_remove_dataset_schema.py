@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0010_move_dataset_schemas"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="dataset",
+            name="schema",
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0011_remove_dataset_schema"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resourcechunk",
+            name="last_id",
+            field=models.BigIntegerField(default=-1),
+        ),
+        migrations.AddField(
+            model_name="resourcechunk",
+            name="row_ids",
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def number_rows(apps, schema_editor):
+    """
+    Give the rows of the existing chunks their position in the sheet as id,
+    which is the id they were served with so far
+    """
+    ResourceChunk = apps.get_model("data_gateway", "ResourceChunk")
+
+    sheet = None
+    next_id = 0
+    # one row per chunk, read before the updates
+    chunks = list(
+        ResourceChunk.objects.order_by(
+            "dataset_id", "resource_type", "seq"
+        ).values_list("id", "dataset_id", "resource_type", "num_rows")
+    )
+    for chunk_id, dataset_id, resource_type, num_rows in chunks:
+        if (dataset_id, resource_type) != sheet:
+            sheet = (dataset_id, resource_type)
+            next_id = 0
+        ResourceChunk.objects.filter(id=chunk_id).update(
+            row_ids=list(range(next_id, next_id + num_rows)),
+            last_id=next_id + num_rows - 1,
+        )
+        next_id += num_rows
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_gateway", "0012_resourcechunk_row_ids"),
+    ]
+
+    operations = [
+        migrations.RunPython(number_rows, migrations.RunPython.noop),
+    ]
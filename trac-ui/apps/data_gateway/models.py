@@ -1,33 +1,151 @@
 import hashlib
 import json
+import threading
+from types import MappingProxyType
+from typing import Dict, Mapping
 
 from apps.trac_app.models import AppInstance
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 from trac.schema.task import FileDef
 
 
-# custom json decoder for the schema type
-# schema takes the form {"input_schema": List[FileDef], "output_schema": List[FileDef]}
-class FileDefListDecoder(json.JSONDecoder):
-    def decode(self, s):
-        d = super().decode(s)
-        if isinstance(d, dict):
-            for k, v in d.items():
-                if isinstance(v, list):
-                    d[k] = [FileDef(**x) for x in v]
-        return d
-
-
 # custom json encoder for the schema type
 # schema takes the form {"input_schema": List[FileDef], "output_schema": List[FileDef]}
 class FileDefListEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, FileDef):
             return o.dict()
+        elif isinstance(o, MappingProxyType):
+            return dict(o)
         else:
             return super().default(o)
 
 
+# parsed schemas by schema hash, shared by all the datasets with the same schema
+_PARSED_SCHEMAS: Dict[str, Mapping] = {}
+_PARSED_SCHEMAS_LOCK = threading.Lock()
+# number of parsed schemas kept, the oldest ones are dropped beyond it
+PARSED_SCHEMA_CACHE_SIZE = 1024
+
+
+def _sort_keys(value, keep_order=False):
+    if isinstance(value, dict):
+        # the order of the properties is the order of the columns
+        items = value.items() if keep_order else sorted(value.items())
+        return {k: _sort_keys(v, keep_order=k == "properties") for k, v in items}
+    elif isinstance(value, list):
+        return [_sort_keys(x) for x in value]
+    else:
+        return value
+
+
+def canonical_schema(schema):
+    """
+    The plain json form of a schema, with the keys sorted recursively,
+    except the properties of the file schemas which keep their order
+    """
+    return _sort_keys(json.loads(json.dumps(schema, cls=FileDefListEncoder)))
+
+
+def hash_schema(schema) -> str:
+    """
+    Hash of the canonical form of a schema
+    """
+    canonical = json.dumps(canonical_schema(schema), separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def parse_schema(schema) -> Mapping:
+    """
+    Turn the lists of a stored schema into tuples of FileDef
+    The result is read-only, as it is shared by the datasets
+    """
+    return MappingProxyType(
+        {
+            key: tuple(x if isinstance(x, FileDef) else FileDef(**x) for x in value)
+            if isinstance(value, (list, tuple))
+            else value
+            for key, value in schema.items()
+        }
+    )
+
+
+def get_parsed_schema(key: str, schema) -> Mapping:
+    """
+    Return the parsed schema of hash key, parse schema on a cache miss
+    """
+    parsed = _PARSED_SCHEMAS.get(key)
+    if parsed is None:
+        parsed = parse_schema(schema)
+        with _PARSED_SCHEMAS_LOCK:
+            if len(_PARSED_SCHEMAS) >= PARSED_SCHEMA_CACHE_SIZE:
+                _PARSED_SCHEMAS.pop(next(iter(_PARSED_SCHEMAS)))
+            _PARSED_SCHEMAS[key] = parsed
+    return parsed
+
+
+class LazySchemaAttribute(DeferredAttribute):
+    """
+    Hold the schema as stored, and parse it on first access only
+
+    Loading rows does not build any FileDef, and equal schemas share the
+    parsed one
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        raw = super().__get__(instance, cls)
+        if not isinstance(raw, (dict, MappingProxyType)):
+            return raw
+
+        parsed = instance.__dict__.get("_parsed_schema")
+        # the raw value is replaced, never mutated, when the schema is set
+        if parsed is None or parsed[0] is not raw:
+            key = hash_schema(raw)
+            parsed = (raw, key, get_parsed_schema(key, raw))
+            instance.__dict__["_parsed_schema"] = parsed
+        return parsed[2]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class SchemaField(models.JSONField):
+    """
+    A json field holding a schema,
+    {"input_schema": List[FileDef], "output_schema": List[FileDef]}
+    """
+
+    descriptor_class = LazySchemaAttribute
+
+
+class Schema(models.Model):
+    """
+    A distinct schema, shared by all the datasets having it
+    Identified by the hash of its content
+    """
+
+    hash = models.CharField(max_length=64, primary_key=True)
+    # decoded to FileDef on first access, see LazySchemaAttribute
+    content = SchemaField(encoder=FileDefListEncoder)
+
+    def __str__(self):
+        return self.hash
+
+    @classmethod
+    def intern(cls, schema) -> "Schema":
+        """
+        Return the row of a schema, create it if it is new
+        """
+        schema_hash = hash_schema(schema)
+        obj, _ = cls.objects.get_or_create(
+            hash=schema_hash, defaults={"content": canonical_schema(schema)}
+        )
+        return obj
+
+
 class DataSet(models.Model):
     """
     A dataset = a workbook in excel
@@ -39,8 +157,13 @@ class DataSet(models.Model):
         AppInstance, on_delete=models.CASCADE, related_name="datasets"
     )
 
-    schema = models.JSONField(
-        blank=True, null=True, decoder=FileDefListDecoder, encoder=FileDefListEncoder
+    # read and written through the schema property
+    schema_def = models.ForeignKey(
+        Schema,
+        on_delete=models.PROTECT,
+        related_name="datasets",
+        null=True,
+        blank=True,
     )
 
     initialized = models.BooleanField(default=False)
@@ -50,33 +173,62 @@ class DataSet(models.Model):
         choices=[
             ("excel", "Excel"),
             ("db", "Database"),
+            ("columnar", "Columnar Database"),
             ("gsheet", "Google Sheet"),
         ],
         default="db",
     )
+    # bumped on every write to the records, identifies a version of the content
+    revision = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    @property
+    def schema(self):
+        """
+        The schema of the dataset,
+        {"input_schema": Tuple[FileDef], "output_schema": Tuple[FileDef]}
+        Shared by all the datasets with the same schema, and read-only
+        """
+        pending = self.__dict__.get("_pending_schema")
+        if pending is not None:
+            return get_parsed_schema(self.schema_def_id, pending)
+        if self.schema_def_id is None:
+            return None
+        # the parsed schemas are cached by hash, the row is only loaded on a miss
+        parsed = _PARSED_SCHEMAS.get(self.schema_def_id)
+        if parsed is None:
+            parsed = self.schema_def.content
+        return parsed
+
+    @schema.setter
+    def schema(self, value):
+        # the schema row is created on save
+        self.__dict__["_pending_schema"] = value
+        self.schema_def_id = None if value is None else hash_schema(value)
+
     def save(self, *args, **kwargs):
-        # reoder the keys and values in the schema in alphabetical order recursively
-        self.schema = self._sort_dict(self.schema)
+        pending = self.__dict__.pop("_pending_schema", None)
+        if pending is not None:
+            self.schema_def = Schema.intern(pending)
         super().save(*args, **kwargs)
 
-    def _sort_dict(self, d):
-        if isinstance(d, dict):
-            return {k: self._sort_dict(v) for k, v in sorted(d.items())}
-        elif isinstance(d, list):
-            return [self._sort_dict(x) for x in d]
-        else:
-            return d
+    def bump_revision(self):
+        """
+        Record that the records of the dataset changed
+        """
+        DataSet.objects.filter(pk=self.pk).update(revision=models.F("revision") + 1)
+        self.refresh_from_db(fields=["revision"])
 
     def schema_hash(self):
         """
         Hash value of the schema
         So that we can compare the schema of two datasets
         """
-        return hashlib.sha256(str(self.schema).encode("utf-8")).hexdigest()
+        if self.schema_def_id is None:
+            return hash_schema(None)
+        return self.schema_def_id
 
 
 class Resource(models.Model):
@@ -90,5 +242,44 @@ class Resource(models.Model):
     resource_type = models.CharField(max_length=100)
     value = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # resources are always listed per sheet, in id order
+            models.Index(
+                fields=["dataset", "resource_type", "id"],
+                name="resource_sheet_idx",
+            )
+        ]
+
     def __str__(self):
         return self.name
+
+
+class ResourceChunk(models.Model):
+    """
+    A chunk of consecutive rows of a sheet, stored column by column
+    Used by the datasets with the columnar backend
+    """
+
+    dataset = models.ForeignKey(
+        DataSet, on_delete=models.CASCADE, related_name="resource_chunks"
+    )
+    resource_type = models.CharField(max_length=100)
+    # position of the chunk in the sheet
+    seq = models.PositiveIntegerField()
+    num_rows = models.PositiveIntegerField()
+    # {column name: [typed values]}, all of length num_rows
+    columns = models.JSONField()
+    # ids of the rows, increasing across the chunks of the sheet
+    row_ids = models.JSONField(default=list)
+    # the highest id given to a row of the chunk, the row may be deleted since
+    last_id = models.BigIntegerField(default=-1)
+
+    class Meta:
+        ordering = ["seq"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dataset", "resource_type", "seq"],
+                name="unique_resource_chunk",
+            )
+        ]
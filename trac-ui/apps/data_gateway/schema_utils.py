@@ -21,15 +21,41 @@ def generate_openapi_paths(url_prefix, resource_schema: FileDef):
                 "summary": f"List {resource_type}",
                 "description": f"List all {resource_type}",
                 "operationId": f"list_{resource_type}",
+                "parameters": [
+                    {
+                        "name": "limit",
+                        "in": "query",
+                        "description": "Maximum number of resources to return",
+                        "required": False,
+                        "schema": {"type": "integer"},
+                    },
+                    {
+                        "name": "after",
+                        "in": "query",
+                        "description": "Only return resources with an id greater than this",
+                        "required": False,
+                        "schema": {"type": "integer", "format": "int64"},
+                    },
+                ],
                 "responses": {
                     "200": {
-                        "description": f"List of {resource_type}",
+                        "description": f"A page of {resource_type}",
                         "content": {
                             "application/json": {
                                 "schema": {
-                                    "type": "array",
-                                    "items": {
-                                        "$ref": f"#/components/schemas/{resource_type}"
+                                    "type": "object",
+                                    "properties": {
+                                        "results": {
+                                            "type": "array",
+                                            "items": {
+                                                "$ref": f"#/components/schemas/{resource_type}"
+                                            },
+                                        },
+                                        "next": {
+                                            "type": "string",
+                                            "nullable": True,
+                                            "description": "Url of the next page",
+                                        },
                                     },
                                 }
                             }
@@ -64,6 +90,47 @@ def generate_openapi_paths(url_prefix, resource_schema: FileDef):
                 },
             },
         },
+        f"/{url_prefix}/{resource_type}/_bulk": {
+            "post": {
+                "summary": f"Create or update {resource_type} in bulk",
+                "description": f"Create the {resource_type} without an id, update the ones with an id",
+                "operationId": f"bulk_{resource_type}",
+                "parameters": [
+                    {
+                        "name": "chunk_size",
+                        "in": "query",
+                        "description": "Number of objects validated and written at a time",
+                        "required": False,
+                        "schema": {"type": "integer"},
+                    },
+                ],
+                "requestBody": {
+                    "description": f"{resource_type} to create or update",
+                    "content": {
+                        "application/json": {
+                            "schema": {
+                                "type": "array",
+                                "items": {
+                                    "$ref": f"#/components/schemas/{resource_type}"
+                                },
+                            }
+                        },
+                        "application/x-ndjson": {
+                            "schema": {"type": "string"},
+                        },
+                        "text/csv": {
+                            "schema": {"type": "string"},
+                        },
+                    },
+                    "required": True,
+                },
+                "responses": {
+                    "200": {"description": f"{resource_type} updated"},
+                    "201": {"description": f"{resource_type} created"},
+                    "400": {"description": "Invalid objects, nothing is written"},
+                },
+            },
+        },
         f"/{url_prefix}/{resource_type}/{{resource_id}}/": {
             "get": {
                 "summary": f"Get {resource_type}",
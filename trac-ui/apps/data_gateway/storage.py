@@ -0,0 +1,397 @@
+"""
+Storage engines for the records of the datasets stored in the database
+
+A dataset's backend selects the engine keeping its records:
+- db: one Resource row, holding the record as JSON, per record
+- columnar: ResourceChunk rows, each holding a run of records column by column,
+  with the values typed by the file_schema of the sheet
+"""
+
+import bisect
+import itertools
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DataSet, Resource, ResourceChunk
+
+
+class StorageEngine:
+    """
+    Read and write the records of a sheet (resource type) of a dataset
+    Each record is identified by an id, which is never changed nor reused,
+    and the ids increase with the order of the records
+    Writes bump the revision of the dataset
+    """
+
+    def iter_rows(
+        self, dataset: DataSet, resource_type: str, after: Optional[int] = None
+    ) -> Iterator[Tuple]:
+        """
+        Iterate over the (id, record) pairs of a sheet, in order
+        If after is given, start with the first record with a greater id
+        """
+        raise NotImplementedError
+
+    def get_record(self, dataset: DataSet, resource_type: str, record_id: int) -> Dict:
+        """
+        Return a record of a sheet
+        Raise KeyError if it does not exist
+        """
+        for row_id, record in self.iter_rows(
+            dataset, resource_type, after=record_id - 1
+        ):
+            if row_id == record_id:
+                return record
+            break
+        raise KeyError(f"Unknown record {record_id} in sheet {resource_type}")
+
+    def iter_records(self, dataset: DataSet, resource_type: str) -> Iterator[Dict]:
+        """
+        Iterate over the records of a sheet, in order
+        """
+        for _, record in self.iter_rows(dataset, resource_type):
+            yield record
+
+    def append_records(
+        self, dataset: DataSet, resource_type: str, records: Iterable[Dict]
+    ) -> int:
+        """
+        Append records to a sheet, return the number of records written
+        """
+        raise NotImplementedError
+
+    def apply_changes(
+        self,
+        dataset: DataSet,
+        resource_type: str,
+        created: List[Dict],
+        updated: Dict[int, Dict],
+        deleted: List[int],
+    ) -> Tuple[int, int, int]:
+        """
+        Apply the changes made to a sheet in the spreadsheet view
+        Raise KeyError if an updated record does not exist
+        Return the number of records created, updated and deleted
+        """
+        raise NotImplementedError
+
+
+class RowStorage(StorageEngine):
+    """
+    One Resource row per record
+    """
+
+    batch_size = 1000
+
+    def iter_rows(self, dataset, resource_type, after=None):
+        resources = Resource.objects.filter(
+            dataset=dataset, resource_type=resource_type
+        )
+        if after is not None:
+            resources = resources.filter(id__gt=after)
+        resources = resources.order_by("id").values_list("id", "value")
+        return resources.iterator(chunk_size=self.batch_size)
+
+    def get_record(self, dataset, resource_type, record_id):
+        try:
+            return Resource.objects.values_list("value", flat=True).get(
+                dataset=dataset, resource_type=resource_type, id=record_id
+            )
+        except Resource.DoesNotExist:
+            raise KeyError(f"Unknown record {record_id} in sheet {resource_type}")
+
+    def append_records(self, dataset, resource_type, records):
+        num_records = 0
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                if num_records:
+                    dataset.bump_revision()
+                return num_records
+
+            Resource.objects.bulk_create(
+                [
+                    Resource(dataset=dataset, resource_type=resource_type, value=record)
+                    for record in batch
+                ]
+            )
+            num_records += len(batch)
+
+    def apply_changes(self, dataset, resource_type, created, updated, deleted):
+        resources = Resource.objects.filter(
+            dataset=dataset, resource_type=resource_type
+        )
+
+        # update the changed rows
+        resources_to_update = list(resources.filter(id__in=updated))
+        if len(resources_to_update) != len(updated):
+            raise KeyError(f"Unknown resources in sheet {resource_type}")
+        for resource in resources_to_update:
+            resource.value = updated[resource.id]
+        Resource.objects.bulk_update(
+            resources_to_update, ["value"], batch_size=self.batch_size
+        )
+
+        # add the new rows
+        num_created = self.append_records(dataset, resource_type, created)
+
+        # delete the removed rows
+        num_deleted, _ = resources.filter(id__in=deleted).delete()
+
+        if resources_to_update or num_deleted:
+            dataset.bump_revision()
+
+        return num_created, len(resources_to_update), num_deleted
+
+
+class ColumnarStorage(StorageEngine):
+    """
+    Records are stored in chunks of rows, each chunk holds one typed array
+    per column of the file_schema, so that a sheet is read with a handful
+    of sequential reads instead of one JSON decode per record
+    The rows get increasing ids when they are appended. The last chunk of a
+    sheet is kept when all its rows are deleted, as it holds the last id given
+    """
+
+    @property
+    def chunk_rows(self):
+        return getattr(settings, "TRAC_COLUMNAR_CHUNK_ROWS", 10000)
+
+    def _columns(self, dataset, resource_type) -> Dict[str, str]:
+        """
+        Return the {column name: json schema type} of a sheet
+        """
+        for file_def in (
+            *dataset.schema["input_schema"],
+            *dataset.schema.get("output_schema", ()),
+        ):
+            if file_def.name == resource_type:
+                return {
+                    name: prop.get("type")
+                    for name, prop in file_def.file_schema["properties"].items()
+                }
+        raise KeyError(f"Unknown sheet {resource_type}")
+
+    def _lock(self, dataset) -> None:
+        """
+        Serialize the writes to a dataset, which read the chunks they rewrite,
+        the next seq and the next row id
+        Must be called in a transaction
+        """
+        list(DataSet.objects.select_for_update().filter(pk=dataset.pk).values("pk"))
+
+    def iter_rows(self, dataset, resource_type, after=None):
+        chunks = ResourceChunk.objects.filter(
+            dataset=dataset, resource_type=resource_type
+        ).order_by("seq")
+        if after is not None:
+            # skip the chunks before the start without reading their columns
+            chunks = chunks.filter(last_id__gt=after)
+
+        for chunk in chunks.iterator(chunk_size=1):
+            for row_id, record in zip(chunk.row_ids, chunk_records(chunk)):
+                if after is None or row_id > after:
+                    yield row_id, record
+
+    def append_records(self, dataset, resource_type, records):
+        columns = self._columns(dataset, resource_type)
+        with transaction.atomic():
+            self._lock(dataset)
+            last_chunk = (
+                ResourceChunk.objects.filter(
+                    dataset=dataset, resource_type=resource_type
+                )
+                .order_by("-seq")
+                .first()
+            )
+            seq = next_id = 0
+            if last_chunk:
+                seq = last_chunk.seq + 1
+                next_id = last_chunk.last_id + 1
+
+            num_records = 0
+            records = iter(records)
+            while True:
+                batch = list(itertools.islice(records, self.chunk_rows))
+                if not batch:
+                    if num_records:
+                        dataset.bump_revision()
+                    return num_records
+
+                if last_chunk and last_chunk.num_rows == 0:
+                    # the new chunk holds the last id given from now on
+                    last_chunk.delete()
+                    seq = last_chunk.seq
+                last_chunk = ResourceChunk.objects.create(
+                    dataset=dataset,
+                    resource_type=resource_type,
+                    seq=seq,
+                    num_rows=len(batch),
+                    columns=to_columns(batch, columns),
+                    row_ids=list(range(next_id, next_id + len(batch))),
+                    last_id=next_id + len(batch) - 1,
+                )
+                seq += 1
+                next_id += len(batch)
+                num_records += len(batch)
+
+    def apply_changes(self, dataset, resource_type, created, updated, deleted):
+        with transaction.atomic():
+            self._lock(dataset)
+            return self._apply_changes(
+                dataset, resource_type, created, updated, deleted
+            )
+
+    def _apply_changes(self, dataset, resource_type, created, updated, deleted):
+        chunks = list(
+            ResourceChunk.objects.filter(dataset=dataset, resource_type=resource_type)
+            .order_by("seq")
+            .values_list("id", "num_rows", "last_id")
+        )
+        last_ids = [last_id for _, _, last_id in chunks]
+
+        def chunk_of(row_id):
+            # the ids increase across the chunks
+            idx = bisect.bisect_left(last_ids, row_id)
+            return idx if row_id >= 0 and idx < len(chunks) else None
+
+        # the changed rows of each chunk, by row id
+        chunk_updates = defaultdict(dict)
+        for row_id, record in updated.items():
+            idx = chunk_of(row_id)
+            if idx is None:
+                raise KeyError(f"Unknown row {row_id} in sheet {resource_type}")
+            chunk_updates[idx][row_id] = record
+
+        chunk_deletes = defaultdict(set)
+        for row_id in set(deleted):
+            idx = chunk_of(row_id)
+            if idx is not None:
+                chunk_deletes[idx].add(row_id)
+
+        # fill the room left in the last chunk before starting new ones
+        created = list(created)
+        topped_up = []
+        if created and chunks and chunks[-1][1] < self.chunk_rows:
+            room = self.chunk_rows - chunks[-1][1]
+            topped_up, created = created[:room], created[room:]
+
+        touched = set(chunk_updates) | set(chunk_deletes)
+        if topped_up:
+            touched.add(len(chunks) - 1)
+
+        # only the chunks holding changed rows are rewritten
+        chunk_ids = {chunks[idx][0]: idx for idx in touched}
+        loaded = ResourceChunk.objects.in_bulk(chunk_ids)
+        # check that the updated rows exist before writing anything
+        for chunk_id, idx in chunk_ids.items():
+            missing = set(chunk_updates.get(idx, ())) - set(loaded[chunk_id].row_ids)
+            if missing:
+                raise KeyError(f"Unknown row {min(missing)} in sheet {resource_type}")
+
+        columns = self._columns(dataset, resource_type)
+        num_deleted = 0
+        for chunk_id, idx in chunk_ids.items():
+            chunk = loaded[chunk_id]
+            updates = chunk_updates.get(idx, {})
+            removed = chunk_deletes.get(idx, set())
+            row_ids = []
+            records = []
+            for row_id, record in zip(chunk.row_ids, chunk_records(chunk)):
+                if row_id in removed:
+                    num_deleted += 1
+                    continue
+                row_ids.append(row_id)
+                records.append(updates.get(row_id, record))
+
+            is_last = idx == len(chunks) - 1
+            if is_last and topped_up:
+                next_id = chunk.last_id + 1
+                row_ids.extend(range(next_id, next_id + len(topped_up)))
+                records.extend(topped_up)
+                chunk.last_id = row_ids[-1]
+
+            if not records and not is_last:
+                chunk.delete()
+                continue
+            chunk.columns = to_columns(records, columns)
+            chunk.num_rows = len(records)
+            chunk.row_ids = row_ids
+            chunk.save(update_fields=["columns", "num_rows", "row_ids", "last_id"])
+
+        self.append_records(dataset, resource_type, created)
+        if touched:
+            dataset.bump_revision()
+
+        return len(topped_up) + len(created), len(updated), num_deleted
+
+
+def chunk_records(chunk: ResourceChunk) -> Iterator[Dict]:
+    """
+    Iterate over the records of a chunk, in order
+    """
+    names = list(chunk.columns)
+    for values in zip(*(chunk.columns[name] for name in names)):
+        # drop the cells left empty, like a json row would
+        yield {name: value for name, value in zip(names, values) if value is not None}
+
+
+def coerce(value, type_):
+    """
+    Convert a cell value to the json schema type of its column
+    Empty cells become None
+    """
+    if value is None or value == "":
+        return None
+
+    if type_ == "integer":
+        if isinstance(value, str) and "." in value:
+            value = float(value)
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{value} is not an integer")
+        return int(value)
+    elif type_ == "number":
+        return float(value)
+    elif type_ == "boolean":
+        if isinstance(value, str):
+            if value.lower() in ("true", "1", "yes"):
+                return True
+            elif value.lower() in ("false", "0", "no"):
+                return False
+            raise ValueError(f"{value} is not a boolean")
+        return bool(value)
+    elif type_ == "string":
+        return str(value)
+    return value
+
+
+def to_columns(records: List[Dict], columns: Dict[str, str]) -> Dict[str, List]:
+    """
+    Transpose records to one typed array per column
+    """
+    result = {}
+    for name, type_ in columns.items():
+        try:
+            result[name] = [coerce(record.get(name), type_) for record in records]
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid value in column {name}: {e}")
+    return result
+
+
+STORAGE_ENGINES = {
+    "db": RowStorage(),
+    "columnar": ColumnarStorage(),
+}
+
+
+def get_storage(dataset: DataSet) -> StorageEngine:
+    """
+    Return the storage engine of a dataset stored in the database
+    """
+    if dataset.backend not in STORAGE_ENGINES:
+        raise Exception(f"Backend {dataset.backend} is not stored in the database")
+    return STORAGE_ENGINES[dataset.backend]
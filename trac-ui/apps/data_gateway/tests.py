@@ -1,7 +1,23 @@
+import importlib
+import io
 import json
+import zipfile
+from unittest.mock import patch
 
-from apps.data_gateway.models import FileDefListDecoder, FileDefListEncoder
-from django.test import SimpleTestCase
+from apps.data_gateway.data_gateway_views import get_resource_serializer
+from apps.data_gateway.forms import DatasetForm
+from apps.data_gateway.models import (
+    DataSet,
+    FileDefListEncoder,
+    Resource,
+    ResourceChunk,
+    Schema,
+    parse_schema,
+)
+from apps.data_gateway.storage import get_storage
+from apps.trac_app.models import AppDefinition, AppInstance
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
 from trac.schema.task import FILE_TYPE, FileDef
 
 
@@ -108,7 +124,11 @@ class SchemaUtilsTestCase(SimpleTestCase):
 
         schema = json.dumps(schema)
 
-        decoder = FileDefListDecoder()
+        # the decoder only remains in the migration it is used by
+        migration = importlib.import_module(
+            "apps.data_gateway.migrations.0004_alter_dataset_schema"
+        )
+        decoder = migration.FileDefListDecoder()
         decoded = decoder.decode(schema)
 
         expected_decoded_schema = {
@@ -143,3 +163,622 @@ class SchemaUtilsTestCase(SimpleTestCase):
         }
 
         self.assertDictEqual(decoded, expected_decoded_schema)
+
+
+def create_people_dataset(app_inst, backend="db"):
+    """
+    A dataset with a single sheet of people
+    """
+    return DataSet.objects.create(
+        name="test_dataset",
+        app=app_inst,
+        backend=backend,
+        schema={
+            "input_schema": [
+                FileDef(
+                    name="people",
+                    description="people",
+                    type=FILE_TYPE.INPUT,
+                    mount_path="/people.csv",
+                    file_schema={
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "age": {"type": "integer"},
+                        },
+                    },
+                )
+            ],
+            "output_schema": [],
+        },
+    )
+
+
+class LazySchemaTestCase(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        self.app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        create_people_dataset(self.app_inst)
+        create_people_dataset(self.app_inst)
+
+    def test_schema_is_parsed_lazily_and_shared(self):
+        with patch(
+            "apps.data_gateway.models.parse_schema", wraps=parse_schema
+        ) as parse:
+            datasets = list(DataSet.objects.all())
+            parse.assert_not_called()
+
+            first, second = [dataset.schema for dataset in datasets]
+            self.assertIsInstance(first["input_schema"][0], FileDef)
+            # equal schemas are parsed once
+            self.assertIs(first, second)
+            self.assertLessEqual(parse.call_count, 1)
+
+        self.assertEqual(datasets[0].schema_hash(), datasets[1].schema_hash())
+        with self.assertRaises(TypeError):
+            first["input_schema"] = []
+
+        # a parsed schema can be saved to another dataset
+        copy = DataSet.objects.create(name="copy", app=self.app_inst, schema=first)
+        copy.refresh_from_db()
+        self.assertEqual(copy.schema_hash(), datasets[0].schema_hash())
+
+    def test_schemas_are_stored_once(self):
+        """
+        Equal schemas share one row, and are compared without queries
+        """
+        self.assertEqual(Schema.objects.count(), 1)
+
+        first, second = DataSet.objects.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(first.schema_hash(), second.schema_hash())
+
+        # the order of the columns is part of the schema
+        file_def = first.schema["input_schema"][0]
+        file_schema = dict(file_def.file_schema)
+        file_schema["properties"] = dict(
+            reversed(list(file_schema["properties"].items()))
+        )
+        other = DataSet.objects.create(
+            name="other",
+            app=self.app_inst,
+            schema={
+                "input_schema": [file_def.copy(update={"file_schema": file_schema})],
+                "output_schema": [],
+            },
+        )
+        self.assertNotEqual(other.schema_hash(), first.schema_hash())
+        self.assertEqual(Schema.objects.count(), 2)
+
+        other.refresh_from_db()
+        self.assertEqual(
+            list(other.schema["input_schema"][0].file_schema["properties"]),
+            ["age", "name"],
+        )
+
+
+class DatasetInputSaveTestCase(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        self.app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = create_people_dataset(self.app_inst)
+        self.resources = Resource.objects.bulk_create(
+            [
+                Resource(
+                    dataset=self.dataset,
+                    resource_type="people",
+                    value={"name": name, "age": 1},
+                )
+                for name in ["alice", "bob", "carol"]
+            ]
+        )
+
+    def save(self, payload):
+        return self.client.post(
+            reverse("data_gateway:save_data", args=[self.app_inst.id, self.dataset.id]),
+            {"data": json.dumps(payload)},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+
+    def test_view_holds_resource_ids(self):
+        """
+        Each row of the grid holds the id of its resource in a hidden column,
+        so that the client matches the rows by id rather than by position
+        """
+        response = self.client.get(
+            reverse("data_gateway:view_input", args=[self.app_inst.id, self.dataset.id])
+        )
+        (sheet,) = json.loads(response.context["workbook_data"])
+        self.assertEqual(json.loads(response.context["id_columns"]), {"people": 2})
+        self.assertEqual(sheet["config"], {"colhidden": {"2": 0}})
+        ids = {cell["r"]: cell["v"] for cell in sheet["celldata"] if cell["c"] == 2}
+        self.assertEqual(
+            ids, {0: "id", **{idx + 1: r.id for idx, r in enumerate(self.resources)}}
+        )
+
+    def test_save_applies_row_changes(self):
+        """
+        Only the changed rows are written, the others are left untouched
+        """
+        alice, bob, carol = self.resources
+        response = self.save(
+            [
+                {
+                    "name": "people",
+                    "created": [["dave", 4]],
+                    "updated": [{"id": bob.id, "row": ["bob", 2]}],
+                    "deleted": [carol.id],
+                }
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+
+        values = list(
+            Resource.objects.filter(dataset=self.dataset)
+            .order_by("id")
+            .values_list("id", "value")
+        )
+        self.assertEqual(values[0], (alice.id, {"name": "alice", "age": 1}))
+        self.assertEqual(values[1], (bob.id, {"name": "bob", "age": 2}))
+        self.assertEqual(values[2][1], {"name": "dave", "age": 4})
+        self.assertEqual(len(values), 3)
+
+    def test_save_rejects_unknown_resources(self):
+        """
+        A change to a resource of another sheet is rejected, and nothing is written
+        """
+        response = self.save(
+            [
+                {
+                    "name": "people",
+                    "created": [["dave", 4]],
+                    "updated": [{"id": 12345, "row": ["bob", 2]}],
+                }
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Resource.objects.filter(dataset=self.dataset).count(), 3)
+
+
+class ColumnarStorageTestCase(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = create_people_dataset(app_inst, backend="columnar")
+        self.storage = get_storage(self.dataset)
+
+    @override_settings(TRAC_COLUMNAR_CHUNK_ROWS=2)
+    def test_records_roundtrip(self):
+        """
+        Records are typed by the file_schema, and read back in order across chunks
+        """
+        records = [{"name": "alice", "age": "1"}, {"name": "bob", "age": 2.0}]
+        records += [{"name": "carol"}]
+        self.storage.append_records(self.dataset, "people", records)
+
+        self.assertEqual(ResourceChunk.objects.filter(dataset=self.dataset).count(), 2)
+        self.assertEqual(
+            list(self.storage.iter_rows(self.dataset, "people")),
+            [
+                (0, {"name": "alice", "age": 1}),
+                (1, {"name": "bob", "age": 2}),
+                (2, {"name": "carol"}),
+            ],
+        )
+
+    def test_apply_changes(self):
+        """
+        Rows are addressed by id, and the changes are applied in place
+        """
+        records = [{"name": name, "age": 1} for name in ["alice", "bob", "carol"]]
+        self.storage.append_records(self.dataset, "people", records)
+
+        counts = self.storage.apply_changes(
+            self.dataset,
+            "people",
+            created=[{"name": "dave", "age": 4}],
+            updated={1: {"name": "bob", "age": 2}},
+            deleted=[2],
+        )
+        self.assertEqual(counts, (1, 1, 1))
+        self.assertEqual(
+            list(self.storage.iter_records(self.dataset, "people")),
+            [
+                {"name": "alice", "age": 1},
+                {"name": "bob", "age": 2},
+                {"name": "dave", "age": 4},
+            ],
+        )
+
+    @override_settings(TRAC_COLUMNAR_CHUNK_ROWS=2)
+    def test_apply_changes_rewrites_changed_chunks(self):
+        """
+        Only the chunks holding changed rows are rewritten, new rows fill the
+        last chunk before new chunks are started
+        """
+        records = [{"name": f"person {idx}", "age": idx} for idx in range(5)]
+        self.storage.append_records(self.dataset, "people", records)
+        chunks = ResourceChunk.objects.filter(dataset=self.dataset)
+        before = {chunk.seq: chunk.columns for chunk in chunks}
+
+        counts = self.storage.apply_changes(
+            self.dataset,
+            "people",
+            created=[{"name": "new 1", "age": 5}, {"name": "new 2", "age": 6}],
+            updated={},
+            deleted=[0, 1],
+        )
+        self.assertEqual(counts, (2, 0, 2))
+
+        after = {chunk.seq: chunk.columns for chunk in chunks.all()}
+        # the first chunk is emptied, the middle one is untouched
+        self.assertNotIn(0, after)
+        self.assertEqual(after[1], before[1])
+        self.assertEqual(after[2]["name"], ["person 4", "new 1"])
+        self.assertEqual(after[3]["name"], ["new 2"])
+        self.assertEqual(
+            [
+                record["age"]
+                for record in self.storage.iter_records(self.dataset, "people")
+            ],
+            [2, 3, 4, 5, 6],
+        )
+        self.assertEqual(
+            [row_id for row_id, _ in self.storage.iter_rows(self.dataset, "people")],
+            [2, 3, 4, 5, 6],
+        )
+
+        # the deleted rows cannot be updated, nor the ones not created yet
+        for row_id in [0, 7]:
+            with self.assertRaises(KeyError):
+                self.storage.apply_changes(
+                    self.dataset, "people", created=[], updated={row_id: {}}, deleted=[]
+                )
+
+    @override_settings(TRAC_COLUMNAR_CHUNK_ROWS=2)
+    def test_row_ids_are_stable(self):
+        """
+        Deleting rows does not shift the ids of the others, and the ids of the
+        deleted rows are not given again, even when the sheet is emptied
+        """
+        records = [{"name": f"person {idx}", "age": idx} for idx in range(3)]
+        self.storage.append_records(self.dataset, "people", records)
+
+        self.storage.apply_changes(
+            self.dataset, "people", created=[], updated={}, deleted=[0]
+        )
+        # a client still holding the ids read before the delete
+        self.storage.apply_changes(
+            self.dataset,
+            "people",
+            created=[],
+            updated={2: {"name": "person 2", "age": 20}},
+            deleted=[],
+        )
+        self.assertEqual(
+            list(self.storage.iter_rows(self.dataset, "people", after=1)),
+            [(2, {"name": "person 2", "age": 20})],
+        )
+
+        self.storage.apply_changes(
+            self.dataset, "people", created=[], updated={}, deleted=[1, 2]
+        )
+        self.assertEqual(list(self.storage.iter_rows(self.dataset, "people")), [])
+        self.storage.append_records(self.dataset, "people", [{"name": "dave"}])
+        self.assertEqual(
+            list(self.storage.iter_rows(self.dataset, "people")),
+            [(3, {"name": "dave"})],
+        )
+        self.assertEqual(ResourceChunk.objects.filter(dataset=self.dataset).count(), 1)
+
+    def test_backend_is_read_only(self):
+        """
+        The backend of an existing dataset cannot be changed from the form
+        """
+        form = DatasetForm(
+            data={"name": "renamed", "description": "renamed", "backend": "db"},
+            instance=self.dataset,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().backend, "columnar")
+
+    def test_invalid_value(self):
+        with self.assertRaises(ValueError):
+            self.storage.append_records(
+                self.dataset, "people", [{"name": "alice", "age": "one"}]
+            )
+
+
+class ResourceApiTestCase(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = create_people_dataset(app_inst)
+        self.resources = Resource.objects.bulk_create(
+            [
+                Resource(
+                    dataset=self.dataset,
+                    resource_type="people",
+                    value={"name": f"person {idx}", "age": idx},
+                )
+                for idx in range(5)
+            ]
+        )
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_list_keyset_pagination(self):
+        """
+        Pages are chained by the id of their last resource
+        """
+        url = reverse(
+            "data_gateway:resource_list_create", args=[self.dataset.id, "people"]
+        )
+
+        names = []
+        page = self.get_page(url + "?limit=2")
+        while True:
+            names += [resource["name"] for resource in page["results"]]
+            if not page["next"]:
+                break
+            page = self.get_page(page["next"])
+
+        self.assertEqual(names, [f"person {idx}" for idx in range(5)])
+        self.assertEqual(page["results"][0]["id"], self.resources[4].id)
+
+    def test_list_unknown_resource_type(self):
+        url = reverse(
+            "data_gateway:resource_list_create", args=[self.dataset.id, "unknown"]
+        )
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_create(self):
+        url = reverse(
+            "data_gateway:resource_list_create", args=[self.dataset.id, "people"]
+        )
+        response = self.client.post(
+            url, {"name": "new person", "age": 7}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            Resource.objects.filter(dataset=self.dataset).last().value,
+            {"name": "new person", "age": 7},
+        )
+
+    def test_serializer_shared_per_schema(self):
+        """
+        Datasets with the same schema share the generated serializer class
+        """
+        other_dataset = create_people_dataset(self.dataset.app)
+        resource_schema = self.dataset.schema["input_schema"][0]
+
+        serializer_class = get_resource_serializer(self.dataset, resource_schema)
+        self.assertIs(
+            get_resource_serializer(other_dataset, resource_schema), serializer_class
+        )
+
+        serializer = serializer_class(data={"name": "alice", "age": "1"})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data, {"name": "alice", "age": 1})
+
+    def test_bulk_upsert(self):
+        """
+        Objects with an id are updated, the others are created
+        """
+        url = reverse("data_gateway:resource_bulk", args=[self.dataset.id, "people"])
+        payload = [
+            {"id": self.resources[0].id, "name": "renamed", "age": 0},
+            {"name": "new 1", "age": 10},
+            {"name": "new 2", "age": 11},
+        ]
+        response = self.client.post(
+            url + "?chunk_size=2", json.dumps(payload), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"created": 2, "updated": 1})
+
+        self.resources[0].refresh_from_db()
+        self.assertEqual(self.resources[0].value, {"name": "renamed", "age": 0})
+        self.assertEqual(Resource.objects.filter(dataset=self.dataset).count(), 7)
+
+    def test_bulk_csv_and_ndjson(self):
+        url = reverse("data_gateway:resource_bulk", args=[self.dataset.id, "people"])
+
+        response = self.client.post(
+            url, "name,age\ncsv 1,1\ncsv 2,2\n", content_type="text/csv"
+        )
+        self.assertEqual(response.json(), {"created": 2, "updated": 0})
+
+        response = self.client.post(
+            url,
+            '{"name": "ndjson 1", "age": 1}\n{"name": "ndjson 2", "age": 2}\n',
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.json(), {"created": 2, "updated": 0})
+
+        values = Resource.objects.filter(dataset=self.dataset).order_by("id")
+        self.assertEqual(values.last().value, {"name": "ndjson 2", "age": 2})
+        self.assertEqual(values[5].value, {"name": "csv 1", "age": 1})
+
+    def test_bulk_rejects_invalid_objects(self):
+        """
+        An invalid object rejects the whole request, including the valid chunks
+        """
+        url = reverse("data_gateway:resource_bulk", args=[self.dataset.id, "people"])
+        payload = [{"name": "valid", "age": 1}, {"name": "invalid", "age": "old"}]
+        response = self.client.post(
+            url + "?chunk_size=1", json.dumps(payload), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("1", response.json())
+        self.assertEqual(Resource.objects.filter(dataset=self.dataset).count(), 5)
+
+
+class ColumnarResourceApiTestCase(TestCase):
+    """
+    The resource api reads and writes the records of any storage engine
+    """
+
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        self.app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = create_people_dataset(self.app_inst, backend="columnar")
+        self.storage = get_storage(self.dataset)
+        self.storage.append_records(
+            self.dataset, "people", [{"name": "alice", "age": 1}]
+        )
+
+    def records(self):
+        return list(self.storage.iter_records(self.dataset, "people"))
+
+    def test_crud(self):
+        list_url = reverse(
+            "data_gateway:resource_list_create", args=[self.dataset.id, "people"]
+        )
+        bulk_url = reverse(
+            "data_gateway:resource_bulk", args=[self.dataset.id, "people"]
+        )
+        revision = DataSet.objects.get(id=self.dataset.id).revision
+
+        response = self.client.post(
+            list_url, {"name": "bob", "age": 2}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            bulk_url,
+            json.dumps(
+                [{"id": 0, "name": "alice", "age": 10}, {"name": "carol", "age": 3}]
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"created": 1, "updated": 1})
+        self.assertEqual(
+            self.records(),
+            [
+                {"name": "alice", "age": 10},
+                {"name": "bob", "age": 2},
+                {"name": "carol", "age": 3},
+            ],
+        )
+        # the input cache of the runs sees the changes
+        self.assertGreater(DataSet.objects.get(id=self.dataset.id).revision, revision)
+
+        page = json.loads(
+            b"".join(self.client.get(list_url + "?limit=2").streaming_content)
+        )
+        self.assertEqual([resource["id"] for resource in page["results"]], [0, 1])
+        page = json.loads(b"".join(self.client.get(page["next"]).streaming_content))
+        self.assertEqual(page["results"], [{"id": 2, "name": "carol", "age": 3}])
+
+        detail_url = reverse(
+            "data_gateway:resource_retrieve_update_destroy",
+            args=[self.dataset.id, "people", 1],
+        )
+        self.assertEqual(
+            self.client.get(detail_url).json(), {"id": 1, "name": "bob", "age": 2}
+        )
+        response = self.client.put(
+            detail_url, {"name": "bob", "age": 3}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.delete(detail_url).status_code, 204)
+        self.assertEqual(
+            self.records(), [{"name": "alice", "age": 10}, {"name": "carol", "age": 3}]
+        )
+        # the rows after the deleted one keep their id
+        carol_url = reverse(
+            "data_gateway:resource_retrieve_update_destroy",
+            args=[self.dataset.id, "people", 2],
+        )
+        self.assertEqual(
+            self.client.get(carol_url).json(), {"id": 2, "name": "carol", "age": 3}
+        )
+
+        missing_url = reverse(
+            "data_gateway:resource_retrieve_update_destroy",
+            args=[self.dataset.id, "people", 5],
+        )
+        self.assertEqual(self.client.get(missing_url).status_code, 404)
+
+    def test_gsheet_dataset_rejected(self):
+        dataset = create_people_dataset(self.app_inst, backend="gsheet")
+        url = reverse("data_gateway:resource_list_create", args=[dataset.id, "people"])
+        response = self.client.post(
+            url, {"name": "bob", "age": 2}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class DatasetExportTestCase(TestCase):
+    def setUp(self):
+        app_def = AppDefinition.objects.create(
+            name="test_app",
+            image_name="test_app",
+            image_tag="latest",
+            description="test app",
+        )
+        app_inst = AppInstance.objects.create(name="test_instance", app=app_def)
+        self.dataset = create_people_dataset(app_inst)
+        Resource.objects.bulk_create(
+            [
+                Resource(
+                    dataset=self.dataset,
+                    resource_type="people",
+                    value={"name": f"person {idx}", "age": idx},
+                )
+                for idx in range(3)
+            ]
+        )
+
+    def test_export_resource(self):
+        url = reverse("data_gateway:export_resource", args=[self.dataset.id, "people"])
+
+        response = self.client.get(url)
+        self.assertEqual(
+            b"".join(response.streaming_content).decode(),
+            "name,age\r\nperson 0,0\r\nperson 1,1\r\nperson 2,2\r\n",
+        )
+
+        response = self.client.get(url + "?format=ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[2]), {"name": "person 2", "age": 2})
+
+        response = self.client.get(url + "?format=xlsx")
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_dataset(self):
+        url = reverse("data_gateway:export_dataset", args=[self.dataset.id])
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/zip")
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["people.csv"])
+        self.assertTrue(archive.read("people.csv").startswith(b"name,age\r\n"))
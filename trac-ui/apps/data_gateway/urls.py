@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 
 from .data_gateway_views import *
 from .views import *
@@ -30,6 +30,16 @@ urlpatterns = [
     path(
         "datasets/<int:dataset_id>/spec.json", dataset_api_spec, name="dataset_api_spec"
     ),
+    path(
+        "datasets/<int:dataset_id>/export/",
+        export_dataset,
+        name="export_dataset",
+    ),
+    path(
+        "datasets/<int:dataset_id>/export/<str:resource_type>/",
+        export_resource,
+        name="export_resource",
+    ),
     path(
         "datasets/<int:dataset_id>/swagger-ui",
         dataset_api_swagger_ui,
@@ -40,6 +50,11 @@ urlpatterns = [
         ResourceListCreateView.as_view(),
         name="resource_list_create",
     ),
+    re_path(
+        r"^datasets/(?P<dataset_id>\d+)/api/(?P<resource_type>[^/]+)/_bulk/?$",
+        ResourceBulkView.as_view(),
+        name="resource_bulk",
+    ),
     path(
         "datasets/<int:dataset_id>/api/<str:resource_type>/<int:resource_id>/",
         ResourceDetailView.as_view(),
@@ -4,15 +4,17 @@ from typing import List
 
 from apps.trac_app.models import AppInstance
 from django.db import transaction
-from django.http import HttpResponse, JsonResponse
-from django.shortcuts import redirect, render
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from trac.schema.task import FileDef
 
+from .export import EXPORT_FORMATS, EXPORT_WRITERS, check_export_format, iter_zip
 from .forms import DatasetForm
-from .models import DataSet, Resource
+from .models import DataSet
 from .schema_utils import generate_openapi_schema_for_dataset
 from .services.gsheet import GoogleSheetsDataBackend
+from .storage import get_storage
 
 
 def create_dataset(request, instance_id):
@@ -112,32 +114,44 @@ def dataset_input_view(request, instance_id, dataset_id):
         return redirect(dataset.url)
 
     input_schema: List[FileDef] = dataset.schema["input_schema"]
+    storage = get_storage(dataset)
 
     workbook_data = []
+    id_columns = {}
     for resource_schema in input_schema:
         # resource_schema is a jsonschema that defines an object
         resource_name = resource_schema.name
         # header names
         field_names = list(resource_schema.file_schema["properties"].keys())
-        # data
-        resources = Resource.objects.filter(
-            dataset=dataset, resource_type=resource_name
-        ).all()
-
+        # the id of the resource behind each row is kept in a hidden column
+        # after the fields, so that it moves with the row when rows are
+        # inserted, deleted or sorted, and the client can send back only
+        # the rows it changed
+        id_column = len(field_names)
         celldata = []
         # header
-        for idx, name in enumerate(field_names):
+        for idx, name in enumerate([*field_names, "id"]):
             celldata.append({"r": 0, "c": idx, "v": name})
 
         # data
-        for idx, resource in enumerate(resources):
+        rows = storage.iter_rows(dataset, resource_name)
+        for idx, (resource_id, value) in enumerate(rows):
             for jdx, name in enumerate(field_names):
-                celldata.append({"r": idx + 1, "c": jdx, "v": resource.value.get(name)})
-
-        workbook_data.append({"name": resource_name, "celldata": celldata})
+                celldata.append({"r": idx + 1, "c": jdx, "v": value.get(name)})
+            celldata.append({"r": idx + 1, "c": id_column, "v": resource_id})
+
+        workbook_data.append(
+            {
+                "name": resource_name,
+                "celldata": celldata,
+                "config": {"colhidden": {str(id_column): 0}},
+            }
+        )
+        id_columns[resource_name] = id_column
 
     context = {
         "workbook_data": json.dumps(workbook_data),
+        "id_columns": json.dumps(id_columns),
         "instance_id": instance_id,
         "dataset_id": dataset_id,
     }
@@ -145,62 +159,154 @@ def dataset_input_view(request, instance_id, dataset_id):
     return render(request, "data_gateway/view_data.html", context=context)
 
 
+def _row_to_value(row, field_names):
+    """
+    Map a row of cell values to a resource value
+    """
+    resource_value = {}
+    for field_name, value in zip(field_names, row):
+        if value is None:
+            break
+        resource_value[field_name] = value
+    return resource_value
+
+
 def dataset_input_view_save(request, instance_id, dataset_id):
     """
-    Update or create a resource when request is PUT or POST
+    Apply the rows changed in the spreadsheet when request is POST
+
+    The payload is a list of sheets, each of the form
+    {"name": ..., "created": [row], "updated": [{"id": ..., "row": row}], "deleted": [id]}
+    where a row is the list of its cell values
     """
     # decide if the request is ajax
-    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        return HttpResponse(status=400, reason="Bad Request")
 
-        if request.method == "POST":
-            # get data schema
-            dataset = DataSet.objects.get(id=dataset_id)
-            input_schema = dataset.schema["input_schema"]
+    if request.method != "POST":
+        return HttpResponse(status=405, reason="Method Not Allowed")
 
-            payload = json.loads(request.POST["data"])
-            # TODO: validate the payload
-            resources_to_add = []
+    # get data schema
+    dataset = DataSet.objects.get(id=dataset_id)
+    input_schema = dataset.schema["input_schema"]
+
+    payload = json.loads(request.POST["data"])
+
+    storage = get_storage(dataset)
+
+    num_created = num_updated = num_deleted = 0
+    # start a transaction, the changes of all the sheets are applied or none
+    try:
+        with transaction.atomic():
             for sheet in payload:
                 sheet_name = sheet["name"]
                 # get the schema with title == sheet_name
                 resource_schema = next(
                     (x for x in input_schema if x.name == sheet_name), None
                 )
+                if resource_schema is None:
+                    raise KeyError(f"Unknown sheet {sheet_name}")
                 field_names = list(resource_schema.file_schema["properties"].keys())
-                cell_data = sheet["data"]
-                # drop the first row
-                cell_data = cell_data[1:]
-
-                for idx, row in enumerate(cell_data):
-                    resource_value = {}
-                    for jidx, cell in enumerate(row):
-                        if not cell:
-                            break
-                        field_name = field_names[jidx]
-                        value = cell["v"]
-                        resource_value[field_name] = value
-
-                    # construct a resource
-                    resource = Resource(
-                        dataset=dataset, resource_type=sheet_name, value=resource_value
-                    )
-
-                    resources_to_add.append(resource)
-
-            # start a transaction
-            with transaction.atomic():
-                # TODO: this is very inefficient
-                # delete all the resources
-                Resource.objects.filter(dataset=dataset).delete()
-                # add all the resources
-                Resource.objects.bulk_create(resources_to_add)
-            # get the number of resources impacted
-            num_resources = len(resources_to_add)
-
-            return HttpResponse("OK. {} resources added".format(num_resources))
 
-    else:
-        return HttpResponse(status=400, reason="Bad Request")
+                created, updated, deleted = storage.apply_changes(
+                    dataset,
+                    sheet_name,
+                    created=[
+                        _row_to_value(row, field_names)
+                        for row in sheet.get("created", [])
+                    ],
+                    updated={
+                        change["id"]: _row_to_value(change["row"], field_names)
+                        for change in sheet.get("updated", [])
+                    },
+                    deleted=sheet.get("deleted", []),
+                )
+
+                num_created += created
+                num_updated += updated
+                num_deleted += deleted
+    except (KeyError, ValueError) as e:
+        return HttpResponse(status=400, reason=str(e).strip("'"))
+
+    return HttpResponse(
+        "OK. {} resources added, {} updated, {} deleted".format(
+            num_created, num_updated, num_deleted
+        )
+    )
+
+
+def _export_file_defs(dataset: DataSet) -> List[FileDef]:
+    """
+    The sheets of a dataset, input ones first
+    """
+    file_defs = {}
+    for file_def in (
+        *dataset.schema["input_schema"],
+        *dataset.schema.get("output_schema", ()),
+    ):
+        file_defs.setdefault(file_def.name, file_def)
+    return list(file_defs.values())
+
+
+def export_resource(request, dataset_id, resource_type):
+    """
+    Stream the records of a sheet as a file
+    The format is given by the `format` query parameter: csv (default), ndjson or parquet
+    """
+    dataset = get_object_or_404(DataSet, id=dataset_id)
+    export_format = request.GET.get("format", "csv")
+
+    file_def = next(
+        (x for x in _export_file_defs(dataset) if x.name == resource_type), None
+    )
+    if file_def is None:
+        raise Http404(f"Resource type {resource_type} not found")
+
+    try:
+        check_export_format(export_format)
+        storage = get_storage(dataset)
+    except Exception as e:
+        return HttpResponse(status=400, reason=str(e))
+
+    extension, content_type = EXPORT_FORMATS[export_format]
+    records = storage.iter_records(dataset, resource_type)
+    response = StreamingHttpResponse(
+        EXPORT_WRITERS[export_format](file_def, records), content_type=content_type
+    )
+    response[
+        "Content-Disposition"
+    ] = f'attachment; filename="{resource_type}.{extension}"'
+    return response
+
+
+def export_dataset(request, dataset_id):
+    """
+    Stream all the sheets of a dataset as a zip of files
+    The format is given by the `format` query parameter: csv (default), ndjson or parquet
+    """
+    dataset = get_object_or_404(DataSet, id=dataset_id)
+    export_format = request.GET.get("format", "csv")
+
+    try:
+        check_export_format(export_format)
+        storage = get_storage(dataset)
+    except Exception as e:
+        return HttpResponse(status=400, reason=str(e))
+
+    extension, _ = EXPORT_FORMATS[export_format]
+    writer = EXPORT_WRITERS[export_format]
+    # the members are generated lazily, one sheet at a time
+    members = (
+        (
+            f"{file_def.name}.{extension}",
+            writer(file_def, storage.iter_records(dataset, file_def.name)),
+        )
+        for file_def in _export_file_defs(dataset)
+    )
+
+    response = StreamingHttpResponse(iter_zip(members), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{dataset.name}.zip"'
+    return response
 
 
 def dataset_api_spec(request, dataset_id):
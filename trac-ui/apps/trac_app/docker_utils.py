@@ -1,22 +1,20 @@
 # utils functions to run docker containers locally
 
-import json
 from functools import lru_cache
 from typing import List, Union
 
 import docker
+from pydantic import ValidationError
+from trac.runtime.session import get_session
+from trac.runtime.spec import get_image, read_app_spec
 from trac.schema.task import FILE_TYPE, AppDef, FileDef, ParameterDef, TaskDef
 
 
 class DockerUtils:
-
-    _client = None
-
     @classmethod
     def get_client(cls):
-        if cls._client is None:
-            cls._client = docker.from_env()
-        return cls._client
+        # share the docker client pooled by the trac runtime
+        return get_session("docker").client
 
     @classmethod
     @lru_cache(maxsize=128)
@@ -41,68 +39,54 @@ class DockerUtils:
         return True
 
     @classmethod
-    @lru_cache
+    @lru_cache(maxsize=128)
+    def _app_spec(cls, digest, image_name, image_tag) -> AppDef:
+        """
+        Return the parsed spec of the image with the given digest
+        """
+        # the spec is read from the on-disk spec cache shared with the ADK,
+        # a container is only started when the image digest is not cached yet
+        try:
+            return AppDef.parse_obj(
+                read_app_spec(image_name, image_tag, client=cls.get_client())
+            )
+        except ValidationError:
+            raise Exception("The app spec is not valid")
+
+    @classmethod
     def spec(cls, image_name, image_tag, task_name=None) -> Union[TaskDef, AppDef]:
         """
         Return the spec of the app
         """
-        client = cls.get_client()
-        image_name = image_name + ":" + image_tag
-
-        # create a container and run it with command "-- spec"
-        # get the output and return it
+        # the tag is resolved to its image digest on every call, so that a
+        # re-pushed tag is picked up, only the parsed spec is cached by digest
+        digest = get_image(cls.get_client(), image_name, image_tag).id
+        spec = cls._app_spec(digest, image_name, image_tag)
 
         if not task_name:
-            command = "-- spec"
-        else:
-            command = f"-- spec --task-name {task_name}"
-
-        logs = client.containers.run(
-            image_name,
-            command=command,
-            auto_remove=True,
+            return spec
+
+        # find the task with the given name, the same way the launcher does
+        for task in spec.tasks:
+            if (
+                task.name.lower() == task_name.lower()
+                or task.name.replace(" ", "_").lower() == task_name
+            ):
+                return task
+
+        available_task_names = [task.name for task in spec.tasks]
+        raise Exception(
+            f"Task {task_name} not found. Available tasks: {available_task_names}"
         )
 
-        # get the output
-        output = logs.decode("utf-8")
-
-        try:
-            spec = json.loads(output)
-        except json.decoder.JSONDecodeError as ex:
-            raise Exception("The app spec is not valid")
-
-        if not task_name:
-            return AppDef.parse_obj(spec)
-        else:
-            return TaskDef.parse_obj(spec)
-
     @classmethod
-    @lru_cache
     def tasks(cls, image_name, image_tag) -> List[str]:
         """
         Return the tasks of the app
         """
-        client = cls.get_client()
-        image_name = image_name + ":" + image_tag
-
-        # create a container and run it with command "-- tasks"
-        # get the output and return it
-
-        logs = client.containers.run(
-            image_name,
-            command="-- tasks",
-            auto_remove=True,
-        )
-
-        # get the output
-        output = logs.decode("utf-8")
-
-        # each line is a task
-        tasks = output.splitlines()
-        return tasks
+        return [task.name for task in cls.spec(image_name, image_tag).tasks]
 
     @classmethod
-    @lru_cache
     def input_schema(cls, image_name, image_tag, task_name) -> List[FileDef]:
         """
         Return the input schema of a task
@@ -113,7 +97,6 @@ class DockerUtils:
         return [f for f in spec.io.files if f.type == FILE_TYPE.INPUT]
 
     @classmethod
-    @lru_cache
     def output_schema(cls, image_name, image_tag, task_name) -> List[FileDef]:
         """
         Return the output schema of a task
@@ -124,7 +107,6 @@ class DockerUtils:
         return [f for f in spec.io.files if f.type == FILE_TYPE.OUTPUT]
 
     @classmethod
-    @lru_cache
     def parameter_schema(cls, image_name, image_tag, task_name) -> List[ParameterDef]:
         """
         Return the parameter schema of a task
@@ -1,4 +1,4 @@
-from functools import cached_property, lru_cache
+from functools import cached_property
 
 from django.db import models
 
@@ -33,7 +33,6 @@ class AppDefinition(models.Model):
         """
         return DockerUtils.tasks(self.image_name, self.image_tag)
 
-    @lru_cache
     def task_spec(self, task_name=None):
         """
         Return the spec of a task
@@ -42,7 +41,6 @@ class AppDefinition(models.Model):
         task_name = task_name or self.default_task
         return DockerUtils.spec(self.image_name, self.image_tag, task_name)
 
-    @lru_cache
     def input_schema(self, task_name=None):
         """
         Return the input schema of the app
@@ -53,7 +51,6 @@ class AppDefinition(models.Model):
             self.image_name, self.image_tag, task_name=task_name
         )
 
-    @lru_cache
     def output_schema(self, task_name=None):
         """
         Return the output schema of the app
@@ -65,7 +62,6 @@ class AppDefinition(models.Model):
             self.image_name, self.image_tag, task_name=task_name
         )
 
-    @lru_cache
     def parameter_schema(self, task_name=None):
         """
         Return the parameter schema of the app
@@ -57,7 +57,7 @@ def dashboard(request, instance_id):
     app = AppInstance.objects.get(id=instance_id)
 
     # all runs belong to this instance
-    runs = app.runs.all()
+    runs = app.runs.select_related("batch").all()
 
     datasets = app.datasets.all()
 
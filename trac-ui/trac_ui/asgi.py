@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "trac_ui.settings")
 
 application = get_asgi_application()
+
+# the models can only be imported once the application is set up
+from apps.app_run.jobs import JobManager  # noqa: E402
+
+JobManager.start()
@@ -140,6 +140,44 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 50
 }
+# upper bound of the `limit` of the dataset resource api
+TRAC_API_MAX_PAGE_SIZE = 10000
+# number of resources validated and written at a time by the bulk api
+TRAC_BULK_CHUNK_SIZE = 1000
+
+
+# background job manager for app runs, started with each web server process
+# number of worker threads per process, set to 0 to only queue runs in the web
+# processes and execute them with `python manage.py run_jobs`
+TRAC_JOB_WORKERS = 4
+# seconds between checks of the run queue in the database
+TRAC_JOB_POLL_INTERVAL = 5
+# seconds before a run is considered failed, None to wait forever
+TRAC_JOB_TIMEOUT = None
+# seconds without a heartbeat of its worker before a RUNNING run is recovered,
+# the workers renew their runs every TRAC_JOB_POLL_INTERVAL seconds
+TRAC_JOB_LEASE = 60
+# limits of the scheduler admitting the jobs of the workers of a process, as
+# the kwargs of trac.runtime.scheduler.JobScheduler, e.g.,
+# {"backend_limits": {"docker": {"max_jobs": 8, "cpu": 16, "memory": "64Gi"}},
+#  "default_app_limit": 4, "policy": "fair"}
+# the limits apply to each process separately, so the jobs of the web server
+# processes and of every `run_jobs` worker add up on the backend
+TRAC_SCHEDULER = {}
+
+# storage of the datasets with the columnar backend
+# number of rows per stored chunk of a sheet
+TRAC_COLUMNAR_CHUNK_ROWS = 10000
+# number of threads writing the input files of a run, one per sheet
+TRAC_MATERIALIZE_WORKERS = 4
+# cache of the input files of the runs, reused while a dataset is unchanged
+# None to use a trac-inputs directory under the system temp dir
+TRAC_INPUT_CACHE_DIR = None
+# size budget of the cache, least recently used inputs are evicted beyond it,
+# except the inputs of the runs and batches that are not finished
+TRAC_INPUT_CACHE_MAX_BYTES = 10 * 1024**3
+# check the input files against the file schemas of the app before a run
+TRAC_VALIDATE_INPUTS = True
 
 
 # logging format for console